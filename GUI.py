@@ -1,16 +1,59 @@
 import sys
+import threading
+import time
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QPushButton, QFileDialog, QTextEdit, QLabel
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QLabel,
+    QProgressBar, QTableView, QHeaderView
 )
 from PyQt5.QtGui import QFont, QColor, QPalette
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QThread, QMetaObject, pyqtSignal, pyqtSlot
 
 from canWithIsoTpSender import *
+from firmware_stream import FirmwareImage
+from hex_viewer import HexTableModel, image_crc32
+from image_loader import SparseImage, image_format, load_image
+
+file_filters = ("Firmware images (*.hex *.ihex *.ihx *.s19 *.s28 *.s37 *.srec *.mot *.elf *.axf *.bin);;"
+                "Intel HEX (*.hex *.ihex *.ihx);;Motorola S-record (*.s19 *.s28 *.s37 *.srec *.mot);;"
+                "ELF (*.elf *.axf);;All Files (*)")
+
+
+class TransferWorker(QObject):
+    # Runs canTpSendFile on a QThread so the event loop stays responsive
+    progress = pyqtSignal(int, int, float, float)  # bytes sent, total bytes, bytes/s, ETA (s)
+    finished = pyqtSignal(bool)  # True when the whole file was sent
+
+    def __init__(self, file_name):
+        super().__init__()
+        self.file_name = file_name
+        self.cancel_event = threading.Event()
+        self.start_time = None
+
+    @pyqtSlot()
+    def run(self):
+        self.start_time = time.monotonic()
+        sent = canTpSendFile(self.file_name, progress_callback=self.report_progress,
+                             cancel_event=self.cancel_event)
+        self.finished.emit(sent)
+
+    def report_progress(self, bytes_sent, total_bytes):
+        elapsed = time.monotonic() - self.start_time
+        throughput = bytes_sent / elapsed if elapsed > 0 else 0.0
+        eta = (total_bytes - bytes_sent) / throughput if throughput > 0 else 0.0
+        self.progress.emit(bytes_sent, total_bytes, throughput, eta)
+
+    def cancel(self):
+        self.cancel_event.set()
 
 class FileBrowserApp(QWidget):
+    image_ready = pyqtSignal(object, object, object)  # Request token, image (or the error), CRC32
+
     def __init__(self):
         super().__init__()
-        self.byte_array = None  # Variable to store the byte array
+        self.file_name = None  # Path of the last file sent
+        self.image = None  # FirmwareImage or SparseImage shown in the hex view
+        self.image_request = None  # Token of the file being shown, see show_image
+        self.transfer_worker = None  # Worker of the running transfer, if any
         self.init_ui()
 
     def init_ui(self):
@@ -28,13 +71,25 @@ class FileBrowserApp(QWidget):
         self.label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.label)
 
-        # Text area to show file content as byte array
-        self.text_area = QTextEdit()
-        self.text_area.setReadOnly(True)
-        self.text_area.setFont(QFont("Courier New", 12))
-        self.text_area.setStyleSheet(
+        # Summary of the selected file: size, CRC and block count
+        self.summary_label = QLabel("No file selected")
+        self.summary_label.setFont(QFont("Courier New", 12))
+        layout.addWidget(self.summary_label)
+        self.image_ready.connect(self.show_loaded_image)
+
+        # Hex view of the file content, only visible rows are formatted
+        self.hex_model = HexTableModel()
+        self.hex_view = QTableView()
+        self.hex_view.setModel(self.hex_model)
+        self.hex_view.setFont(QFont("Courier New", 12))
+        self.hex_view.setStyleSheet(
             "background-color: #f0f0f0; border: 1px solid #ccc;")
-        layout.addWidget(self.text_area)
+        self.hex_view.verticalHeader().setVisible(False)
+        # Fixed row height so Qt never measures rows it does not display
+        self.hex_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.hex_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.hex_view.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.hex_view)
 
         # Button to browse files
         self.browse_button = QPushButton("Browse File")
@@ -44,7 +99,31 @@ class FileBrowserApp(QWidget):
         )
         self.browse_button.setCursor(Qt.PointingHandCursor)
         self.browse_button.clicked.connect(self.open_file_browser)
-        layout.addWidget(self.browse_button)
+
+        # Transfers run on this thread, one worker at a time
+        self.transfer_thread = QThread(self)
+        self.transfer_thread.start()
+
+        # Transfer progress, throughput/ETA and cancel button
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.status_label = QLabel("Idle")
+        self.status_label.setFont(QFont("Arial", 12))
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setFont(QFont("Arial", 14, QFont.Bold))
+        self.cancel_button.setStyleSheet(
+            "background-color: #f44336; color: white; padding: 10px; border-radius: 5px; border: none;"
+        )
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_transfer)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.browse_button)
+        button_layout.addWidget(self.cancel_button)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        layout.addLayout(button_layout)
 
         # Set layout
         self.setLayout(layout)
@@ -60,29 +139,109 @@ class FileBrowserApp(QWidget):
     def open_file_browser(self):
         # Open file dialog to select a file
         file_name, _ = QFileDialog.getOpenFileName(
-            self, "Open File", "", "All Files (*)"
+            self, "Open File", "", file_filters
         )
 
         if file_name:
+            self.file_name = file_name
             try:
-                # Read file content as byte array
-                with open(file_name, "rb") as file:
-                    self.byte_array = file.read()
-
-                # Convert byte array to list of integers
-                byte_list = list(self.byte_array)
-
-                canTpSend(byte_list)
-
-                # Display byte content and list of integers in the text area
-                display_text = (
-                    f"Byte Array:\n{self.byte_array}\n\n"
-                    f"Byte List (as integers):\n{byte_list}"
-                )
-                self.text_area.setText(display_text)
-            except Exception as e:
-                self.text_area.setText(f"Error reading file: {e}")
+                self.show_image(file_name)
+            except OSError as e:
+                self.status_label.setText(f"Error reading file: {e}")
+                return
+            self.start_transfer(file_name)
+
+    def show_image(self, file_name):
+        # A flat file is shown as it is; a HEX, S-record or ELF file as the
+        # segments that get flashed, at their addresses, once it is parsed
+        self.close_image()
+        request = self.image_request = object()  # Results for an earlier file are dropped
+        if image_format(file_name) is None:
+            self.image = FirmwareImage(file_name).open()
+            self.hex_model.set_image(self.image)
+            self.summary_label.setText(self.summary_text(file_name, self.image, "computing..."))
+        else:
+            self.summary_label.setText(f"File: {file_name}\nLoading segments...")
+        # The CRC needs a full pass over the image and a sparse image has to be
+        # parsed (cached for the transfer), keep both off the UI thread
+        threading.Thread(target=self.prepare_image, args=(request, file_name, self.image), daemon=True).start()
+
+    def prepare_image(self, request, file_name, image):
+        try:
+            if image is None:
+                image = load_image(file_name)
+            self.image_ready.emit(request, image, image_crc32(image))
+        except (OSError, ValueError) as e:
+            self.image_ready.emit(request, e, None)
+
+    def show_loaded_image(self, request, image, crc):
+        if request is not self.image_request:
+            return
+        if isinstance(image, Exception):
+            self.summary_label.setText(f"File: {self.file_name}\nNot readable: {image}")
+            return
+        if image is not self.image:
+            self.image = image
+            self.hex_model.set_image(image)
+        self.summary_label.setText(self.summary_text(self.file_name, image, f"{crc:08X}"))
+
+    def summary_text(self, file_name, image, crc):
+        if isinstance(image, SparseImage):
+            layout = f"Segments: {len(image)} in a {image.span} byte span"
+        else:
+            layout = f"Blocks: {image.block_count} x {image.block_size} bytes"
+        return f"File: {file_name}\nSize: {image.size} bytes  |  CRC32: {crc}  |  {layout}"
+
+    def close_image(self):
+        self.hex_model.set_image(None)
+        if isinstance(self.image, FirmwareImage):
+            self.image.close()
+        self.image = None
+
+    def start_transfer(self, file_name):
+        # Stream the file from the transfer thread, the UI only receives signals
+        self.transfer_worker = TransferWorker(file_name)
+        self.transfer_worker.moveToThread(self.transfer_thread)
+        self.transfer_worker.progress.connect(self.show_progress)
+        self.transfer_worker.finished.connect(self.transfer_finished)
+
+        self.browse_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.status_label.setText("Sending...")
+        QMetaObject.invokeMethod(self.transfer_worker, "run", Qt.QueuedConnection)
+
+    def cancel_transfer(self):
+        if self.transfer_worker is not None:
+            self.transfer_worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_label.setText("Cancelling...")
+
+    def show_progress(self, bytes_sent, total_bytes, throughput, eta):
+        percent = 100 * bytes_sent // total_bytes if total_bytes else 100
+        self.progress_bar.setValue(percent)
+        self.status_label.setText(
+            f"Sent {bytes_sent} of {total_bytes} bytes ({percent}%) - "
+            f"{throughput / 1024:.1f} KiB/s - ETA {eta:.0f} s"
+        )
 
+    def transfer_finished(self, sent):
+        cancelled = self.transfer_worker.cancel_event.is_set()
+        status = "completed" if sent else ("cancelled" if cancelled else "failed")
+        self.status_label.setText(f"Transfer {status}.")
+        self.browse_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.transfer_worker.deleteLater()
+        self.transfer_worker = None
+
+    def closeEvent(self, event):
+        # Stop a running transfer before the window goes away
+        if self.transfer_worker is not None:
+            self.transfer_worker.cancel()
+        self.transfer_thread.quit()
+        self.transfer_thread.wait()
+        self.close_image()
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,173 @@
+import asyncio
+import collections
+
+import can
+import isotp
+
+# asyncio transport for ISO-TP and UDS: one event loop drives any number of
+# ISO-TP sessions. A can.Notifier feeds an AsyncBufferedReader, a single
+# router task hands every frame to the session owning its arbitration id,
+# and each session runs isotp's state machine (TransportLayerLogic) from a
+# task that sleeps until a frame arrives, a send is queued or a timer runs out.
+
+response_pending_nrc = 0x78
+
+
+class AsyncCanRouter:
+    def __init__(self, bus: can.BusABC, loop=None):
+        self.bus = bus
+        self.loop = loop or asyncio.get_running_loop()
+        self.sessions = {}
+        self.reader = can.AsyncBufferedReader()
+        self.notifier = can.Notifier(bus, [self.reader], loop=self.loop)
+        self._task = self.loop.create_task(self._route())
+
+    async def _route(self):
+        async for msg in self.reader:
+            session = self.sessions.get(msg.arbitration_id)
+            if session is not None:
+                session.feed(msg)
+
+    def open_session(self, txid, rxid, params=None, addressing_mode=isotp.AddressingMode.Normal_11bits):
+        session = AsyncIsoTpSession(self, isotp.Address(addressing_mode, txid=txid, rxid=rxid), params)
+        self.sessions[rxid] = session
+        return session
+
+    def close_session(self, session):
+        self.sessions.pop(session.address.get_rx_arbitration_id(), None)
+        session.close()
+
+    async def close(self):
+        for session in list(self.sessions.values()):
+            self.close_session(session)
+        self.notifier.stop()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class AsyncIsoTpSession:
+    def __init__(self, router, address, params=None):
+        self.router = router
+        self.address = address
+        self._frames = collections.deque()
+        self._received = asyncio.Queue()
+        self._pending_sends = []  # (isotp SendRequest, future)
+        self._wakeup = asyncio.Event()
+        # rxfn without argument: isotp treats it as non-blocking
+        self.logic = isotp.TransportLayerLogic(rxfn=self._rxfn, txfn=self._txfn, address=address,
+                                               params=params, post_send_callback=self._on_send_request)
+        self._task = router.loop.create_task(self._run())
+
+    def _rxfn(self):
+        if not self._frames:
+            return None
+        msg = self._frames.popleft()
+        return isotp.CanMessage(arbitration_id=msg.arbitration_id, data=msg.data,
+                                extended_id=msg.is_extended_id, is_fd=msg.is_fd,
+                                bitrate_switch=msg.bitrate_switch)
+
+    def _txfn(self, isotp_msg):
+        self.router.bus.send(can.Message(arbitration_id=isotp_msg.arbitration_id, data=isotp_msg.data,
+                                         is_extended_id=isotp_msg.is_extended_id, is_fd=isotp_msg.is_fd,
+                                         bitrate_switch=isotp_msg.bitrate_switch))
+
+    def _on_send_request(self, send_request):
+        self._pending_sends.append((send_request, self.router.loop.create_future()))
+
+    def feed(self, msg):
+        # Called by the router for every frame addressed to this session
+        self._frames.append(msg)
+        self._wakeup.set()
+
+    def _next_timeout(self):
+        # None: nothing in progress, sleep until woken up
+        if self.logic.is_tx_transmitting_cf() and not self.logic.is_rx_active():
+            return self.logic.next_cf_delay()
+        if self.logic.transmitting() or self.logic.is_rx_active():
+            return self.logic.sleep_time()  # Poll the flow control / consecutive frame timers
+        return None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self.logic.process()
+            while self.logic.available():
+                self._received.put_nowait(bytes(self.logic.recv()))
+            if self._pending_sends:
+                still_pending = []
+                for send_request, future in self._pending_sends:
+                    if send_request.complete_event.is_set():
+                        if not future.done():
+                            future.set_result(send_request.success)
+                    else:
+                        still_pending.append((send_request, future))
+                self._pending_sends = still_pending
+
+            timeout = self._next_timeout()
+            if timeout == 0:
+                await asyncio.sleep(0)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def send(self, data, timeout=None) -> bool:
+        # Returns once the whole payload is on the bus, False if isotp gave up
+        self.logic.send(data)
+        send_request, future = self._pending_sends[-1]
+        self._wakeup.set()
+        return await asyncio.wait_for(future, timeout)
+
+    async def recv(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._received.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self._task.cancel()
+        for _, future in self._pending_sends:
+            if not future.done():
+                future.cancel()
+
+
+class AsyncUdsClient:
+    # Minimal UDS client on top of an AsyncIsoTpSession
+    def __init__(self, session, timeout=1.0, pending_timeout=5.0):
+        self.session = session
+        self.timeout = timeout
+        self.pending_timeout = pending_timeout
+
+    async def request(self, payload: bytes):
+        if not await self.session.send(payload):
+            raise IOError("ISO-TP transmission of the request failed")
+        timeout = self.timeout
+        while True:
+            response = await self.session.recv(timeout)
+            if response is None:
+                raise TimeoutError(f"No response to service 0x{payload[0]:02X}")
+            if len(response) == 3 and response[0] == 0x7F and response[2] == response_pending_nrc:
+                timeout = self.pending_timeout  # requestCorrectlyReceived-ResponsePending
+                continue
+            return response
+
+    async def read_data_by_identifier(self, did: int) -> bytes:
+        response = await self.request(bytes((0x22, did >> 8, did & 0xFF)))
+        if response[0] != 0x62 or response[1:3] != bytes((did >> 8, did & 0xFF)):
+            raise ValueError(f"Negative or unexpected response: {response.hex()}")
+        return bytes(response[3:])
+
+
+async def serve_uds(session, handle_request):
+    # Server loop answering requests with handle_request(request) -> response
+    while True:
+        request = await session.recv()
+        if request is None:
+            continue
+        response = handle_request(request)
+        if response is not None:
+            await session.send(response)
@@ -0,0 +1,2 @@
+# Benchmarks run against python-can's virtual interface, e.g.
+#   python -m benchmarks.uds_flash --size 1048576
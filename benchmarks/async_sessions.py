@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import logging
+import time
+
+import can
+import isotp
+
+import uds_server
+from async_transport import AsyncCanRouter, AsyncUdsClient, serve_uds
+from isotp_profiles import load_profiles
+
+# Runs many concurrent UDS sessions on one event loop over the virtual bus
+# and reports how many sessions one core sustains, e.g.
+#   python -m benchmarks.async_sessions --sessions 200 --requests 50
+
+vin_did = 0xF190
+
+
+async def run(sessions, requests, params, channel="async_bench"):
+    loop = asyncio.get_running_loop()
+    client_router = AsyncCanRouter(can.Bus(interface="virtual", channel=channel), loop)
+    server_router = AsyncCanRouter(can.Bus(interface="virtual", channel=channel), loop)
+    mode = isotp.AddressingMode.Normal_29bits  # Room for more than a few hundred id pairs
+    servers = []
+    clients = []
+    for index in range(sessions):
+        request_id, response_id = 0x18DA0000 + index, 0x18DB0000 + index
+        server_session = server_router.open_session(response_id, request_id, params, mode)
+        ecu = uds_server.EcuState(f"ECU{index}", response_id, request_id)  # One emulated ECU per session
+        servers.append(loop.create_task(serve_uds(server_session, ecu.handle_request)))
+        clients.append(AsyncUdsClient(client_router.open_session(request_id, response_id, params, mode)))
+
+    latencies = []
+
+    async def client_loop(client):
+        for _ in range(requests):
+            start = time.perf_counter()
+            await client.read_data_by_identifier(vin_did)
+            latencies.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(client_loop(client) for client in clients))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    for task in servers:
+        task.cancel()
+    await client_router.close()
+    await server_router.close()
+    client_router.bus.shutdown()
+    server_router.bus.shutdown()
+    latencies.sort()
+    return wall, cpu, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent asyncio UDS sessions on the virtual bus")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=20, help="requests per session")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests/s a single session needs")
+    parser.add_argument("--profile", default="classic_fast")
+    args = parser.parse_args()
+    logging.getLogger("GeneralLogger").setLevel(logging.WARNING)  # The server logs every request
+
+    params = load_profiles()["profiles"][args.profile]
+    wall, cpu, latencies = asyncio.run(run(args.sessions, args.requests, params))
+    total = args.sessions * args.requests
+    requests_per_cpu_second = total / cpu
+    print(f"{args.sessions} sessions x {args.requests} requests: {total / wall:.0f} req/s "
+          f"(wall {wall:.2f} s, cpu {cpu:.2f} s, client and server on one loop)")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    print(f"~{requests_per_cpu_second / args.rate:.0f} sessions per core at {args.rate:g} req/s each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import glob
+import os
+import sysconfig
+
+import uds_server
+from benchmarks import fd_vs_classic, uds_flash
+from isotp_profiles import load_profiles
+
+# Uncompressed versus compressed transfers of a firmware-like image (native
+# code taken from the interpreter's extension modules), for both the block
+# transfer and the UDS download, e.g.
+#   python -m benchmarks.compressed_transfer --size 262144 --methods zlib lzma
+
+default_profile = "classic_fast"
+
+
+def firmware_like(size) -> bytes:
+    # Machine code compresses like a real ECU image, random bytes do not
+    image = bytearray()
+    for file_name in sorted(glob.glob(os.path.join(sysconfig.get_paths()["platstdlib"], "lib-dynload", "*.so"))):
+        with open(file_name, "rb") as file:
+            image += file.read(size - len(image))
+        if len(image) >= size:
+            break
+    return bytes(image).ljust(size, b"\xFF")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed transfers on the virtual bus")
+    parser.add_argument("--size", type=int, default=256 * 1024, help="image size in bytes")
+    parser.add_argument("--methods", nargs="+", default=["zlib", "lzma"], help="compression methods to compare")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5
+
+    params = load_profiles()["profiles"][args.profile]
+    payload = firmware_like(args.size)
+    for path, run in (("isotp", fd_vs_classic.isotp_transfer), ("uds", uds_flash.run)):
+        baseline = None
+        for method in [None] + args.methods:
+            ok, elapsed = run(args.size, params, payload=payload, compression=method)
+            baseline = baseline or elapsed
+            print(f"{path:>5} {method or 'none':>5}: {'OK' if ok else 'FAILED'} {elapsed:6.3f} s "
+                  f"{args.size / elapsed / 1024:8.1f} KiB/s ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import can
+from udsoncan.client import Client
+
+import delta_flash
+import uds_client
+import uds_server
+from isotp_profiles import load_profiles
+
+# Full flash versus delta flash of a new build where a few blocks changed:
+#   python -m benchmarks.delta_flash --size 1048576 --changed 3
+
+default_profile = "classic_fast"
+
+
+def run(size, changed_blocks, isotp_params, channel="delta_flash_bench"):
+    # Returns (ok, full flash seconds, delta flash seconds, bytes sent by the delta)
+    with tempfile.TemporaryDirectory() as directory:
+        old_file = os.path.join(directory, "old.bin")
+        new_file = os.path.join(directory, "new.bin")
+        old_image = os.urandom(size)
+        new_image = bytearray(old_image)
+        step = size // changed_blocks
+        for number in range(changed_blocks):
+            new_image[number * step:number * step + 100] = os.urandom(100)  # e.g. patched functions
+        new_image += os.urandom(1000)  # The new build is a little longer
+        with open(old_file, "wb") as file:
+            file.write(old_image)
+        with open(new_file, "wb") as file:
+            file.write(new_image)
+
+        server_bus = can.Bus(interface="virtual", channel=channel)
+        client_bus = can.Bus(interface="virtual", channel=channel)
+        stop_event = threading.Event()
+        server_connection = uds_server.create_uds_connection(server_bus, isotp_params)
+        server_connection.open()
+        server_thread = threading.Thread(target=uds_server.serve, args=(server_connection, stop_event), daemon=True)
+        server_thread.start()
+        sent = []
+        try:
+            client_connection = uds_client.create_uds_connection(client_bus, isotp_params)
+            with Client(client_connection, config=uds_client.client_config) as client:
+                start = time.perf_counter()
+                ok = uds_client.flash_image(client, old_file)
+                full = time.perf_counter() - start
+                start = time.perf_counter()
+                ok = ok and delta_flash.flash_delta(client, new_file, old_file,
+                                                    progress_callback=lambda done, total: sent.append(total))
+                delta = time.perf_counter() - start
+            ok = ok and uds_server.default_ecu.flash_memory == new_image
+        finally:
+            stop_event.set()
+            server_thread.join()
+            server_connection.close()
+            server_bus.shutdown()
+            client_bus.shutdown()
+    return ok, full, delta, sent[-1] if sent else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full versus delta flash on the virtual bus")
+    parser.add_argument("--size", type=int, default=512 * 1024, help="image size in bytes")
+    parser.add_argument("--changed", type=int, default=3, help="number of patched places in the new image")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5  # Let the server notice stop_event quickly
+    ok, full, delta, sent = run(args.size, args.changed, load_profiles()["profiles"][args.profile])
+    print(f"{'OK' if ok else 'FAILED'}: full flash {args.size} bytes in {full:.3f} s, "
+          f"delta flash {sent} bytes in {delta:.3f} s ({full / delta:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import os
+import random
+import time
+
+import uds_server
+from did_store import DidStore
+
+# ReadDataByIdentifier requests/s served by one emulated ECU, without the
+# bus, for single and multi DID requests, e.g.
+#   python -m benchmarks.did_reads --dids 5000 --per-request 8
+
+
+def make_store(count, max_length):
+    rng = random.Random(0)
+    dids = rng.sample(range(0x0100, 0xFF00), count)
+    return DidStore({did: os.urandom(rng.randint(1, max_length)) for did in dids})
+
+
+def make_requests(store, count, per_request):
+    rng = random.Random(1)
+    requests = []
+    for _ in range(count):
+        request = bytearray(b'\x22')
+        for did in rng.sample(list(store.dids), per_request):
+            request += did.to_bytes(2, 'big')
+        requests.append(bytes(request))
+    return requests
+
+
+def requests_per_second(handle, requests, duration):
+    served = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for request in requests:
+            handle(request)
+        served += len(requests)
+    return served / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DID read throughput of the UDS server")
+    parser.add_argument("--dids", type=int, default=5000, help="number of DIDs in the store")
+    parser.add_argument("--max-length", type=int, default=32, help="largest DID value in bytes")
+    parser.add_argument("--per-request", type=int, default=8, help="DIDs per multi DID request")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds per measurement")
+    args = parser.parse_args()
+    logging.getLogger("GeneralLogger").setLevel(logging.WARNING)
+
+    store = make_store(args.dids, args.max_length)
+    ecu = uds_server.EcuState(dids=store)
+    for per_request in (1, args.per_request):
+        requests = make_requests(store, 1000, per_request)
+        rate = requests_per_second(ecu.handle_request, requests, args.duration)
+        print(f"{per_request} DID(s) per request: {rate:,.0f} req/s ({rate * per_request:,.0f} DIDs/s)")
+
+    first, last = store.dids[len(store) // 4], store.dids[len(store) // 4 + 63]
+    start = time.perf_counter()
+    rounds = 100000
+    for _ in range(rounds):
+        store.range_records(first, last)
+    elapsed = time.perf_counter() - start
+    print(f"range query over 64 DIDs: {elapsed / rounds * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
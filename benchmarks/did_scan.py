@@ -0,0 +1,70 @@
+import argparse
+import logging
+import threading
+import time
+
+import can
+from udsoncan.client import Client
+
+import uds_client
+import uds_server
+from did_store import DidStore
+from isotp_profiles import load_profiles
+
+# Full DID scan against the simulated ECU on the virtual bus: one DID per
+# request through udsoncan against uds_client.read_all_dids, e.g.
+#   python -m benchmarks.did_scan --dids 500
+
+default_profile = "classic_fast"
+first_did = 0x1000
+
+
+def run(did_count, isotp_params, channel="did_scan_bench"):
+    dids = list(range(first_did, first_did + did_count))
+    ecu = uds_server.EcuState(dids=DidStore({did: did.to_bytes(4, 'big') for did in dids}))
+    for did in dids:
+        uds_client.did_codecs.register(did, '>I')
+    config = dict(uds_client.client_config, data_identifiers=uds_client.did_codecs.config())
+
+    server_bus = can.Bus(interface="virtual", channel=channel)
+    client_bus = can.Bus(interface="virtual", channel=channel)
+    stop_event = threading.Event()
+    server_connection = uds_server.create_uds_connection(server_bus, isotp_params, ecu)
+    server_connection.open()
+    server_thread = threading.Thread(target=uds_server.serve, args=(server_connection, stop_event, ecu), daemon=True)
+    server_thread.start()
+    try:
+        client_connection = uds_client.create_uds_connection(client_bus, isotp_params)
+        with Client(client_connection, config=config) as client:
+            start = time.perf_counter()
+            single = {did: client.read_data_by_identifier([did]).service_data.values[did] for did in dids}
+            single_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            bulk = uds_client.read_all_dids(client, dids)
+            bulk_time = time.perf_counter() - start
+    finally:
+        stop_event.set()
+        server_thread.join()
+        server_connection.close()
+        server_bus.shutdown()
+        client_bus.shutdown()
+    ok = single == bulk and all(bulk[did] == (did,) for did in dids)
+    return ok, single_time, bulk_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full DID scan, one DID per request against bulk reads")
+    parser.add_argument("--dids", type=int, default=500, help="number of 4 byte DIDs on the ECU")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    logging.getLogger("GeneralLogger").setLevel(logging.WARNING)
+    uds_server.timeout_seconds = 0.5  # Let the server notice stop_event quickly
+
+    ok, single_time, bulk_time = run(args.dids, load_profiles()["profiles"][args.profile])
+    print(f"{'OK' if ok else 'FAILED'}: {args.dids} DIDs, one per request {single_time:.3f} s, "
+          f"bulk {bulk_time:.3f} s ({single_time / bulk_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import threading
+import time
+
+import can_bus_manager
+import canWithIsoTpReceiver as receiver
+import canWithIsoTpSender as sender
+import uds_server
+from benchmarks import uds_flash
+from isotp_profiles import load_profiles, profile_is_fd
+
+# Compares classic CAN and CAN-FD profiles on python-can's virtual bus, for
+# both the block transfer (canWithIsoTpSender -> receiver loop) and the UDS
+# flashing pipeline, e.g.
+#   python -m benchmarks.fd_vs_classic --size 262144
+
+
+def use_profile(module, params):
+    module.isotp_params = params
+    module.fd_flag = profile_is_fd(params)
+
+
+def isotp_transfer(size, params, payload=None, compression=None):
+    # Sender and receiver need separate bus objects, the virtual interface
+    # does not deliver a bus' own frames back to it
+    can_bus_manager.default_interface = "virtual"
+    sender.bus_manager = can_bus_manager.BusManager()
+    receiver.bus_manager = can_bus_manager.BusManager()
+    use_profile(sender, params)
+    use_profile(receiver, params)
+    receiver.receive_timeout_in_seconds = 0.2
+
+    payload = os.urandom(size) if payload is None else payload
+    received = bytearray(size)
+
+    def store(offset, data):
+        received[offset:offset + len(data)] = data
+
+    stop_event = threading.Event()
+    tp_layer = receiver.create_tp_layer()
+    receive_thread = threading.Thread(target=receiver.receive_loop, args=(tp_layer, store, stop_event), daemon=True)
+    receive_thread.start()
+    try:
+        start = time.perf_counter()
+        ok = sender.run_transfer(lambda sender_tp_layer: sender.send_blocks(
+            sender_tp_layer, memoryview(payload), compression=compression))
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_event.set()
+        receive_thread.join()
+        tp_layer.stop()
+        sender.bus_manager.shutdown()
+        receiver.bus_manager.shutdown()
+    return ok and received == payload, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classic CAN vs CAN-FD throughput on the virtual bus")
+    parser.add_argument("--size", type=int, default=128 * 1024, help="payload size in bytes")
+    parser.add_argument("--classic", default="classic_fast", help="classic CAN profile")
+    parser.add_argument("--fd", default="fd_fast", help="CAN-FD profile")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5
+
+    profiles = load_profiles()["profiles"]
+    results = {}
+    for name in (args.classic, args.fd):
+        params = profiles[name]
+        for path, run in (("isotp", isotp_transfer), ("uds", uds_flash.run)):
+            ok, elapsed = run(args.size, params)
+            results[(name, path)] = args.size / elapsed
+            print(f"{name:>14} {path:>5}: {'OK' if ok else 'FAILED'} "
+                  f"{args.size / elapsed / 1024:8.1f} KiB/s")
+    for path in ("isotp", "uds"):
+        speedup = results[(args.fd, path)] / results[(args.classic, path)]
+        print(f"{path}: CAN-FD is {speedup:.1f}x classic CAN")
+
+
+if __name__ == "__main__":
+    main()
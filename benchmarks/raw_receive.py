@@ -0,0 +1,51 @@
+import argparse
+import logging
+import os
+import threading
+
+import can
+
+import receive
+import sender
+
+# Sustained receive rate of receive.py's bulk mode on the virtual bus, fed
+# by sender.py's bulk mode, e.g.
+#   python -m benchmarks.raw_receive --size 1000000 --ring 256
+
+
+def run(size, gap=0.0, fd=False, channel="raw_receive_bench"):
+    payload = os.urandom(size)
+    receiver_bus = can.Bus(interface="virtual", channel=channel)
+    sender_bus = can.Bus(interface="virtual", channel=channel)
+    result = {}
+    receiver_thread = threading.Thread(target=lambda: result.update(receive.receive_bulk(receiver_bus, timeout=5)))
+    receiver_thread.start()
+    try:
+        sent = sender.send_bulk(sender_bus, payload, gap=gap, fd=fd)
+        receiver_thread.join()
+    finally:
+        receiver_bus.shutdown()
+        sender_bus.shutdown()
+    result['ok'] = result.get('ok', False) and sent['ok'] and bytes(result['data']) == payload
+    return sent, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw bulk receive rate on the virtual bus")
+    parser.add_argument("--size", type=int, default=1000000, help="bytes transferred")
+    parser.add_argument("--gap", type=float, default=0.0, help="sender inter-frame gap in seconds")
+    parser.add_argument("--ring", type=int, default=receive.ring_buffer_size, help="receive ring buffer size")
+    parser.add_argument("--fd", action="store_true", help="64 byte CAN-FD frames")
+    args = parser.parse_args()
+    logging.getLogger("GeneralLogger").setLevel(logging.WARNING)
+    receive.ring_buffer_size = args.ring
+
+    sent, received = run(args.size, args.gap, args.fd)
+    print(f"{'OK' if received['ok'] else 'FAILED'}: {args.size} bytes, {sent['frames']} frames")
+    print(f"sender:   {sent['frames_per_second']:.0f} frames/s, {sent['frames_sent'] - sent['frames']} resent")
+    print(f"receiver: {received['frames_per_second']:.0f} frames/s sustained, "
+          f"{received['ring_dropped']} dropped by the ring buffer")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import can_bus_manager
+import canWithIsoTpReceiver as receiver
+import canWithIsoTpSender as sender
+from benchmarks.fd_vs_classic import use_profile
+from block_protocol import block_payload_size
+from firmware_stream import ImageSink, default_block_size
+from isotp_profiles import load_profiles
+
+# Cost of storing received blocks with ImageSink (one slice assignment per
+# block) versus copying them byte by byte, and a block transfer on the
+# virtual bus captured into a memory-mapped file:
+#   python -m benchmarks.receive_sink --size 1048576
+
+default_profile = "fd_fast"
+block_size = block_payload_size(default_block_size)
+
+
+def per_byte_store(buffer, offset, data):
+    # What a receiver that handles every byte in Python costs
+    for index, value in enumerate(data):
+        buffer[offset + index] = value
+
+
+def store_rate(size, file_name=None):
+    # Bytes/s of ImageSink.on_block alone
+    payload = memoryview(os.urandom(size))
+    with ImageSink(size, file_name) as sink:
+        start = time.perf_counter()
+        for offset in range(0, size, block_size):
+            sink.on_block(offset, payload[offset:offset + block_size])
+        elapsed = time.perf_counter() - start
+        ok = sink.data == payload
+    return ok, size / elapsed
+
+
+def per_byte_rate(size):
+    payload = os.urandom(size)
+    buffer = bytearray(size)
+    start = time.perf_counter()
+    for offset in range(0, size, block_size):
+        per_byte_store(buffer, offset, payload[offset:offset + block_size])
+    return buffer == payload, size / (time.perf_counter() - start)
+
+
+def captured_transfer(size, isotp_params, file_name):
+    # Returns (ok, transfer bytes/s, bytes/s the sink saw)
+    can_bus_manager.default_interface = "virtual"
+    sender.bus_manager = can_bus_manager.BusManager()
+    receiver.bus_manager = can_bus_manager.BusManager()
+    use_profile(sender, isotp_params)
+    use_profile(receiver, isotp_params)
+    receiver.receive_timeout_in_seconds = 0.2
+    payload = os.urandom(size)
+
+    stop_event = threading.Event()
+    tp_layer = receiver.create_tp_layer()
+    with ImageSink(size, file_name) as sink:
+        receive_thread = threading.Thread(target=receiver.receive_loop, args=(tp_layer, sink.on_block, stop_event),
+                                          daemon=True)
+        receive_thread.start()
+        try:
+            start = time.perf_counter()
+            ok = sender.run_transfer(lambda sender_tp_layer: sender.send_blocks(sender_tp_layer, memoryview(payload)))
+            elapsed = time.perf_counter() - start
+        finally:
+            stop_event.set()
+            receive_thread.join()
+            tp_layer.stop()
+            sender.bus_manager.shutdown()
+            receiver.bus_manager.shutdown()
+        sink_rate = sink.bytes_per_second
+    with open(file_name, "rb") as file:
+        ok = ok and file.read() == payload
+    return ok, size / elapsed, sink_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive sink throughput")
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="image size in bytes")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "capture.bin")
+        for label, (ok, rate) in (("per byte", per_byte_rate(args.size)),
+                                  ("bytearray", store_rate(args.size)),
+                                  ("mmap file", store_rate(args.size, file_name))):
+            print(f"{label:>10}: {'OK' if ok else 'FAILED'} {rate / 1024 / 1024:10.1f} MiB/s stored")
+        ok, rate, sink_rate = captured_transfer(args.size, load_profiles()["profiles"][args.profile], file_name)
+        print(f"{'transfer':>10}: {'OK' if ok else 'FAILED'} {rate / 1024:10.1f} KiB/s over the bus, "
+              f"sink saw {sink_rate / 1024:.1f} KiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import can
+from can.interfaces.virtual import VirtualBus
+from udsoncan.client import Client
+
+import uds_client
+import uds_server
+from benchmarks import fd_vs_classic, raw_receive, uds_flash
+from isotp_profiles import load_profiles, profile_is_fd
+
+# End-to-end benchmark suite on python-can's virtual bus. Every scenario runs
+# for every payload size and ISO-TP profile, each in its own process so the
+# peak RSS is that of the scenario. Results are written as JSON and can be
+# checked against an earlier run:
+#   python -m benchmarks.run_all --output results.json
+#   python -m benchmarks.run_all --compare results.json   exit code 1 on regression
+#
+#   isotp        canTpSend's block transfer against the ISO-TP receiver loop
+#   raw          sender.py --bulk against receive.py --bulk, once per bus
+#                type of the profiles ("classic", "fd"), ISO-TP is not used
+#   uds_flash    uds_client.flash_image against uds_server
+#   uds_latency  ReadDataByIdentifier round trips against uds_server
+
+default_sizes = (16 * 1024, 128 * 1024)
+default_profiles = ("classic_fast", "fd_fast")
+latency_requests = 200
+regression_tolerance = 0.15  # Relative slowdown reported as a regression
+
+
+@contextlib.contextmanager
+def count_frames():
+    # Counts every frame sent on any virtual bus of this process
+    counter = {'frames': 0}
+    original_send = VirtualBus.send
+
+    def send(self, msg, timeout=None):
+        counter['frames'] += 1
+        return original_send(self, msg, timeout)
+
+    VirtualBus.send = send
+    try:
+        yield counter
+    finally:
+        VirtualBus.send = original_send
+
+
+def peak_rss_kib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {name: samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+            for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))}
+
+
+def run_isotp(size, params):
+    ok, _ = fd_vs_classic.isotp_transfer(size, params)
+    return {'ok': ok}
+
+
+def run_raw(size, fd):
+    sent, received = raw_receive.run(size, fd=fd)
+    return {'ok': received['ok'], 'resent_frames': sent['frames_sent'] - sent['frames'],
+            'ring_dropped': received['ring_dropped']}
+
+
+def run_uds_flash(size, params):
+    ok, _ = uds_flash.run(size, params)
+    return {'ok': ok}
+
+
+def run_uds_latency(size, params, channel="uds_latency_bench"):
+    # size is unused, the request and response are the VIN read
+    server_bus = can.Bus(interface="virtual", channel=channel)
+    client_bus = can.Bus(interface="virtual", channel=channel)
+    stop_event = threading.Event()
+    server_connection = uds_server.create_uds_connection(server_bus, params)
+    server_connection.open()
+    server_thread = threading.Thread(target=uds_server.serve, args=(server_connection, stop_event), daemon=True)
+    server_thread.start()
+    latencies = []
+    try:
+        with Client(uds_client.create_uds_connection(client_bus, params), config=uds_client.client_config) as client:
+            for _ in range(latency_requests):
+                start = time.perf_counter()
+                client.read_data_by_identifier([0xF190])
+                latencies.append(time.perf_counter() - start)
+    finally:
+        stop_event.set()
+        server_thread.join()
+        server_connection.close()
+        server_bus.shutdown()
+        client_bus.shutdown()
+    return {'ok': len(latencies) == latency_requests, 'requests': len(latencies),
+            'latency_ms': percentiles(latencies)}
+
+
+scenarios = {
+    # (function, depends on the payload size, runs per ISO-TP profile or per bus type)
+    "isotp": (run_isotp, True, True),
+    "raw": (run_raw, True, False),
+    "uds_flash": (run_uds_flash, True, True),
+    "uds_latency": (run_uds_latency, False, True),
+}
+
+
+def scenario_runs(name, profile_names, profiles):
+    # (label, argument) pairs: the profile name and its parameters, or the
+    # bus type and the FD flag for scenarios that do not use ISO-TP
+    if scenarios[name][2]:
+        return [(profile, profiles[profile]) for profile in profile_names]
+    bus_types = sorted({"fd" if profile_is_fd(profiles[profile]) else "classic" for profile in profile_names})
+    return [(bus_type, bus_type == "fd") for bus_type in bus_types]
+
+
+def configure():
+    logging.getLogger("GeneralLogger").setLevel(logging.WARNING)
+    uds_server.timeout_seconds = 0.5  # Let the servers notice their stop event quickly
+
+
+def measure(name, size, profile, params):
+    run, sized, _ = scenarios[name]
+    with count_frames() as counter:
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        try:
+            result = run(size, params)
+        except Exception as e:
+            result = {'ok': False, 'error': str(e)}
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    result.update(scenario=name, profile=profile, size=size if sized else None, seconds=elapsed,
+                  cpu_seconds=cpu, frames=counter['frames'], frames_per_second=counter['frames'] / elapsed,
+                  peak_rss_kib=peak_rss_kib())
+    if sized:
+        result['bytes_per_second'] = size / elapsed
+    return result
+
+
+def measure_in_process(name, size, profile):
+    # Runs measure() in a new interpreter, see --measure
+    with tempfile.TemporaryDirectory() as directory:
+        result_file = os.path.join(directory, "result.json")
+        command = [sys.executable, "-m", "benchmarks.run_all", "--measure", name, profile, str(size or 0),
+                   "--output", result_file]
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        try:
+            with open(result_file, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            error = completed.stderr.strip().splitlines()[-1:] or [f"exit code {completed.returncode}"]
+            return {'ok': False, 'error': error[0], 'scenario': name, 'profile': profile,
+                    'size': size if scenarios[name][1] else None, 'seconds': 0.0, 'cpu_seconds': 0.0,
+                    'frames': 0, 'frames_per_second': 0.0}
+
+
+def measure_one(name, label, size, output):
+    # Child side of measure_in_process
+    configure()
+    profiles = load_profiles()["profiles"]
+    argument = profiles[label] if scenarios[name][2] else label == "fd"
+    result = measure(name, size or None, label, argument)
+    with open(output, "w") as file:
+        json.dump(result, file)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['scenario'], result['profile'], result['size']
+
+
+def compare(results, baseline, tolerance):
+    # Returns a description of every result slower than the baseline by more than tolerance
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or not old.get('ok') or not result.get('ok'):
+            continue
+        if 'bytes_per_second' in result and 'bytes_per_second' in old:
+            change = result['bytes_per_second'] / old['bytes_per_second'] - 1
+            if change < -tolerance:
+                regressions.append(f"{result_key(result)}: throughput {change:+.0%}")
+        if 'latency_ms' in result and 'latency_ms' in old:
+            change = result['latency_ms']['p50'] / old['latency_ms']['p50'] - 1
+            if change > tolerance:
+                regressions.append(f"{result_key(result)}: p50 latency {change:+.0%}")
+    return regressions
+
+
+def print_result(result):
+    line = f"{result['scenario']:>11} {result['profile']:>14} {str(result['size'] or '-'):>8}: "
+    line += "OK    " if result['ok'] else "FAILED"
+    if 'bytes_per_second' in result:
+        line += f" {result['bytes_per_second'] / 1024:9.1f} KiB/s"
+    line += f" {result['frames_per_second']:9.0f} frames/s cpu {result['cpu_seconds']:.2f} s"
+    if 'latency_ms' in result:
+        latency = result['latency_ms']
+        line += f" latency p50 {latency['p50']:.2f} p95 {latency['p95']:.2f} p99 {latency['p99']:.2f} ms"
+    if 'error' in result:
+        line += f" ({result['error']})"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks on the virtual bus")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(scenarios), default=sorted(scenarios))
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(default_sizes), help="payload sizes in bytes")
+    parser.add_argument("--profiles", nargs="+", default=list(default_profiles), help="ISO-TP profiles")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=regression_tolerance)
+    parser.add_argument("--measure", nargs=3, metavar=("SCENARIO", "PROFILE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        name, label, size = args.measure
+        measure_one(name, label, int(size), args.output)
+        return
+
+    profiles = load_profiles()["profiles"]
+    results = []
+    for name in args.scenarios:
+        sizes = args.sizes if scenarios[name][1] else [None]
+        for label, _ in scenario_runs(name, args.profiles, profiles):
+            for size in sizes:
+                result = measure_in_process(name, size, label)
+                print_result(result)
+                results.append(result)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec="seconds"),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'python_can': can.__version__,
+        },
+        'results': results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = [result for result in results if not result['ok']]
+    regressions = []
+    if args.compare:
+        with open(args.compare, "r") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import can
+from udsoncan.client import Client
+
+import can_bus_manager
+import canWithIsoTpReceiver as receiver
+import canWithIsoTpSender as sender
+import image_loader
+import uds_client
+import uds_server
+from benchmarks.fd_vs_classic import use_profile
+from isotp_profiles import load_profiles
+
+# Flat binary versus Intel HEX file of the same firmware: a bootloader,
+# an application and a calibration block with erased flash (0xFF) between
+# them. The flat image sends the gaps, the HEX file only the segments.
+#   python -m benchmarks.sparse_image
+
+default_profile = "classic_fast"
+layout = ((0x00000, 8 * 1024), (0x10000, 192 * 1024), (0xF0000, 16 * 1024))  # address, size
+
+
+def write_ihex(file_name, segments):
+    # 32 data bytes per record, extended linear address records as needed
+    def record(address, record_type, data=b""):
+        body = bytes((len(data), (address >> 8) & 0xFF, address & 0xFF, record_type)) + data
+        return ":" + (body + bytes(((-sum(body)) & 0xFF,))).hex().upper() + "\n"
+
+    with open(file_name, "w") as file:
+        upper = None
+        for address, data in segments:
+            for offset in range(0, len(data), 32):
+                if (address + offset) >> 16 != upper:
+                    upper = (address + offset) >> 16
+                    file.write(record(0, 0x04, upper.to_bytes(2, "big")))
+                file.write(record(address + offset, 0x00, data[offset:offset + 32]))
+        file.write(record(0, 0x01))
+
+
+def make_images(directory):
+    segments = [(address, os.urandom(size)) for address, size in layout]
+    flat = bytearray(b"\xFF" * (layout[-1][0] + layout[-1][1]))
+    for address, data in segments:
+        flat[address:address + len(data)] = data
+    flat_file = os.path.join(directory, "firmware.bin")
+    hex_file = os.path.join(directory, "firmware.hex")
+    with open(flat_file, "wb") as file:
+        file.write(flat)
+    write_ihex(hex_file, segments)
+    return segments, flat_file, hex_file
+
+
+def uds_flash(file_name, segments, isotp_params, channel="sparse_image_bench"):
+    uds_server.default_ecu.flash_memory = bytearray()
+    server_bus = can.Bus(interface="virtual", channel=channel)
+    client_bus = can.Bus(interface="virtual", channel=channel)
+    stop_event = threading.Event()
+    server_connection = uds_server.create_uds_connection(server_bus, isotp_params)
+    server_connection.open()
+    server_thread = threading.Thread(target=uds_server.serve, args=(server_connection, stop_event), daemon=True)
+    server_thread.start()
+    try:
+        client_connection = uds_client.create_uds_connection(client_bus, isotp_params)
+        with Client(client_connection, config=uds_client.client_config) as client:
+            start = time.perf_counter()
+            ok = uds_client.flash_image(client, file_name)
+            elapsed = time.perf_counter() - start
+    finally:
+        stop_event.set()
+        server_thread.join()
+        server_connection.close()
+        server_bus.shutdown()
+        client_bus.shutdown()
+    memory = uds_server.default_ecu.flash_memory
+    return ok and all(memory[address:address + len(data)] == data for address, data in segments), elapsed
+
+
+def block_transfer(file_name, segments, isotp_params):
+    can_bus_manager.default_interface = "virtual"
+    sender.bus_manager = can_bus_manager.BusManager()
+    receiver.bus_manager = can_bus_manager.BusManager()
+    use_profile(sender, isotp_params)
+    use_profile(receiver, isotp_params)
+    receiver.receive_timeout_in_seconds = 0.2
+    received = bytearray(layout[-1][0] + layout[-1][1])
+
+    def store(offset, data):
+        received[offset:offset + len(data)] = data
+
+    stop_event = threading.Event()
+    tp_layer = receiver.create_tp_layer()
+    receive_thread = threading.Thread(target=receiver.receive_loop, args=(tp_layer, store, stop_event), daemon=True)
+    receive_thread.start()
+    try:
+        start = time.perf_counter()
+        ok = sender.canTpSendFile(file_name)
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_event.set()
+        receive_thread.join()
+        tp_layer.stop()
+        sender.bus_manager.shutdown()
+        receiver.bus_manager.shutdown()
+    return ok and all(received[address:address + len(data)] == data for address, data in segments), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flat binary versus sparse HEX image transfers on the virtual bus")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5  # Let the server notice stop_event quickly
+    params = load_profiles()["profiles"][args.profile]
+
+    with tempfile.TemporaryDirectory() as directory:
+        image_loader.cache_directory = os.path.join(directory, "cache")
+        segments, flat_file, hex_file = make_images(directory)
+        for label, use_cache in (("parse", False), ("parse + cache", True), ("cached reload", True)):
+            start = time.perf_counter()
+            image = image_loader.load_image(hex_file, use_cache)
+            print(f"{label:>14}: {os.path.getsize(hex_file)} byte HEX file in {time.perf_counter() - start:.3f} s")
+        print(f"{len(image)} segments, {image.size} of {image.span} bytes populated")
+
+        for path, run in (("uds", uds_flash), ("isotp", block_transfer)):
+            results = {}
+            for label, file_name in (("flat", flat_file), ("sparse", hex_file)):
+                ok, elapsed = run(file_name, segments, params)
+                results[label] = elapsed
+                print(f"{path:>5} {label:>6}: {'OK' if ok else 'FAILED'} in {elapsed:.3f} s")
+            print(f"{path}: sparse image is {results['flat'] / results['sparse']:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import can
+
+from frame_trace import TraceReader, TraceWriter
+
+# Writes a synthetic binary trace and searches it by ID and time range, e.g.
+#   python -m benchmarks.trace_index --frames 2000000
+
+
+def write_trace(file_name, frame_count, id_count):
+    rng = random.Random(0)
+    ids = [0x100 + index for index in range(id_count)]
+    msg = can.Message(arbitration_id=0, data=bytearray(8), is_extended_id=False)
+    start = time.perf_counter()
+    with TraceWriter(file_name) as writer:
+        for number in range(frame_count):
+            msg.timestamp = number * 0.0001  # 10k frames/s
+            msg.arbitration_id = ids[rng.randrange(id_count)]
+            msg.data[0] = number & 0xFF
+            writer.on_message_received(msg)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary trace write and search speed")
+    parser.add_argument("--frames", type=int, default=1000000)
+    parser.add_argument("--ids", type=int, default=50, help="distinct arbitration ids")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "trace.bin")
+        elapsed = write_trace(file_name, args.frames, args.ids)
+        size = os.path.getsize(file_name)
+        print(f"write: {args.frames} frames in {elapsed:.2f} s ({args.frames / elapsed:,.0f} frames/s), "
+              f"{size / 1e6:.1f} MB ({size / args.frames:.0f} bytes/frame)")
+        text_line = ("2026-01-01 00:00:00 - INFO - Message received with arbitration_id=0x100 and "
+                     "data=bytearray(b'\\x00\\x19\\x00\\x01\\x03\\x01\\x04\\x01') , and hole message = "
+                     "Timestamp: 1700000000.000000    ID: 0100    S Rx                DL:  8    "
+                     "00 19 00 01 03 01 04 01\n")
+        print(f"the same frames as text log lines: ~{len(text_line) * args.frames / 1e6:.0f} MB")
+
+        with TraceReader(file_name) as reader:
+            duration = args.frames * 0.0001
+            start = time.perf_counter()
+            window = reader.time_range(duration * 0.4, duration * 0.5)
+            print(f"time range query: {len(window)} frames in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+            start = time.perf_counter()
+            reader.id_index()
+            print(f"ID index over {len(reader)} frames: {time.perf_counter() - start:.2f} s")
+
+            start = time.perf_counter()
+            selected = reader.select([0x100, 0x101], duration * 0.4, duration * 0.5)
+            print(f"ID + time query: {len(selected)} frames in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+            start = time.perf_counter()
+            count = sum(1 for _ in reader.filter([0x100], duration * 0.4, duration * 0.5))
+            print(f"decoded {count} matching frames to can.Message in {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import can
+from udsoncan.client import Client
+
+import uds_client
+import uds_server
+from isotp_profiles import load_profiles
+
+# No artificial separation time: the virtual bus is as fast as the CPU allows
+default_profile = "classic_fast"
+
+
+def run(size, isotp_params, channel="uds_flash_bench", payload=None, compression=None):
+    with tempfile.NamedTemporaryFile(delete=False) as image:
+        image.write(os.urandom(size) if payload is None else payload)
+    server_bus = can.Bus(interface="virtual", channel=channel)
+    client_bus = can.Bus(interface="virtual", channel=channel)
+    stop_event = threading.Event()
+    server_connection = uds_server.create_uds_connection(server_bus, isotp_params)
+    server_connection.open()
+    server_thread = threading.Thread(target=uds_server.serve, args=(server_connection, stop_event), daemon=True)
+    server_thread.start()
+    try:
+        client_connection = uds_client.create_uds_connection(client_bus, isotp_params)
+        with Client(client_connection, config=uds_client.client_config) as client:
+            start = time.perf_counter()
+            ok = uds_client.flash_image(client, image.name, compression=compression)
+            elapsed = time.perf_counter() - start
+        flashed = uds_server.default_ecu.flash_memory[:size] == open(image.name, "rb").read()
+    finally:
+        stop_event.set()
+        server_thread.join()
+        server_connection.close()
+        server_bus.shutdown()
+        client_bus.shutdown()
+        os.unlink(image.name)
+    return ok and flashed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDS flashing throughput on the virtual bus")
+    parser.add_argument("--size", type=int, default=256 * 1024, help="image size in bytes")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5  # Let the server notice stop_event quickly
+    ok, elapsed = run(args.size, load_profiles()["profiles"][args.profile])
+    print(f"{'OK' if ok else 'FAILED'}: {args.size} bytes in {elapsed:.3f} s "
+          f"({args.size / elapsed / 1024:.1f} KiB/s)")
+
+
+if __name__ == "__main__":
+    main()
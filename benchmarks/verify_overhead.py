@@ -0,0 +1,41 @@
+import argparse
+import statistics
+
+import uds_client
+import uds_server
+from benchmarks import uds_flash
+from isotp_profiles import load_profiles
+
+# Cost of the running CRC32/SHA-256 and the checkMemory routine on a UDS
+# flash, runs with and without verification alternate to even out noise:
+#   python -m benchmarks.verify_overhead --size 1048576 --runs 5
+
+default_profile = "classic_fast"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Integrity verification overhead on the virtual bus")
+    parser.add_argument("--size", type=int, default=512 * 1024, help="image size in bytes")
+    parser.add_argument("--runs", type=int, default=3, help="runs with and without verification")
+    parser.add_argument("--profile", default=default_profile, help="ISO-TP profile from isotp_profiles.json")
+    args = parser.parse_args()
+    uds_server.timeout_seconds = 0.5
+
+    params = load_profiles()["profiles"][args.profile]
+    times = {False: [], True: []}
+    for _ in range(args.runs):
+        for verify in (False, True):
+            uds_client.verify_downloads = verify
+            ok, elapsed = uds_flash.run(args.size, params)
+            if not ok:
+                print(f"FAILED (verify={verify})")
+                return
+            times[verify].append(elapsed)
+    plain = statistics.median(times[False])
+    verified = statistics.median(times[True])
+    print(f"without verification: {plain:.3f} s, with verification: {verified:.3f} s "
+          f"({(verified / plain - 1) * 100:+.1f}%), median of {args.runs} runs of {args.size} bytes")
+
+
+if __name__ == "__main__":
+    main()
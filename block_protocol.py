@@ -0,0 +1,119 @@
+import os
+import struct
+
+# Application level protocol carried in ISO-TP messages between canTpSend
+# and the receiver loop. Every block carries a sequence number and its
+# offset in the image and is acknowledged on its own, so the sender can keep
+# a window of blocks in flight and retransmit only the ones that were lost.
+#
+#   BLOCK    type, transfer id (u32), seq (u32), offset (u32), data
+#   ZBLOCK   type, transfer id (u32), seq (u32), offset (u32), dataFormatIdentifier (u8), compressed data
+#   ACK      type, transfer id (u32), seq (u32)
+#   END      type, transfer id (u32), block count (u32), total size (u32), CRC32 (u32), SHA-256 (32 bytes)
+#   END_ACK  type, transfer id (u32), blocks received (u32), check status (u8, 0 = digests match)
+#
+# The digests in END are those of the whole image, see integrity.py. The
+# transfer id is chosen by the sender for every transfer: a receiver seeing
+# a new id drops what it holds of an unfinished (e.g. cancelled) transfer,
+# and late ACKs of an earlier transfer are not taken for the current one.
+
+BLOCK = 0x01
+ACK = 0x02
+END = 0x03
+END_ACK = 0x04
+ZBLOCK = 0x05  # Compressed BLOCK, see compression.py; offset is the uncompressed one
+
+block_header = struct.Struct(">BIII")
+compressed_block_header = struct.Struct(">BIIIB")
+ack_message = struct.Struct(">BII")
+end_message = struct.Struct(">BIIII32s")
+end_ack_message = struct.Struct(">BIIB")
+
+
+def block_payload_size(message_size: int) -> int:
+    # Data bytes per block so that header + data fit in one ISO-TP message
+    return message_size - block_header.size
+
+
+def _chain(header, data):
+    yield from header
+    yield from data
+
+
+def new_transfer_id() -> int:
+    return int.from_bytes(os.urandom(4), "big")
+
+
+def encode_block(transfer_id: int, seq: int, offset: int, data):
+    # Returns a (generator, size) pair accepted by isotp's send(). isotp reads
+    # the payload through a generator anyway, so chaining the header in front
+    # of the memoryview avoids copying the block into a new buffer.
+    header = block_header.pack(BLOCK, transfer_id, seq, offset)
+    return _chain(header, data), len(header) + len(data)
+
+
+def compressed_payload_size(message_size: int) -> int:
+    # Largest compressed block that fits in one ISO-TP message
+    return message_size - compressed_block_header.size
+
+
+def encode_compressed_block(transfer_id: int, seq: int, offset: int, data_format: int, data: bytes) -> bytes:
+    return compressed_block_header.pack(ZBLOCK, transfer_id, seq, offset, data_format) + data
+
+
+def decode_compressed_block(message):
+    # Returns (transfer id, seq, offset, dataFormatIdentifier, compressed data)
+    _, transfer_id, seq, offset, data_format = compressed_block_header.unpack_from(message)
+    return transfer_id, seq, offset, data_format, memoryview(message)[compressed_block_header.size:]
+
+
+def decode_block(message):
+    # Returns (transfer id, seq, offset, data) with data as a memoryview of the message
+    _, transfer_id, seq, offset = block_header.unpack_from(message)
+    return transfer_id, seq, offset, memoryview(message)[block_header.size:]
+
+
+def encode_ack(transfer_id: int, seq: int) -> bytes:
+    return ack_message.pack(ACK, transfer_id, seq)
+
+
+def encode_end(transfer_id: int, block_count: int, total_size: int, crc32: int, sha256: bytes) -> bytes:
+    return end_message.pack(END, transfer_id, block_count, total_size, crc32, sha256)
+
+
+def encode_end_ack(transfer_id: int, blocks_received: int, status: int) -> bytes:
+    return end_ack_message.pack(END_ACK, transfer_id, blocks_received, status)
+
+
+def message_type(message):
+    return message[0] if message else None
+
+
+def is_protocol_message(message) -> bool:
+    kind = message_type(message)
+    if kind == BLOCK:
+        return len(message) >= block_header.size
+    if kind == ZBLOCK:
+        return len(message) > compressed_block_header.size
+    if kind == ACK:
+        return len(message) == ack_message.size
+    if kind == END_ACK:
+        return len(message) == end_ack_message.size
+    if kind == END:
+        return len(message) == end_message.size
+    return False
+
+
+def decode_ack(message):
+    # Returns (transfer id, seq)
+    return ack_message.unpack(message)[1:]
+
+
+def decode_end(message):
+    # Returns (transfer id, block count, total size, CRC32, SHA-256)
+    return end_message.unpack(message)[1:]
+
+
+def decode_end_ack(message):
+    # Returns (transfer id, blocks received, check status)
+    return end_ack_message.unpack(message)[1:]
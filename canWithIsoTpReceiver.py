@@ -1,107 +1,233 @@
-import logging
+import argparse
+import time
 import isotp
 import can
+import metrics
 from can.interfaces.vector.exceptions import VectorInitializationError
+from can_bus_manager import bus_manager
+from firmware_stream import ImageSink
+from logging_setup import FrameLog, setup_logging
+from isotp_profiles import load_profile, profile_is_fd
+from compression import decompress
+from integrity import RunningDigest, check_memory_failed, check_memory_ok
+from block_protocol import (
+    BLOCK, END, ZBLOCK, decode_block, decode_compressed_block, decode_end, encode_ack, encode_end_ack,
+    is_protocol_message, message_type
+)
+
+# Logging, see logging_setup.py
+logger, ErrorLogger = setup_logging("isotp_receiver.log", "isotp_receiver_errors.log")
 
-# Error Logger setup
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-error_file_handler = logging.FileHandler("isotp_receiver_errors.log")
-error_file_handler.setFormatter(error_formatter)
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(error_formatter)
-ErrorLogger.addHandler(error_file_handler)
-ErrorLogger.addHandler(error_console_handler)
-
-# General Logger setup
-logger = logging.getLogger("GeneralLogger")
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-file_handler = logging.FileHandler("isotp_receiver.log")
-file_handler.setFormatter(formatter)
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-fd_flag = False
 extended_flag = False
 channel_number = 0
 message_id = 0x33  # Same as transmitter's txid
 timeout_in_seconds = 5  # Timeout for receiving acknowledgment
+receive_timeout_in_seconds = 60  # Timeout of a single tp_layer.recv
+isotp_profile = "isotp_default"  # Used unless another profile is active, see isotp_profiles
+isotp_params = load_profile(isotp_profile)
+fd_flag = profile_is_fd(isotp_params)  # Bus opened in CAN-FD mode for FD profiles
+
+# Receive metrics, see metrics.py
+frame_metrics = metrics.IsoTpMetrics("isotp_receiver")
+blocks_received = metrics.counter("isotp_receiver.blocks")
+bytes_received = metrics.counter("isotp_receiver.bytes")
+duplicate_blocks = metrics.counter("isotp_receiver.duplicate_blocks")
+protocol_errors = metrics.counter("isotp_receiver.protocol_errors")
+can_errors = metrics.counter("isotp_receiver.can_errors")
+
+def get_bus() -> can.BusABC:
+    # Opened once and reused for every frame
+    return bus_manager.get_bus(channel=channel_number, fd=fd_flag, app_name="udsWithIsoTp")
+
 def my_rxfn(timeout:float) -> isotp.CanMessage:
-    bus=can.Bus(interface="vector", channel=channel_number, app_name="udsWithIsoTp", fd=fd_flag)
-    canMsg = bus.recv()
+    canMsg = get_bus().recv(timeout)
+    if canMsg is None:
+        return None
+    frame_metrics.on_rx(canMsg.data)
     return isotp.CanMessage(arbitration_id=canMsg.arbitration_id,
                             data = canMsg.data,
                             extended_id=canMsg.is_extended_id,
-                            is_fd=canMsg.is_fd)
+                            is_fd=canMsg.is_fd,
+                            bitrate_switch=canMsg.bitrate_switch)
 
 
 
 def my_txfn(isotp_msg:isotp.CanMessage):
-    bus=can.Bus(interface="vector", channel=channel_number, app_name="udsWithIsoTp", fd=fd_flag)
     msg = can.Message(arbitration_id=isotp_msg.arbitration_id, 
                       data=isotp_msg.data, 
                       is_extended_id=isotp_msg.is_extended_id,
-                      is_fd=isotp_msg.is_fd)
-    bus.send(msg)
+                      is_fd=isotp_msg.is_fd,
+                      bitrate_switch=isotp_msg.bitrate_switch)
+    bus_manager.send(msg, channel=channel_number, fd=fd_flag, app_name="udsWithIsoTp")
+    frame_metrics.on_tx(isotp_msg.data)
+
+def create_tp_layer() -> isotp.TransportLayer:
+    # ISO-TP configuration
+    tp_address = isotp.Address(isotp.AddressingMode.Normal_11bits, txid=message_id + 1, rxid=message_id)
+    tp_layer = isotp.TransportLayer(txfn=my_txfn, rxfn=my_rxfn, address=tp_address,
+                                    params=isotp_params, error_handler=frame_metrics.on_error)
+
+    tp_layer.start()  # Start the transport layer
+    return tp_layer
+
+
+class TransferState:
+    # Blocks received in the current transfer, see block_protocol
+    def __init__(self):
+        self.transfer_id = None  # Transfer the blocks belong to
+        self.blocks = set()
+        self.digest = None  # Running CRC32/SHA-256 of the blocks, see integrity.py
+        self.started = 0.0  # When the first block of the transfer arrived
+        self.completed_id = None  # Last finished transfer,
+        self.completed_count = 0  # its number of blocks
+        self.completed_status = check_memory_ok  # and whether its digests matched
+
+    def start(self, transfer_id):
+        # A new transfer id: an unfinished transfer (cancelled, sender
+        # restarted) never gets its END, its blocks are dropped
+        if self.blocks:
+            logger.warning("Transfer %08X abandoned after %d blocks.", self.transfer_id, len(self.blocks))
+        if self.digest is not None:
+            self.digest.result()  # Ends its worker thread
+        self.transfer_id = transfer_id
+        self.blocks = set()
+        self.digest = RunningDigest(by_index=True)  # Offsets may start anywhere, seq always at 0
+        self.started = time.monotonic()
+
 
-try:
-    # Initialize CAN bus
-    with can.Bus(interface="vector", channel=channel_number, app_name="udsWithIsoTp", fd=fd_flag) as bus:
+def handle_protocol_message(tp_layer, message, state, on_block=None):
+    kind = message_type(message)
+    if kind in (BLOCK, ZBLOCK):
+        if kind == BLOCK:
+            transfer_id, seq, offset, data = decode_block(message)
+        else:
+            transfer_id, seq, offset, data_format, data = decode_compressed_block(message)
+        if transfer_id != state.transfer_id and transfer_id != state.completed_id:
+            state.start(transfer_id)
+        if transfer_id == state.transfer_id and seq not in state.blocks:
+            if kind == ZBLOCK:
+                try:
+                    data = decompress(data, data_format)
+                except Exception as e:
+                    # Not acknowledged, the sender retransmits the block
+                    ErrorLogger.error("Could not decompress block %d: %s", seq, e)
+                    return
+            if on_block is not None:
+                try:
+                    on_block(offset, data)
+                except Exception as e:
+                    # Not acknowledged either, e.g. a block outside the ImageSink
+                    ErrorLogger.error("Could not store block %d at 0x%08X: %s", seq, offset, e)
+                    return
+            state.blocks.add(seq)
+            blocks_received.value += 1
+            bytes_received.value += len(data)
+            state.digest.add(seq, data)
+        else:
+            duplicate_blocks.value += 1
+        # Duplicates (also late ones of the finished transfer) are acknowledged
+        # again, their first ACK was probably lost
+        tp_layer.send(encode_ack(transfer_id, seq))
+    elif kind == END:
+        transfer_id, block_count, total_size, crc32, sha256 = decode_end(message)
+        if transfer_id == state.transfer_id:
+            state.transfer_id = None
+            state.completed_id = transfer_id
+            state.completed_count = len(state.blocks)
+            state.blocks = set()
+            # result() waits for the queued blocks, only then is size final
+            received = state.digest.result()
+            size = state.digest.size
+            state.digest = None
+            elapsed = time.monotonic() - state.started
+            logger.info("Received %d bytes in %.3f s (%.1f KiB/s).", size, elapsed,
+                        size / elapsed / 1024 if elapsed > 0 else 0.0)
+            matches = size == total_size and received == (crc32, sha256)
+            state.completed_status = check_memory_ok if matches else check_memory_failed
+            if not matches:
+                ErrorLogger.error("Image digest mismatch: received %d bytes with CRC32 %08X, sender has %d bytes "
+                                  "with CRC32 %08X.", size, received[0], total_size, crc32)
+        elif transfer_id != state.completed_id:
+            # No block of this transfer arrived, which only an empty one completes
+            state.completed_id = transfer_id
+            state.completed_count = 0
+            state.completed_status = check_memory_ok if block_count == 0 and total_size == 0 else check_memory_failed
+        # A repeated END (lost END_ACK) is answered with the same count and status
+        tp_layer.send(encode_end_ack(transfer_id, state.completed_count, state.completed_status))
+        logger.info("Transfer complete: %d of %d blocks, %d bytes, CRC32 %08X %s.", state.completed_count, block_count,
+                    total_size, crc32, "verified" if state.completed_status == check_memory_ok else "MISMATCH")
+
+
+def receive_loop(tp_layer, on_block=None, stop_event=None):
+    # on_block(offset, data) is called once per new block of a transfer
+    state = TransferState()
+    message_log = FrameLog(logger, "Received ISO-TP message: %s")
+    logger.info("Waiting to receive ISO-TP messages...")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            # Receive a message from the sender
+            message = tp_layer.recv(block=True, timeout=receive_timeout_in_seconds)
+            if message and is_protocol_message(message):
+                handle_protocol_message(tp_layer, message, state, on_block)
+            elif message:
+                message_log.log(message)
+            else:
+                message_log.flush("ISO-TP messages received")
+                logger.info("Timeout: No message received.")
+
+        except isotp.ProtocolError as e:
+            protocol_errors.value += 1
+            ErrorLogger.error("ProtocolError while receiving ISO-TP message: %s", e)
+
+        except can.CanError as e:
+            can_errors.value += 1
+            ErrorLogger.error("CAN error occurred while receiving a message: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive block protocol transfers over ISO-TP")
+    parser.add_argument("--output", help="write received blocks at their offsets into this file")
+    parser.add_argument("--size", type=lambda text: int(text, 0), default=16 * 1024 * 1024,
+                        help="capacity of the output file, trimmed to the data received on exit")
+    parser.add_argument("--base-address", type=lambda text: int(text, 0), default=0,
+                        help="block offset stored at the start of the output file")
+    args = parser.parse_args()
+
+    metrics.start_from_env(logger)
+    sink = None
+    try:
+        # Initialize CAN bus (shared with my_txfn/my_rxfn)
+        get_bus()
         logger.info("CAN bus initialized successfully for ISO-TP.")
 
-        # ISO-TP configuration
-        tp_address = isotp.Address(isotp.AddressingMode.Normal_11bits, txid=message_id + 1, rxid=message_id)
-        tp_layer = isotp.TransportLayer(txfn=my_txfn, rxfn=my_rxfn, address=tp_address)
-        tp_layer.params.tx_padding = 0xAA  # Same as transmitter
-        tp_layer.params.tx_data_length = 8  # Standard CAN frame data length
-        tp_layer.params.stmin = 10  # Minimum separation time (ms)
-        tp_layer.params.blocksize = 0  # No block size limit
-
-        tp_layer.start()  # Start the transport layer
-
-        while True:
-            logger.info("Waiting to receive an ISO-TP message...")
-            try:
-                # Receive a message from the sender
-                message = tp_layer.recv(block=True,timeout=60)
-                if message:
-                    print("Message is ", message.hex())
-                    for msgByte in message:
-                        print("Byte is ",msgByte)
-                    #logger.info("Received ISO-TP message: Data=%x", message.hex())
-                    print(f"Message received: {message.hex()}")
-                    #ack_msg = can.Message(arbitration_id=message.arbitration_id, data=[1], is_extended_id=extended_flag,is_fd=fd_flag)
-                    # Send acknowledgment back to the sender
-                    #acknowledgment_message = b'\x01'  # Acknowledgment payload
-                    #tp_layer.send(ack_msg)
-                    logger.info("Acknowledgment sent successfully.")
-                else:
-                    logger.info("Timeout: No message received.")
-                    print("Timeout: No message received.")
-
-            except isotp.ProtocolError as e:
-                ErrorLogger.error("ProtocolError while receiving ISO-TP message: %s", e)
-
-            except can.CanError as e:
-                ErrorLogger.error("CAN error occurred while receiving a message: %s", e)
-
-except VectorInitializationError as e:
-    ErrorLogger.error(
-        "VectorInitializationError: Ensure Vector CAN hardware is connected and configured correctly: %s", e
-    )
-except ValueError as e:
-    ErrorLogger.error("Invalid parameter provided for CAN Bus initialization: %s", e)
-except OSError as e:
-    ErrorLogger.error("OSError likely due to hardware or system issues: %s", e)
-except can.CanError as e:
-    ErrorLogger.error("General CAN-related issue occurred during initialization: %s", e)
-except Exception as e:
-    ErrorLogger.error("Unexpected exception occurred: %s", e)
-finally:
-    logger.info("ISO-TP receive operation complete.")
-    if 'tp_layer' in locals():
-        tp_layer.stop()
+        if args.output:
+            sink = ImageSink(args.size, args.output, args.base_address).open()
+        tp_layer = create_tp_layer()
+        with metrics.profiled():
+            receive_loop(tp_layer, sink.on_block if sink is not None else None)
+
+    except VectorInitializationError as e:
+        ErrorLogger.error(
+            "VectorInitializationError: Ensure Vector CAN hardware is connected and configured correctly: %s", e
+        )
+    except ValueError as e:
+        ErrorLogger.error("Invalid parameter provided for CAN Bus initialization: %s", e)
+    except OSError as e:
+        ErrorLogger.error("OSError likely due to hardware or system issues: %s", e)
+    except can.CanError as e:
+        ErrorLogger.error("General CAN-related issue occurred during initialization: %s", e)
+    except Exception as e:
+        ErrorLogger.error("Unexpected exception occurred: %s", e)
+    finally:
+        logger.info("ISO-TP receive operation complete.")
+        if 'tp_layer' in locals():
+            tp_layer.stop()
+        if sink is not None:
+            logger.info("Wrote %d bytes to %s at %.1f KiB/s.", sink.bytes_written, args.output,
+                        sink.bytes_per_second / 1024)
+            sink.close()
+        bus_manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,258 @@
-from time import sleep
+import time
 import isotp
 import can
-import logging
-
-# Logger setup
-
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-error_file_handler = logging.FileHandler("isotp_sender_errors.log")
-error_file_handler.setFormatter(error_formatter)
-error_file_handler.setLevel(logging.ERROR)
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(error_formatter)
-error_console_handler.setLevel(logging.ERROR)
-ErrorLogger.addHandler(error_file_handler)
-ErrorLogger.addHandler(error_console_handler)
-
-logger = logging.getLogger("GeneralLogger")
-logger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)
-file_handler = logging.FileHandler("isotp_sender.log")
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-fd_flag = False
+import metrics
+from can_bus_manager import bus_manager
+from isotp_profiles import load_profile, profile_is_fd
+from logging_setup import setup_logging
+from firmware_stream import FirmwareImage, default_block_size
+from compression import BlockCompressor, data_format
+from integrity import RunningDigest, check_memory_ok
+from image_loader import image_format, load_image
+from block_protocol import (
+    ACK, END_ACK, block_payload_size, compressed_payload_size, decode_ack, decode_end_ack, encode_block,
+    encode_compressed_block, encode_end, is_protocol_message, message_type, new_transfer_id
+)
+
+# Logging, see logging_setup.py
+logger, ErrorLogger = setup_logging("isotp_sender.log", "isotp_sender_errors.log")
+
 extended_flag = False
 channel_number = 0
 message_id = 0x33
 retries = 3
 time_out_in_seconds = 5
+isotp_profile = "isotp_default"  # Used unless another profile is active, see isotp_profiles
+isotp_params = load_profile(isotp_profile)
+fd_flag = profile_is_fd(isotp_params)  # Bus opened in CAN-FD mode for FD profiles
+window_size = 8  # Blocks sent ahead of the oldest unacknowledged one
+ack_timeout_in_seconds = 1.0  # Time before an unacknowledged block is resent
+compression_method = None  # "zlib" or "lzma" compresses every block, see compression.py
+compress_ahead = 8  # Blocks compressed ahead of the window, see BlockCompressor
+
+# Transfer metrics, see metrics.py
+frame_metrics = metrics.IsoTpMetrics("isotp_sender")
+block_latency = metrics.histogram("isotp_sender.block_latency")  # Block sent -> ACK received
+block_retries = metrics.counter("isotp_sender.block_retries")
+protocol_errors = metrics.counter("isotp_sender.protocol_errors")
+can_errors = metrics.counter("isotp_sender.can_errors")
+
+def get_bus() -> can.BusABC:
+    # Opened once and reused for every frame of the transfer
+    return bus_manager.get_bus(channel=channel_number, fd=fd_flag, app_name="udsWithIsoTp")
 
 def my_rxfn(timeout:float) -> isotp.CanMessage:
-    bus=can.Bus(interface="vector", channel=channel_number, app_name="udsWithIsoTp", fd=fd_flag)
-    canMsg = bus.recv(timeout)
+    canMsg = get_bus().recv(timeout)
     if(canMsg != None):
+        frame_metrics.on_rx(canMsg.data)
         return isotp.CanMessage(arbitration_id=canMsg.arbitration_id,
                                 data = canMsg.data,
                                 extended_id=canMsg.is_extended_id,
-                                is_fd=canMsg.is_fd)
+                                is_fd=canMsg.is_fd,
+                                bitrate_switch=canMsg.bitrate_switch)
     else:
         return None
 
 
 
 def my_txfn(isotp_msg:isotp.CanMessage):
-    print("I am here")
-    bus=can.Bus(interface="vector", channel=channel_number, app_name="udsWithIsoTp", fd=fd_flag)
     msg = can.Message(arbitration_id=isotp_msg.arbitration_id, 
                       data=isotp_msg.data, 
                       is_extended_id=isotp_msg.is_extended_id,
-                      is_fd=isotp_msg.is_fd)
-    bus.send(msg)
+                      is_fd=isotp_msg.is_fd,
+                      bitrate_switch=isotp_msg.bitrate_switch)
+    bus_manager.send(msg, channel=channel_number, fd=fd_flag, app_name="udsWithIsoTp")
+    frame_metrics.on_tx(isotp_msg.data)
+
+
+def create_tp_layer() -> isotp.TransportLayer:
+    # ISO-TP configuration
+    tp_address = isotp.Address(isotp.AddressingMode.Normal_11bits, txid=message_id, rxid=message_id + 1)
+    params = dict(isotp_params)
+    # blocking_send makes send() return only once the payload is on the wire,
+    # so progress reports reflect what was actually transmitted
+    params['blocking_send'] = True
+    tp_layer = isotp.TransportLayer(txfn=my_txfn, rxfn=my_rxfn, address=tp_address, params=params,
+                                    error_handler=frame_metrics.on_error)
+    tp_layer.start()
+    return tp_layer
+
+
+def transmit_block(tp_layer, transfer_id, data, seq, payload_size, compressor=None, base_address=0):
+    offset = seq * payload_size
+    try:
+        packed = compressor.get(seq) if compressor is not None else None
+        if packed is None:
+            tp_layer.send(encode_block(transfer_id, seq, base_address + offset, data[offset:offset + payload_size]))
+        else:
+            tp_layer.send(encode_compressed_block(transfer_id, seq, base_address + offset, compressor.data_format,
+                                                  packed))
+    except can.CanError as e:
+        can_errors.value += 1
+        ErrorLogger.error("CanError while sending block %d: %s", seq, e)
+    except Exception as e:
+        protocol_errors.value += 1
+        # A failed block stays outstanding and is retransmitted after its ack timeout
+        ErrorLogger.error("ProtocolError while sending block %d: %s", seq, e)
+
 
+def finish_transfer(tp_layer, transfer_id, block_count, total_size, crc32, sha256) -> bool:
+    # END/END_ACK handshake: the receiver reports how many blocks it holds
+    # and whether the digests of what it received match
+    for attempt in range(retries):
+        try:
+            tp_layer.send(encode_end(transfer_id, block_count, total_size, crc32, sha256))
+        except Exception as e:
+            ErrorLogger.error("Error while sending end of transfer: %s", e)
+            continue
+        deadline = time.monotonic() + ack_timeout_in_seconds
+        while time.monotonic() < deadline:
+            message = tp_layer.recv(block=True, timeout=max(0.0, deadline - time.monotonic()))
+            if message is None or message_type(message) != END_ACK or not is_protocol_message(message):
+                continue  # Late duplicate ACKs are expected here
+            acknowledged_id, blocks_received, status = decode_end_ack(message)
+            if acknowledged_id != transfer_id:
+                continue  # END_ACK of an earlier transfer
+            if blocks_received != block_count:
+                ErrorLogger.error("Receiver holds %d of %d blocks.", blocks_received, block_count)
+                return False
+            if status != check_memory_ok:
+                ErrorLogger.error("Receiver reports an image digest mismatch (CRC32 %08X sent).", crc32)
+                return False
+            logger.info("Acknowledgment received: %d blocks, %d bytes, CRC32 %08X verified.",
+                        block_count, total_size, crc32)
+            return True
+        logger.warning("No end of transfer acknowledgment received. Retrying...")
+    print("Message transmission failed after retries.")
+    ErrorLogger.error("Message transmission failed after retries.")
+    return False
 
-def canTpSend(msg):
 
+def send_blocks(tp_layer, data, message_size=default_block_size, progress_callback=None, cancel_event=None,
+                compression=None, base_address=0) -> bool:
+    # Sends data as sequence-numbered blocks with up to window_size blocks
+    # waiting for their ACK. Only blocks whose ACK does not arrive within
+    # ack_timeout_in_seconds are retransmitted, at most `retries` times each.
+    # progress_callback(bytes_acknowledged, total_bytes) is called per ACK.
+    # compression ("zlib", "lzma", defaults to compression_method) sends
+    # blocks compressed by a background thread while earlier ones are on the bus.
+    # The image's CRC32/SHA-256 are computed on another thread as blocks go
+    # out and checked by the receiver at the end of the transfer.
+    # Block offsets start at base_address (a segment's address, see send_segments).
+    # Every call is a new transfer id, see block_protocol.
+    payload_size = block_payload_size(message_size)
+    method = compression or compression_method
+    compressor = None
+    if method:
+        compressor = BlockCompressor(data, payload_size, compressed_payload_size(message_size), data_format(method),
+                                     window_size + compress_ahead)
+    digest = RunningDigest()
     try:
-            print("CAN bus initialized successfully.")
-            logger.info("CAN bus initialized successfully.")
-
-            # ISO-TP configuration
-            tp_address = isotp.Address(isotp.AddressingMode.Normal_11bits, txid=message_id, rxid=message_id + 1)
-            tp_layer = isotp.TransportLayer(txfn=my_txfn, rxfn=my_rxfn, address=tp_address)
-            #tp_layer.params.blocksize = 0  # No block size limit
-
-            # tp_layer.params.tx_arbitration_id = message_ids
-            # tp_layer.params.rx_arbitration_id = message_id + 1
-            tp_layer.start()
-            acknowledgment_received = False
-            retries = 3
-
-            #msg = bytearray([0, 25, 0, 1, 3, 1, 4, 1,1,1,1,1,11,1,1])
-
-            while not acknowledgment_received and retries > 0:
-                try:
-                    tp_layer.send(msg)
-                    #print(f"ISO-TP Message sent: {msg}")
-                    logger.info("ISO-TP Message sent with arbitration_id=0x%X and data=%s", message_id, msg)
-
-                    ack = True # Wait for acknowledgment
-                    if ack:
-                        print("Acknowledgment received.")
-                        logger.info("Acknowledgment received: %s", ack)
-                        acknowledgment_received = True
-                    else:
-                        print("No acknowledgment received. Retrying...")
-                        logger.warning("No acknowledgment received. Retrying...")
-                        retries -= 1
-
-                except Exception as e:
-                    ErrorLogger.error("ProtocolError while sending ISO-TP message: %s", e)
-                    print(f"Error: ProtocolError: {e}")
-                    retries -= 1
-
-                except can.CanError as e:
-                    ErrorLogger.error("CanError while sending ISO-TP message: %s", e)
-                    print(f"Error: CanError: {e}")
-                    retries -= 1
-
-            if not acknowledgment_received:
+        return _send_window(tp_layer, new_transfer_id(), data, payload_size, progress_callback, cancel_event,
+                            compressor, digest, base_address)
+    finally:
+        digest.result()  # Ends the worker, also when the transfer failed
+        if compressor is not None:
+            compressor.stop()
+            logger.info("Compressed %d bytes to %d bytes with %s.", len(data), compressor.compressed_size, method)
+
+
+def _send_window(tp_layer, transfer_id, data, payload_size, progress_callback, cancel_event, compressor, digest,
+                 base_address=0) -> bool:
+    total_size = len(data)
+    block_count = (total_size + payload_size - 1) // payload_size
+    outstanding = {}  # seq -> [ack deadline, attempts, sent at]
+    next_seq = 0
+    acknowledged_bytes = 0
+
+    while next_seq < block_count or outstanding:
+        if cancel_event is not None and cancel_event.is_set():
+            logger.warning("Transfer cancelled with %d of %d bytes acknowledged", acknowledged_bytes, total_size)
+            return False
+
+        # Fill the window
+        while next_seq < block_count and len(outstanding) < window_size:
+            offset = next_seq * payload_size
+            digest.add(offset, data[offset:offset + payload_size])
+            transmit_block(tp_layer, transfer_id, data, next_seq, payload_size, compressor, base_address)
+            now = time.monotonic()
+            outstanding[next_seq] = [now + ack_timeout_in_seconds, 1, now]
+            next_seq += 1
+
+        # Collect ACKs until the oldest deadline
+        timeout = max(0.0, min(entry[0] for entry in outstanding.values()) - time.monotonic())
+        message = tp_layer.recv(block=True, timeout=timeout)
+        while message is not None:
+            if message_type(message) == ACK and is_protocol_message(message):
+                acknowledged_id, seq = decode_ack(message)
+                # ACKs of an earlier (e.g. cancelled) transfer are ignored
+                entry = outstanding.pop(seq, None) if acknowledged_id == transfer_id else None
+                if entry is not None:
+                    if compressor is not None:
+                        compressor.release(seq)
+                    block_latency.observe(time.monotonic() - entry[2])
+                    acknowledged_bytes += min(payload_size, total_size - seq * payload_size)
+                    if progress_callback is not None:
+                        progress_callback(acknowledged_bytes, total_size)
+            message = tp_layer.recv()
+
+        # Selective retransmission of the blocks whose ACK timed out
+        now = time.monotonic()
+        for seq, entry in list(outstanding.items()):
+            if entry[0] > now:
+                continue
+            if entry[1] >= retries:
                 print("Message transmission failed after retries.")
-                ErrorLogger.error("Message transmission failed after retries.")
+                ErrorLogger.error("Block %d not acknowledged after %d attempts.", seq, entry[1])
+                return False
+            logger.warning("No acknowledgment received for block %d. Retrying...", seq)
+            block_retries.value += 1
+            transmit_block(tp_layer, transfer_id, data, seq, payload_size, compressor, base_address)
+            entry[2] = time.monotonic()
+            entry[0] = entry[2] + ack_timeout_in_seconds
+            entry[1] += 1
+
+    crc32, sha256 = digest.result()
+    return finish_transfer(tp_layer, transfer_id, block_count, total_size, crc32, sha256)
+
+
+def send_segments(tp_layer, image, message_size=default_block_size, progress_callback=None, cancel_event=None,
+                  compression=None) -> bool:
+    # Sends the segments of a sparse image (see image_loader) one transfer
+    # each, with block offsets at the segments' addresses; the gaps between
+    # segments are not sent. progress_callback counts over all segments.
+    total = image.size
+    sent = 0
+    for segment in image:
+        def segment_progress(bytes_acknowledged, _, done=sent):
+            if progress_callback is not None:
+                progress_callback(done + bytes_acknowledged, total)
+
+        logger.info("Sending segment at 0x%08X: %d bytes", segment.address, len(segment.data))
+        with memoryview(segment.data) as data:
+            if not send_blocks(tp_layer, data, message_size, segment_progress, cancel_event, compression,
+                               segment.address):
+                return False
+        sent += len(segment.data)
+    return True
+
+
+def run_transfer(transfer) -> bool:
+    # Opens the bus and a transport layer, runs transfer(tp_layer) and maps
+    # initialization errors to log entries the same way for every entry point
+    metrics.start_from_env(logger)
+    try:
+        # Open (or reuse) the pooled bus here so init errors surface in this thread
+        get_bus()
+        print("CAN bus initialized successfully.")
+        logger.info("CAN bus initialized successfully.")
+
+        tp_layer = create_tp_layer()
+        try:
+            with metrics.profiled():
+                return transfer(tp_layer)
+        finally:
+            tp_layer.stop()
 
     except can.interfaces.vector.exceptions.VectorInitializationError as e:
         ErrorLogger.error("VectorInitializationError: %s", e)
@@ -115,10 +261,36 @@ def canTpSend(msg):
     except OSError as e:
         ErrorLogger.error("OSError likely due to hardware or system issues: %s", e)
     except can.CanError as e:
+        can_errors.value += 1
         ErrorLogger.error("A general CAN-related issue occurred: %s", e)
     except Exception as e:
         ErrorLogger.error("Unexpected exception occurred: %s", e)
     finally:
         logger.info("ISO-TP operation complete.")
+        logger.info("Sender stats: %s", metrics.format_snapshot(metrics.snapshot("isotp_sender.")))
+    return False
+
+
+def canTpSend(msg, compression=None) -> bool:
+    data = memoryview(bytes(msg))
+    return run_transfer(lambda tp_layer: send_blocks(tp_layer, data, compression=compression))
+
+
+def canTpSendFile(file_name, block_size=default_block_size, progress_callback=None, cancel_event=None,
+                  compression=None) -> bool:
+    # Streams the memory-mapped file as acknowledged blocks of block_size
+    # bytes (header included), one ISO-TP transfer per block.
+    # progress_callback(bytes_acknowledged, total_bytes) is called per block.
+    # Setting cancel_event stops the transfer before the next block.
+    # HEX, S-record and ELF files only send their populated address ranges.
+    def transfer(tp_layer):
+        if image_format(file_name) is not None:
+            image = load_image(file_name)
+            logger.info("Sending %s: %d bytes in %d segment(s) spanning %d bytes",
+                        file_name, image.size, len(image), image.span)
+            return send_segments(tp_layer, image, block_size, progress_callback, cancel_event, compression)
+        with FirmwareImage(file_name, block_size) as image:
+            logger.info("Sending %s: %d bytes", file_name, image.size)
+            return send_blocks(tp_layer, image.view, block_size, progress_callback, cancel_event, compression)
 
-    sleep(1)
\ No newline at end of file
+    return run_transfer(transfer)
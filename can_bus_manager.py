@@ -0,0 +1,111 @@
+import atexit
+import threading
+import time
+import can
+
+# Interface used by every script unless overridden.
+# Set to "virtual" to run without Vector hardware (e.g. for benchmarks).
+default_interface = "vector"
+
+
+def open_bus(interface=None, channel=0, fd=False, app_name=None, **kwargs) -> can.BusABC:
+    # Opens a bus the same way for every script; Vector hardware also gets
+    # the application name its channel mapping is configured under
+    interface = interface or default_interface
+    if interface == "vector" and app_name is not None:
+        kwargs["app_name"] = app_name
+    return can.Bus(interface=interface, channel=channel, fd=fd, **kwargs)
+
+
+class BusManager:
+    # Keeps one open can.Bus per (interface, channel, fd) so that the ISO-TP
+    # txfn/rxfn callbacks do not reopen the driver for every single frame.
+
+    def __init__(self):
+        self._buses = {}
+        self._send_locks = {}
+        self._lock = threading.Lock()
+
+    def get_bus(self, interface=None, channel=0, fd=False, app_name=None, **kwargs) -> can.BusABC:
+        interface = interface or default_interface
+        key = (interface, channel, fd)
+        bus = self._buses.get(key)
+        if bus is not None:
+            return bus
+
+        with self._lock:
+            # Another thread may have opened it while we were waiting
+            bus = self._buses.get(key)
+            if bus is None:
+                bus = open_bus(interface, channel, fd, app_name, **kwargs)
+                self._buses[key] = bus
+                self._send_locks[key] = threading.Lock()
+            return bus
+
+    def send(self, msg: can.Message, interface=None, channel=0, fd=False, app_name=None, timeout=None):
+        interface = interface or default_interface
+        bus = self.get_bus(interface, channel, fd, app_name)
+        # The isotp worker thread and the application thread may both transmit
+        with self._send_locks[(interface, channel, fd)]:
+            bus.send(msg, timeout)
+
+    def close(self, interface=None, channel=0, fd=False):
+        key = (interface or default_interface, channel, fd)
+        with self._lock:
+            bus = self._buses.pop(key, None)
+            self._send_locks.pop(key, None)
+        if bus is not None:
+            bus.shutdown()
+
+    def shutdown(self):
+        with self._lock:
+            buses = list(self._buses.values())
+            self._buses.clear()
+            self._send_locks.clear()
+        for bus in buses:
+            bus.shutdown()
+
+
+# Process wide manager shared by the sender, receiver and GUI
+bus_manager = BusManager()
+atexit.register(bus_manager.shutdown)
+
+
+def frame_bits(msg: can.Message) -> int:
+    # Approximate size of a frame on the wire (no bit stuffing):
+    # 47 bits of overhead for 11-bit IDs, 67 for 29-bit IDs, plus the data
+    overhead = 67 if msg.is_extended_id else 47
+    return overhead + 8 * len(msg.data)
+
+
+spin_threshold = 0.001  # Last part of a wait spent spinning instead of sleeping
+
+
+def wait_until(deadline):
+    # Waits until time.perf_counter() reaches deadline. time.sleep alone
+    # overshoots short waits by up to a scheduler tick: sleep for most of
+    # the wait and spin for the rest.
+    remaining = deadline - time.perf_counter()
+    if remaining > 2 * spin_threshold:
+        time.sleep(remaining - spin_threshold)
+    while time.perf_counter() < deadline:
+        pass
+
+
+class BandwidthLimiter:
+    # Paces transmissions to a bit rate shared by every user of a bus.
+    # Each caller reserves the next free slot and sleeps until it starts,
+    # so concurrent senders are serialised fairly without busy waiting.
+
+    def __init__(self, bits_per_second):
+        self.bits_per_second = bits_per_second
+        self._next_free = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, bits):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_free)
+            self._next_free = start + bits / self.bits_per_second
+        if start > now:
+            time.sleep(start - now)
@@ -0,0 +1,141 @@
+import lzma
+import threading
+import zlib
+
+# Optional compression of firmware transfers. The method is announced with
+# a dataFormatIdentifier byte as in UDS RequestDownload: the high nibble is
+# the compression method, the low nibble the encryption method (always 0).
+#   0x00  uncompressed
+#   0x10  zlib (deflate with zlib header)
+#   0x20  LZMA2, raw stream with lzma_filters
+#
+# The block protocol (canTpSend) compresses every block on its own, so a
+# block can be retransmitted or arrive out of order and still be decoded;
+# the UDS download compresses the whole image as one stream cut into
+# TransferData blocks.
+
+uncompressed = 0x00
+data_formats = {None: uncompressed, "zlib": 0x10, "lzma": 0x20}
+zlib_level = 6
+lzma_filters = [{"id": lzma.FILTER_LZMA2, "preset": 6, "dict_size": 1 << 20}]
+
+
+def data_format(method) -> int:
+    # dataFormatIdentifier of a method name ("zlib", "lzma" or None)
+    try:
+        return data_formats[method]
+    except KeyError:
+        raise ValueError(f"Unknown compression method '{method}'") from None
+
+
+def is_supported(data_format_identifier) -> bool:
+    return data_format_identifier in data_formats.values()
+
+
+def compress(data, data_format_identifier) -> bytes:
+    if data_format_identifier == 0x10:
+        return zlib.compress(data, zlib_level)
+    if data_format_identifier == 0x20:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=lzma_filters)
+    raise ValueError(f"Unsupported dataFormatIdentifier 0x{data_format_identifier:02X}")
+
+
+def decompress(data, data_format_identifier) -> bytes:
+    if data_format_identifier == 0x10:
+        return zlib.decompress(data)
+    if data_format_identifier == 0x20:
+        return lzma.decompress(data, format=lzma.FORMAT_RAW, filters=lzma_filters)
+    raise ValueError(f"Unsupported dataFormatIdentifier 0x{data_format_identifier:02X}")
+
+
+def stream_compressor(data_format_identifier):
+    # Object with compress(data) and flush(), for one continuous stream
+    if data_format_identifier == 0x10:
+        return zlib.compressobj(zlib_level)
+    if data_format_identifier == 0x20:
+        return lzma.LZMACompressor(format=lzma.FORMAT_RAW, filters=lzma_filters)
+    raise ValueError(f"Unsupported dataFormatIdentifier 0x{data_format_identifier:02X}")
+
+
+def stream_decompressor(data_format_identifier):
+    # Object with decompress(data) and eof, the counterpart of stream_compressor
+    if data_format_identifier == 0x10:
+        return zlib.decompressobj()
+    if data_format_identifier == 0x20:
+        return lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=lzma_filters)
+    raise ValueError(f"Unsupported dataFormatIdentifier 0x{data_format_identifier:02X}")
+
+
+def stream_finished(decompressor) -> bool:
+    # Raw LZMA2 streams carry an end marker too, so eof works for both
+    return decompressor.eof
+
+
+class BlockCompressor:
+    # Compresses the blocks of data one by one on a background thread, ahead
+    # of the transmission. get(seq) waits until block seq is ready and returns
+    # its compressed bytes, or None when compressing did not make it smaller
+    # than the block or than max_size; such blocks are sent as they are.
+    # At most max_pending blocks are held: the sender's window (kept for
+    # retransmissions) plus the ones compressed ahead of it. release(seq)
+    # drops an acknowledged block, so memory stays flat whatever the image
+    # size. max_pending must be larger than the sender's window.
+
+    def __init__(self, data, block_size, max_size, data_format_identifier, max_pending=64):
+        self.data = data
+        self.block_size = block_size
+        self.max_size = max_size
+        self.data_format = data_format_identifier
+        self.max_pending = max_pending
+        self.block_count = (len(data) + block_size - 1) // block_size
+        self.blocks = {}  # seq -> compressed bytes or None, until released
+        self.compressed_size = 0  # Bytes sent for the blocks done so far
+        self._done = 0
+        self._error = None
+        self._stopped = False
+        self._ready = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="block-compressor", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for seq in range(self.block_count):
+                with self._ready:
+                    self._ready.wait_for(lambda: self._stopped or len(self.blocks) < self.max_pending)
+                    if self._stopped:
+                        return
+                with self.data[seq * self.block_size:(seq + 1) * self.block_size] as block:
+                    packed = compress(block, self.data_format)
+                    size = len(block)
+                if len(packed) < size and len(packed) <= self.max_size:
+                    size = len(packed)
+                else:
+                    packed = None
+                with self._ready:
+                    self.blocks[seq] = packed
+                    self.compressed_size += size
+                    self._done = seq + 1
+                    self._ready.notify_all()
+        except Exception as e:
+            with self._ready:
+                self._error = e
+                self._ready.notify_all()
+
+    def get(self, seq):
+        if self._done <= seq:
+            with self._ready:
+                self._ready.wait_for(lambda: self._done > seq or self._error is not None)
+                if self._error is not None:
+                    raise self._error
+        return self.blocks.get(seq)
+
+    def release(self, seq):
+        with self._ready:
+            self.blocks.pop(seq, None)
+            self._ready.notify_all()
+
+    def stop(self):
+        with self._ready:
+            self._stopped = True
+            self._ready.notify_all()
+        self._thread.join()
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import os
+import struct
+
+import can
+from udsoncan import services
+from udsoncan.client import Client
+
+import uds_client
+from firmware_stream import FirmwareImage
+from logging_setup import setup_logging
+
+# Delta flashing: the image is cut into blocks, every block is hashed, and
+# only the address ranges whose blocks differ from the previously flashed
+# image go through RequestDownload/TransferData/RequestTransferExit.
+#   python delta_flash.py new.bin --base old.bin
+#   python delta_flash.py new.bin --base ecu.blockhash   index written by the last flash
+#   python delta_flash.py new.bin --base old.bin --plan  only print the ranges
+#
+# Block hashes of an image are cached next to it in <image>.blockhash and
+# reused as long as the image's size and modification time are unchanged.
+# After a successful flash the hashes of what the ECU now holds can be
+# saved with --save-state, so the next build is compared against them even
+# when the old image file has been overwritten.
+
+logger, ErrorLogger = setup_logging("can_sender.log", "can_sender_errors.log")
+
+delta_block_size = 4096
+index_suffix = ".blockhash"
+index_magic = b"BLKHASH1"
+index_header = struct.Struct("<8sIQq")  # magic, block size, image size, image mtime (ns)
+digest_size = 16  # BLAKE2b-128 per block
+set_image_size_routine = 0xFF01  # See uds_server.set_image_size
+
+
+class BlockHashes:
+    # Digests of the blocks of one image, concatenated
+
+    def __init__(self, block_size, image_size, digests, mtime_ns=0):
+        self.block_size = block_size
+        self.image_size = image_size
+        self.digests = digests
+        self.mtime_ns = mtime_ns
+
+    def __len__(self):
+        return len(self.digests) // digest_size
+
+    def digest(self, index):
+        return self.digests[index * digest_size:(index + 1) * digest_size]
+
+    def save(self, file_name):
+        with open(file_name, "wb") as file:
+            file.write(index_header.pack(index_magic, self.block_size, self.image_size, self.mtime_ns))
+            file.write(self.digests)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "rb") as file:
+            content = file.read()
+        magic, block_size, image_size, mtime_ns = index_header.unpack_from(content)
+        if magic != index_magic:
+            raise ValueError(f"{file_name} is not a block hash index")
+        return cls(block_size, image_size, content[index_header.size:], mtime_ns)
+
+
+def hash_blocks(view, block_size=delta_block_size) -> bytes:
+    digests = bytearray()
+    for offset in range(0, len(view), block_size):
+        digests += hashlib.blake2b(view[offset:offset + block_size], digest_size=digest_size).digest()
+    return bytes(digests)
+
+
+def image_hashes(file_name, block_size=delta_block_size) -> BlockHashes:
+    # Block hashes of an image file, from its cached index when still valid
+    stat = os.stat(file_name)
+    index_file = file_name + index_suffix
+    try:
+        cached = BlockHashes.load(index_file)
+        if (cached.block_size, cached.image_size, cached.mtime_ns) == (block_size, stat.st_size, stat.st_mtime_ns):
+            return cached
+    except (OSError, ValueError, struct.error):
+        pass
+    with FirmwareImage(file_name) as image:
+        hashes = BlockHashes(block_size, image.size, hash_blocks(image.view, block_size), stat.st_mtime_ns)
+    try:
+        hashes.save(index_file)
+    except OSError as e:
+        logger.warning("Could not cache block hashes in %s: %s", index_file, e)
+    return hashes
+
+
+def base_hashes(base, block_size=delta_block_size) -> BlockHashes:
+    # base is an old image or a saved index
+    if base.endswith(index_suffix):
+        return BlockHashes.load(base)
+    return image_hashes(base, block_size)
+
+
+def changed_ranges(old, new) -> list:
+    # (offset, length) of the new image's blocks that differ from old, with
+    # adjacent blocks merged so each range costs one download
+    ranges = []
+    for index in range(len(new)):
+        offset = index * new.block_size
+        length = min(new.block_size, new.image_size - offset)
+        # A short last block only matches a block of the same length
+        if index < len(old) and length == min(old.block_size, old.image_size - offset) \
+                and old.digest(index) == new.digest(index):
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+def set_image_size(client, memory_address, size):
+    # addressAndLengthFormatIdentifier 0x44: 4-byte size, 4-byte address
+    record = b'\x44' + memory_address.to_bytes(4, 'big') + size.to_bytes(4, 'big')
+    client.start_routine(set_image_size_routine, record)
+
+
+def flash_delta(client, file_name, base, memory_address=None, progress_callback=None) -> bool:
+    # Flashes the blocks of file_name that differ from base (old image or
+    # index). progress_callback(bytes_sent, total_bytes) counts changed bytes.
+    if memory_address is None:
+        memory_address = uds_client.flash_memory_address
+    old = base_hashes(base)
+    new = image_hashes(file_name, old.block_size)
+    ranges = changed_ranges(old, new)
+    total = sum(length for _, length in ranges)
+    logger.info("Delta flash of %s: %d bytes in %d range(s) of %d bytes changed",
+                file_name, total, len(ranges), new.image_size)
+
+    client.change_session(services.DiagnosticSessionControl.Session.programmingSession)
+    sent = 0
+    with FirmwareImage(file_name) as image:
+        for offset, length in ranges:
+            def range_progress(bytes_sent, _, done=sent):
+                if progress_callback is not None:
+                    progress_callback(done + bytes_sent, total)
+
+            with image.view[offset:offset + length] as data:
+                if not uds_client.download(client, data, memory_address + offset, range_progress,
+                                           uds_client.flash_compression):
+                    return False
+            sent += length
+    if new.image_size != old.image_size:
+        set_image_size(client, memory_address, new.image_size)
+    logger.info("Delta flash of %s complete: %d of %d bytes sent.", file_name, total, new.image_size)
+    return True
+
+
+def save_state(file_name, state_file):
+    # Records the image now on the ECU, as base for the next delta flash
+    image_hashes(file_name).save(state_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flash only the blocks that changed since the previous image")
+    parser.add_argument("image")
+    parser.add_argument("--base", required=True, help="previous image, or its .blockhash index")
+    parser.add_argument("--address", type=lambda text: int(text, 0), default=uds_client.flash_memory_address)
+    parser.add_argument("--plan", action="store_true", help="print the changed ranges without flashing")
+    parser.add_argument("--save-state", help="write the index of the flashed image to this file")
+    parser.add_argument("--interface", default="vector")
+    parser.add_argument("--channel", default=uds_client.channel_number)
+    args = parser.parse_args()
+
+    if args.plan:
+        old = base_hashes(args.base)
+        new = image_hashes(args.image, old.block_size)
+        ranges = changed_ranges(old, new)
+        for offset, length in ranges:
+            print(f"0x{args.address + offset:08X} {length} bytes")
+        print(f"{sum(length for _, length in ranges)} of {new.image_size} bytes changed")
+        return
+
+    kwargs = {"app_name": "UDS trial"} if args.interface == "vector" else {}
+    try:
+        with can.Bus(interface=args.interface, channel=args.channel, fd=uds_client.fd_flag, **kwargs) as bus:
+            with Client(uds_client.create_uds_connection(bus), config=uds_client.client_config) as client:
+                if flash_delta(client, args.image, args.base, args.address) and args.save_state:
+                    save_state(args.image, args.save_state)
+    except can.CanError as e:
+        ErrorLogger.error("CAN error occurred: %s", e)
+    except Exception as e:
+        ErrorLogger.error("Delta flash failed: %s", e)
+
+
+if __name__ == "__main__":
+    main()
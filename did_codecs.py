@@ -0,0 +1,104 @@
+import struct
+
+from udsoncan import DidCodec
+
+# DID codecs built once per DID instead of once per decode. udsoncan turns a
+# pack string into a new DidCodec (and struct.unpack call) and a codec class
+# into a new instance every time a DID is decoded. The registry keeps one
+# ready instance per DID, pack strings compiled to struct.Struct, and can
+# decode every DID of a ReadDataByIdentifier response in one pass.
+
+
+class StructCodec(DidCodec):
+    # Same results as DidCodec(packstr), with the format compiled once
+    def __init__(self, packstr):
+        super().__init__(packstr)
+        self.struct = struct.Struct(packstr)
+
+    def encode(self, *did_value):
+        return self.struct.pack(*did_value)
+
+    def decode(self, did_payload):
+        return self.struct.unpack(did_payload)
+
+    def __len__(self):
+        return self.struct.size
+
+
+def make_codec(definition) -> DidCodec:
+    if isinstance(definition, DidCodec):
+        return definition
+    if isinstance(definition, str):
+        return StructCodec(definition)
+    if isinstance(definition, type) and issubclass(definition, DidCodec):
+        return definition()
+    raise ValueError(f"Invalid DID codec definition: {definition!r}")
+
+
+class DidCodecRegistry:
+    def __init__(self, definitions):
+        # definitions: the udsoncan data_identifiers mapping, DID -> pack string,
+        # DidCodec class or instance, plus an optional 'default' entry
+        self.codecs = {}
+        self.default = None
+        self._instances = {}  # pack string or codec class -> codec, one instance per definition
+        for did, definition in definitions.items():
+            self.register(did, definition)
+
+    def register(self, did, definition):
+        # Keyed by the definition itself, not its id(): the registry keeps no
+        # reference to it, and a new object could reuse the id of a freed one
+        if isinstance(definition, (str, type)):
+            codec = self._instances.get(definition)
+            if codec is None:
+                codec = self._instances[definition] = make_codec(definition)
+        else:
+            codec = make_codec(definition)  # An instance is used as it is
+        if did == 'default':
+            self.default = codec
+        else:
+            self.codecs[did] = codec
+
+    def codec(self, did) -> DidCodec:
+        codec = self.codecs.get(did, self.default)
+        if codec is None:
+            raise KeyError(f"No codec for DID 0x{did:04X}")
+        return codec
+
+    def payload_size(self, did):
+        # None when the codec reads all the remaining data
+        try:
+            return len(self.codec(did))
+        except DidCodec.ReadAllRemainingData:
+            return None
+
+    def config(self) -> dict:
+        # Ready instances for client_config['data_identifiers']
+        config = dict(self.codecs)
+        if self.default is not None:
+            config['default'] = self.default
+        return config
+
+    def dids(self):
+        return sorted(self.codecs)
+
+    def decode_response(self, data) -> dict:
+        # data: ReadDataByIdentifier response without the SID, DID + value records
+        values = {}
+        offset = 0
+        end = len(data)
+        while offset + 2 <= end:
+            did = (data[offset] << 8) | data[offset + 1]
+            if did == 0 and not any(data[offset:]):
+                break  # Zero padding
+            codec = self.codec(did)
+            offset += 2
+            try:
+                size = len(codec)
+            except DidCodec.ReadAllRemainingData:
+                size = end - offset
+            if offset + size > end:
+                raise ValueError(f"Response truncated in DID 0x{did:04X}")
+            values[did] = codec.decode(data[offset:offset + size])
+            offset += size
+        return values
@@ -0,0 +1,140 @@
+import bisect
+import csv
+import json
+import os
+import struct
+from array import array
+
+# Data identifiers served by uds_server. Every positive ReadDataByIdentifier
+# response is built once when the store is loaded, reads only look it up.
+# All records (DID + value) are laid out in DID order in one buffer, so a
+# range of DIDs is a single memoryview slice of it.
+#
+# Files are picked by extension:
+#   .json  {"0xF190": "ascii:ABCDE0123456789", "0xF18C": "0102030405"}
+#   .csv   did,value rows with the same value notation (header optional)
+#   other  binary records: DID (u16), length (u16), data, big endian
+
+binary_record_header = struct.Struct(">HH")
+
+
+def parse_did(text) -> int:
+    did = text if isinstance(text, int) else int(str(text).strip(), 16)
+    if not 0 <= did <= 0xFFFF:
+        raise ValueError(f"DID out of range: {text}")
+    return did
+
+
+def parse_value(text) -> bytes:
+    # "ascii:" prefix for text, hexadecimal otherwise
+    text = str(text).strip()
+    if text.startswith("ascii:"):
+        return text[len("ascii:"):].encode("ascii")
+    return bytes.fromhex(text)
+
+
+class DidStore:
+    def __init__(self, values=None):
+        self._values = {}  # DID -> value bytes
+        for did, value in (values or {}).items():
+            self._values[parse_did(did)] = bytes(value)
+        self._compile()
+
+    def _compile(self):
+        self.dids = array('H', sorted(self._values))
+        parts = []
+        self.offsets = array('I')
+        position = 0
+        for did in self.dids:
+            record = did.to_bytes(2, 'big') + self._values[did]
+            parts.append(record)
+            self.offsets.append(position)
+            position += len(record)
+        self.offsets.append(position)
+        self.blob = b''.join(parts)
+        view = memoryview(self.blob)
+        self.records = {}  # DID -> memoryview of DID + value in blob
+        self.responses = {}  # DID -> complete single DID response
+        for index, did in enumerate(self.dids):
+            record = view[self.offsets[index]:self.offsets[index + 1]]
+            self.records[did] = record
+            self.responses[did] = b'\x62' + record
+
+    def __len__(self):
+        return len(self.dids)
+
+    def __contains__(self, did):
+        return did in self._values
+
+    def value(self, did):
+        record = self.records.get(did)
+        return None if record is None else record[2:]
+
+    def response(self, did):
+        return self.responses.get(did)
+
+    def set(self, did, value):
+        # Writes are rare (WriteDataByIdentifier), so the store is simply
+        # recompiled. Responses handed out before stay valid.
+        self._values[did] = bytes(value)
+        self._compile()
+
+    def copy(self):
+        # Shares the compiled, immutable responses until one of them is written
+        clone = DidStore.__new__(DidStore)
+        clone.__dict__.update(self.__dict__)
+        clone._values = dict(self._values)
+        return clone
+
+    def range(self, first, last):
+        # DIDs present in [first, last]
+        return self.dids[bisect.bisect_left(self.dids, first):bisect.bisect_right(self.dids, last)]
+
+    def range_records(self, first, last):
+        # Records of every DID in [first, last], back to back, without copying
+        start = bisect.bisect_left(self.dids, first)
+        end = bisect.bisect_right(self.dids, last)
+        return memoryview(self.blob)[self.offsets[start]:self.offsets[end]]
+
+    def to_binary(self) -> bytes:
+        return b''.join(binary_record_header.pack(did, len(self._values[did])) + self._values[did]
+                        for did in self.dids)
+
+
+def load_json(file_name) -> DidStore:
+    with open(file_name, "r") as file:
+        return DidStore({parse_did(did): parse_value(value) for did, value in json.load(file).items()})
+
+
+def load_csv(file_name) -> DidStore:
+    values = {}
+    with open(file_name, "r", newline="") as file:
+        for row in csv.reader(file):
+            if not row or row[0].strip().lower() == "did":
+                continue
+            values[parse_did(row[0])] = parse_value(row[1])
+    return DidStore(values)
+
+
+def load_binary(file_name) -> DidStore:
+    values = {}
+    with open(file_name, "rb") as file:
+        data = file.read()
+    position = 0
+    while position < len(data):
+        did, length = binary_record_header.unpack_from(data, position)
+        position += binary_record_header.size
+        if position + length > len(data):
+            raise ValueError(f"Truncated record for DID 0x{did:04X} in {file_name}")
+        values[did] = data[position:position + length]
+        position += length
+    return DidStore(values)
+
+
+def load_did_store(file_name) -> DidStore:
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".json":
+        return load_json(file_name)
+    if extension == ".csv":
+        return load_csv(file_name)
+    return load_binary(file_name)
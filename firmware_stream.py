@@ -0,0 +1,163 @@
+import mmap
+import os
+import time
+
+# Largest payload a single ISO-TP transfer carries with the default
+# max_frame_size, so every block fits in one transfer.
+default_block_size = 4095
+
+
+class FirmwareImage:
+    # Read-only, memory-mapped view of a firmware file.
+    # Blocks are handed out as memoryview slices of the mapping, so reading a
+    # block never copies the file into Python objects and peak memory stays
+    # flat regardless of the image size.
+
+    def __init__(self, file_name, block_size=default_block_size):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.file_name = file_name
+        self.block_size = block_size
+        self.size = 0
+        self._file = None
+        self._mmap = None
+        self._view = memoryview(b"")
+
+    def open(self):
+        self._file = open(self.file_name, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size > 0:
+            # mmap cannot map an empty file
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+        return self
+
+    def close(self):
+        self._view.release()
+        self._view = memoryview(b"")
+        self.size = 0
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a block slice; the mapping is
+                # released by the garbage collector once it is dropped
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def view(self) -> memoryview:
+        # Whole image, slicing it does not copy
+        return self._view
+
+    @property
+    def block_count(self) -> int:
+        return (self.size + self.block_size - 1) // self.block_size
+
+    def block(self, index: int) -> memoryview:
+        offset = index * self.block_size
+        return self._view[offset:offset + self.block_size]
+
+    def read(self, offset: int, length: int) -> bytes:
+        # Small copy of the mapped data, e.g. for display
+        return self._view[offset:offset + length].tobytes()
+
+    def blocks(self, block_size=None):
+        # Yields (offset, memoryview) pairs covering the whole image.
+        # block_size overrides the image's block size for this walk only.
+        block_size = block_size or self.block_size
+        for offset in range(0, self.size, block_size):
+            yield offset, self._view[offset:offset + block_size]
+
+
+class ImageSink:
+    # Write side of a transfer: receive_loop's on_block(offset, data) copies
+    # every block straight to its offset in a preallocated buffer, a
+    # bytearray or a memory-mapped output file, with one slice assignment
+    # (a memcpy) per block. Offsets are counted from base_address, e.g. the
+    # first segment address of a sparse image.
+    # Blocks outside the capacity raise ValueError, see receive_loop.
+
+    def __init__(self, size, file_name=None, base_address=0):
+        if size <= 0:
+            raise ValueError("size must be positive")
+        self.size = size
+        self.file_name = file_name
+        self.base_address = base_address
+        self.bytes_written = 0
+        self.extent = 0  # End of the highest block written
+        self.first_block_time = None
+        self.last_block_time = None
+        self._file = None
+        self._mmap = None
+        self._buffer = None
+        self._view = memoryview(b"")
+
+    def open(self):
+        if self.file_name is None:
+            self._buffer = bytearray(self.size)
+            self._view = memoryview(self._buffer)
+        else:
+            self._file = open(self.file_name, "w+b")
+            self._file.truncate(self.size)
+            self._mmap = mmap.mmap(self._file.fileno(), self.size)
+            self._view = memoryview(self._mmap)
+        return self
+
+    def close(self):
+        # An output file keeps what was written, up to the highest block
+        self._view.release()
+        self._view = memoryview(b"")
+        if self._mmap is not None:
+            self._mmap.flush()
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a view of the data, see FirmwareImage.close
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.truncate(self.extent)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def on_block(self, offset, data):
+        start = offset - self.base_address
+        end = start + len(data)
+        if start < 0 or end > self.size:
+            raise ValueError(f"Block at 0x{offset:08X} ({len(data)} bytes) is outside the "
+                             f"{self.size} byte sink at 0x{self.base_address:08X}")
+        self._view[start:end] = data
+        now = time.monotonic()
+        if self.first_block_time is None:
+            self.first_block_time = now
+        self.last_block_time = now
+        self.bytes_written += len(data)
+        if end > self.extent:
+            self.extent = end
+
+    @property
+    def data(self) -> memoryview:
+        # What was received so far, without copying
+        return self._view[:self.extent]
+
+    @property
+    def bytes_per_second(self) -> float:
+        if self.first_block_time is None or self.last_block_time == self.first_block_time:
+            return 0.0
+        return self.bytes_written / (self.last_block_time - self.first_block_time)
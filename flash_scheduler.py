@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import can
+import isotp
+
+import canWithIsoTpReceiver as receiver
+import canWithIsoTpSender as sender
+from can_bus_manager import BandwidthLimiter, frame_bits, open_bus
+from firmware_stream import FirmwareImage
+from isotp_profiles import load_profiles
+
+# Flashes many ECUs concurrently from a manifest such as
+#   {
+#       "buses": {"0": {"interface": "vector", "fd": false, "bitrate_limit": 400000, "app_name": "udsWithIsoTp"}},
+#       "jobs": [
+#           {"name": "engine", "channel": 0, "txid": "0x7E0", "rxid": "0x7E8", "image": "engine.bin"},
+#           {"name": "brakes", "channel": 0, "txid": "0x7E1", "rxid": "0x7E9", "image": "brakes.bin"}
+#       ]
+#   }
+# Each ECU gets its own ISO-TP stack, ECUs on the same channel share one bus
+# and one bitrate_limit (approximate bits/s on the wire), e.g.
+#   python flash_scheduler.py manifest.json --compare-serial
+
+logger = logging.getLogger("GeneralLogger")
+ErrorLogger = logging.getLogger("ErrorLogger")
+
+default_app_name = "udsWithIsoTp"  # Vector application the channels are mapped under, as in the sender
+
+
+class BusLink:
+    # One opened bus shared by several ISO-TP stacks. A single notifier
+    # thread reads the bus and routes frames to the stack owning the
+    # arbitration id, transmissions are serialised and paced by the limiter.
+
+    def __init__(self, interface, channel, fd=False, bitrate_limit=None, app_name=default_app_name):
+        self.bus = open_bus(interface, channel, fd, app_name)
+        self.routes = {}
+        self.limiter = BandwidthLimiter(bitrate_limit) if bitrate_limit else None
+        self._send_lock = threading.Lock()
+        self.notifier = can.Notifier(self.bus, [self.route])
+
+    def route(self, msg):
+        frames = self.routes.get(msg.arbitration_id)
+        if frames is not None:
+            frames.put(msg)
+
+    def create_stack(self, txid, rxid, params) -> isotp.TransportLayer:
+        frames = queue.Queue()
+        self.routes[rxid] = frames
+
+        def rxfn(timeout):
+            try:
+                msg = frames.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            return isotp.CanMessage(arbitration_id=msg.arbitration_id, data=msg.data,
+                                    extended_id=msg.is_extended_id, is_fd=msg.is_fd,
+                                    bitrate_switch=msg.bitrate_switch)
+
+        def txfn(isotp_msg):
+            msg = can.Message(arbitration_id=isotp_msg.arbitration_id, data=isotp_msg.data,
+                              is_extended_id=isotp_msg.is_extended_id, is_fd=isotp_msg.is_fd,
+                              bitrate_switch=isotp_msg.bitrate_switch)
+            if self.limiter is not None:
+                self.limiter.acquire(frame_bits(msg))
+            with self._send_lock:
+                self.bus.send(msg)
+
+        address = isotp.Address(isotp.AddressingMode.Normal_11bits, txid=txid, rxid=rxid)
+        return isotp.TransportLayer(rxfn=rxfn, txfn=txfn, address=address, params=params)
+
+    def shutdown(self):
+        self.notifier.stop()
+        self.bus.shutdown()
+
+
+def load_manifest(file_name):
+    with open(file_name, "r") as file:
+        manifest = json.load(file)
+    buses = {str(channel): config for channel, config in manifest.get("buses", {}).items()}
+    jobs = []
+    for job in manifest["jobs"]:
+        jobs.append({
+            "name": job.get("name", job["image"]),
+            "channel": job.get("channel", 0),
+            "txid": int(str(job["txid"]), 0),
+            "rxid": int(str(job["rxid"]), 0),
+            "image": job["image"],
+        })
+    return buses, jobs
+
+
+def open_links(buses, jobs, simulated=False):
+    links = {}
+    for channel in {job["channel"] for job in jobs}:
+        config = buses.get(str(channel), {})
+        interface = "virtual" if simulated else config.get("interface", "vector")
+        links[channel] = BusLink(interface, channel, config.get("fd", False), config.get("bitrate_limit"),
+                                 config.get("app_name", default_app_name))
+    return links
+
+
+def flash_job(link, job, params) -> dict:
+    tp_layer = link.create_stack(job["txid"], job["rxid"], params)
+    tp_layer.start()
+    start = time.perf_counter()
+    try:
+        with FirmwareImage(job["image"]) as image:
+            ok = sender.send_blocks(tp_layer, image.view)
+            size = image.size
+    finally:
+        tp_layer.stop()
+    elapsed = time.perf_counter() - start
+    logger.info("%s: %s, %d bytes in %.2f s", job["name"], "done" if ok else "FAILED", size, elapsed)
+    return {"name": job["name"], "ok": ok, "bytes": size, "seconds": elapsed}
+
+
+def failed_job(job, error) -> dict:
+    ErrorLogger.error("%s: flashing failed: %s", job["name"], error)
+    return {"name": job["name"], "ok": False, "bytes": 0, "seconds": 0.0, "error": str(error)}
+
+
+def run_jobs(links, jobs, params, concurrent=True):
+    # An exception fails its own job only, the other ECUs keep their results
+    start = time.perf_counter()
+    results = []
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = [executor.submit(flash_job, links[job["channel"]], job, params) for job in jobs]
+            for job, future in zip(jobs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(failed_job(job, e))
+    else:
+        for job in jobs:
+            try:
+                results.append(flash_job(links[job["channel"]], job, params))
+            except Exception as e:
+                results.append(failed_job(job, e))
+    return results, time.perf_counter() - start
+
+
+def start_simulated_ecus(buses, jobs, params):
+    # Receiver loops answering on a second virtual bus per channel
+    links = open_links(buses, jobs, simulated=True)
+    stop_event = threading.Event()
+    stacks = []
+    for job in jobs:
+        tp_layer = links[job["channel"]].create_stack(job["rxid"], job["txid"], params)
+        tp_layer.start()
+        threading.Thread(target=receiver.receive_loop, args=(tp_layer, None, stop_event), daemon=True).start()
+        stacks.append(tp_layer)
+
+    def stop():
+        stop_event.set()
+        for tp_layer in stacks:
+            tp_layer.stop()
+        for link in links.values():
+            link.shutdown()
+
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flash several ECUs in parallel")
+    parser.add_argument("manifest", help="JSON manifest of buses and (channel, txid, rxid, image) jobs")
+    parser.add_argument("--profile", default=None, help="ISO-TP profile, defaults to the sender's")
+    parser.add_argument("--compare-serial", action="store_true", help="also run the jobs one after another")
+    parser.add_argument("--simulate", action="store_true", help="use the virtual bus with simulated ECUs")
+    args = parser.parse_args()
+
+    buses, jobs = load_manifest(args.manifest)
+    params = dict(load_profiles()["profiles"][args.profile]) if args.profile else dict(sender.isotp_params)
+    params["blocking_send"] = True  # send_blocks relies on it
+    if args.simulate:
+        receiver.receive_timeout_in_seconds = 0.2
+        stop_simulation = start_simulated_ecus(buses, jobs, dict(params, blocking_send=False))
+    links = open_links(buses, jobs, simulated=args.simulate)
+    try:
+        results, wall_time = run_jobs(links, jobs, params)
+        print(f"Parallel: {len(jobs)} jobs in {wall_time:.2f} s "
+              f"(sum of job times {sum(result['seconds'] for result in results):.2f} s)")
+        for result in results:
+            print(f"  {result['name']}: {'OK' if result['ok'] else 'FAILED'} "
+                  f"{result['bytes']} bytes in {result['seconds']:.2f} s"
+                  + (f" ({result['error']})" if "error" in result else ""))
+        if args.compare_serial:
+            _, serial_time = run_jobs(links, jobs, params, concurrent=False)
+            print(f"Serial: {serial_time:.2f} s, speed-up {serial_time / wall_time:.1f}x")
+    finally:
+        for link in links.values():
+            link.shutdown()
+        if args.simulate:
+            stop_simulation()
+
+
+if __name__ == "__main__":
+    main()
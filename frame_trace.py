@@ -0,0 +1,247 @@
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import time
+from array import array
+
+import can
+
+# Binary capture of bus traffic, attached to a bus through can.Notifier.
+# Instead of one formatted log line per frame, every frame is a fixed size
+# record, so a trace is written with a few large writes and can be mapped
+# and searched without parsing text.
+#
+#   header  magic (8 bytes), record data size (u16), reserved (6 bytes)
+#   record  timestamp (f64), arbitration id (u32), flags (u8), data length (u8),
+#           channel (u16), data padded to the record data size
+#
+# All fields are little endian. The record data size is 8 for classic CAN
+# traces and 64 for CAN-FD ones. File names ending in .blf, .asc, .csv, ...
+# are written by python-can's own writers instead (see open_trace_writer).
+
+magic = b"CANTRC1\x00"
+header = struct.Struct("<8sH6x")
+classic_data_size = 8
+fd_data_size = 64
+records_per_write = 4096  # Records buffered before one file write
+python_can_extensions = (".blf", ".asc", ".csv", ".log", ".mf4", ".txt")
+
+flag_extended = 0x01
+flag_remote = 0x02
+flag_error = 0x04
+flag_fd = 0x08
+flag_bitrate_switch = 0x10
+flag_rx = 0x20
+
+
+def record_struct(data_size) -> struct.Struct:
+    return struct.Struct(f"<dIBBH{data_size}s")
+
+
+def message_flags(msg: can.Message) -> int:
+    return ((flag_extended if msg.is_extended_id else 0) | (flag_remote if msg.is_remote_frame else 0)
+            | (flag_error if msg.is_error_frame else 0) | (flag_fd if msg.is_fd else 0)
+            | (flag_bitrate_switch if msg.bitrate_switch else 0) | (flag_rx if msg.is_rx else 0))
+
+
+class TraceWriter(can.Listener):
+    # Listener packing frames into a preallocated buffer that is written out
+    # every records_per_write frames. Frames longer than the record data size
+    # are truncated, use fd=True for CAN-FD traffic.
+
+    def __init__(self, file_name, fd=False):
+        self.data_size = fd_data_size if fd else classic_data_size
+        self.record = record_struct(self.data_size)
+        self.file = open(file_name, "wb")
+        self.file.write(header.pack(magic, self.data_size))
+        self.buffer = bytearray(self.record.size * records_per_write)
+        self.buffered = 0
+        self.count = 0
+
+    def on_message_received(self, msg):
+        channel = msg.channel if isinstance(msg.channel, int) else 0
+        self.record.pack_into(self.buffer, self.buffered * self.record.size, msg.timestamp, msg.arbitration_id,
+                              message_flags(msg), len(msg.data), channel & 0xFFFF, msg.data)
+        self.buffered += 1
+        self.count += 1
+        if self.buffered == records_per_write:
+            self.file.write(self.buffer)
+            self.buffered = 0
+
+    def flush(self):
+        if self.buffered:
+            self.file.write(memoryview(self.buffer)[:self.buffered * self.record.size])
+            self.buffered = 0
+        self.file.flush()
+
+    def stop(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def open_trace_writer(file_name, fd=False) -> can.Listener:
+    # python-can writer for the formats it knows, binary trace otherwise
+    if os.path.splitext(file_name)[1].lower() in python_can_extensions:
+        return can.Logger(file_name)
+    return TraceWriter(file_name, fd)
+
+
+def start_capture(bus, file_name, fd=False):
+    # Records everything received on bus until the returned notifier is stopped
+    # and the writer's stop() is called
+    writer = open_trace_writer(file_name, fd)
+    return can.Notifier(bus, [writer]), writer
+
+
+class _Timestamps:
+    # Read-only sequence over the record timestamps, for bisect
+    def __init__(self, reader):
+        self.reader = reader
+
+    def __len__(self):
+        return len(self.reader)
+
+    def __getitem__(self, index):
+        return struct.unpack_from("<d", self.reader.view, index * self.reader.record_size)[0]
+
+
+class TraceReader:
+    # Memory-mapped binary trace. Time range lookups bisect the records
+    # directly (traces are in receive order); the first lookup by ID builds
+    # an index of record numbers per arbitration id in one pass.
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, self.data_size = header.unpack_from(self.map)
+        if file_magic != magic:
+            raise ValueError(f"{file_name} is not a binary frame trace")
+        self.record = record_struct(self.data_size)
+        self.record_size = self.record.size
+        count = (len(self.map) - header.size) // self.record_size
+        self.view = memoryview(self.map)[header.size:header.size + count * self.record_size]
+        self._id_index = None
+
+    def __len__(self):
+        return len(self.view) // self.record_size
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def message(self, index) -> can.Message:
+        timestamp, arbitration_id, flags, length, channel, data = self.record.unpack_from(
+            self.view, index * self.record_size)
+        return can.Message(timestamp=timestamp, arbitration_id=arbitration_id, data=data[:length],
+                           is_extended_id=bool(flags & flag_extended), is_remote_frame=bool(flags & flag_remote),
+                           is_error_frame=bool(flags & flag_error), is_fd=bool(flags & flag_fd),
+                           bitrate_switch=bool(flags & flag_bitrate_switch), is_rx=bool(flags & flag_rx),
+                           channel=channel, check=False)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.message(index)
+
+    def time_range(self, start=None, end=None) -> range:
+        # Record numbers with start <= timestamp <= end
+        timestamps = _Timestamps(self)
+        first = 0 if start is None else bisect.bisect_left(timestamps, start)
+        last = len(self) if end is None else bisect.bisect_right(timestamps, end)
+        return range(first, max(first, last))
+
+    def id_index(self) -> dict:
+        # arbitration id -> array of record numbers
+        if self._id_index is None:
+            index = {}
+            fields = struct.Struct(f"<8xI{self.record_size - 12}x")
+            for number, (arbitration_id,) in enumerate(fields.iter_unpack(self.view)):
+                numbers = index.get(arbitration_id)
+                if numbers is None:
+                    numbers = index[arbitration_id] = array('I')
+                numbers.append(number)
+            self._id_index = index
+        return self._id_index
+
+    def select(self, ids=None, start=None, end=None):
+        # Record numbers matching the ids (any if None) and the time range
+        window = self.time_range(start, end)
+        if ids is None:
+            return window
+        index = self.id_index()
+        selected = []
+        for arbitration_id in ids:
+            numbers = index.get(arbitration_id)
+            if numbers is None:
+                continue
+            low = bisect.bisect_left(numbers, window.start)
+            high = bisect.bisect_left(numbers, window.stop)
+            selected.extend(numbers[low:high])
+        selected.sort()
+        return selected
+
+    def filter(self, ids=None, start=None, end=None):
+        for index in self.select(ids, start, end):
+            yield self.message(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or search binary CAN frame traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="capture a bus to a trace file")
+    record.add_argument("file")
+    record.add_argument("--interface", default="vector")
+    record.add_argument("--channel", default=0)
+    record.add_argument("--fd", action="store_true")
+    record.add_argument("--duration", type=float, default=None, help="seconds, until Ctrl+C by default")
+    query = commands.add_parser("query", help="print frames of a trace file")
+    query.add_argument("file")
+    query.add_argument("--id", type=lambda text: int(text, 0), action="append", help="arbitration id, repeatable")
+    query.add_argument("--start", type=float, default=None, help="first timestamp")
+    query.add_argument("--end", type=float, default=None, help="last timestamp")
+    query.add_argument("--count", action="store_true", help="only print the number of matching frames")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        kwargs = {"app_name": "frameTrace"} if args.interface == "vector" else {}
+        with can.Bus(interface=args.interface, channel=args.channel, fd=args.fd, **kwargs) as bus:
+            notifier, writer = start_capture(bus, args.file, args.fd)
+            deadline = None if args.duration is None else time.monotonic() + args.duration
+            try:
+                while deadline is None or time.monotonic() < deadline:
+                    time.sleep(0.1)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                notifier.stop()
+                writer.stop()
+        return
+
+    with TraceReader(args.file) as reader:
+        start = time.perf_counter()
+        selected = reader.select(args.id, args.start, args.end)
+        elapsed = time.perf_counter() - start
+        if args.count:
+            print(f"{len(selected)} of {len(reader)} frames ({elapsed:.3f} s)")
+            return
+        for index in selected:
+            print(reader.message(index))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import bisect
+import zlib
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant
+
+from image_loader import SparseImage
+
+bytes_per_row = 16
+rows_per_fetch = 4096  # Rows made known to the view at a time
+crc_chunk_size = 1024 * 1024
+
+
+class HexTableModel(QAbstractTableModel):
+    # Table model over a memory-mapped FirmwareImage, or a SparseImage whose
+    # segments are shown at their addresses, each one starting a new row.
+    # Only the rows Qt asks for (the visible ones) are ever formatted, and
+    # rows are announced to the view in batches as the user scrolls
+    # (fetchMore), so the cost of showing a file does not depend on its size.
+    headers = ("Offset", "Hex", "ASCII")
+    _ascii_table = bytes(b if 0x20 <= b < 0x7F else 0x2E for b in range(256))  # Non printable -> '.'
+
+    def __init__(self, image=None, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.segment_rows = None  # First row of every segment of a SparseImage
+        self.rows = 0
+        self.loaded_rows = 0
+        if image is not None:
+            self.set_image(image)
+
+    def set_image(self, image):
+        self.beginResetModel()
+        self.image = image
+        self.segment_rows = None
+        if image is None:
+            self.rows = 0
+        elif isinstance(image, SparseImage):
+            self.segment_rows = []
+            self.rows = 0
+            for segment in image:
+                self.segment_rows.append(self.rows)
+                self.rows += (len(segment.data) + bytes_per_row - 1) // bytes_per_row
+        else:
+            self.rows = (image.size + bytes_per_row - 1) // bytes_per_row
+        self.loaded_rows = min(rows_per_fetch, self.total_rows())
+        self.endResetModel()
+
+    def total_rows(self):
+        return self.rows
+
+    def row(self, row):
+        # (address, bytes) of a row; a flat image's address is the file offset
+        if self.segment_rows is None:
+            offset = row * bytes_per_row
+            return offset, self.image.read(offset, bytes_per_row)
+        index = bisect.bisect_right(self.segment_rows, row) - 1
+        segment = self.image.segments[index]
+        offset = (row - self.segment_rows[index]) * bytes_per_row
+        return segment.address + offset, bytes(segment.data[offset:offset + bytes_per_row])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded_rows
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded_rows < self.total_rows()
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(rows_per_fetch, self.total_rows() - self.loaded_rows)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded_rows, self.loaded_rows + count - 1)
+        self.loaded_rows += count
+        self.endInsertRows()
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            if section == 0 and self.segment_rows is not None:
+                return "Address"
+            return self.headers[section]
+        return QVariant()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid() or self.image is None:
+            return QVariant()
+        address, row = self.row(index.row())
+        if index.column() == 0:
+            return f"{address:08X}"
+        if index.column() == 1:
+            return row.hex(" ").upper()
+        return row.translate(self._ascii_table).decode("ascii")
+
+
+def image_crc32(image) -> int:
+    # CRC32 of the whole image, computed straight from the mapping; for a
+    # SparseImage over the segment data in address order, what gets flashed
+    if isinstance(image, SparseImage):
+        chunks = (segment.data for segment in image)
+    else:
+        chunks = (chunk for _, chunk in image.blocks(crc_chunk_size))
+    crc = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+    return crc
@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+# Loads Intel HEX, Motorola S-record and ELF files into a sparse image: a
+# sorted list of segments (address + data) holding only the populated
+# address ranges, with adjacent records merged. Transfers send segment by
+# segment, so the gaps between them never go on the bus.
+#
+# Text formats are parsed line by line, ELF files through mmap. Parsed
+# images are cached on disk keyed by a hash of the file content, so loading
+# the same file again only costs hashing and reading it back:
+#   python image_loader.py firmware.hex       print the segments
+
+cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "can_image_loader")
+max_cache_files = 32  # Least recently used cache files beyond this are removed
+cache_magic = b"SPARSE1\x00"
+cache_header = struct.Struct("<8sIQ")  # magic, segment count, entry point
+cache_segment = struct.Struct("<QQ")  # address, length
+hash_chunk_size = 1024 * 1024
+
+ihex_extensions = (".hex", ".ihex", ".ihx")
+srec_extensions = (".s19", ".s28", ".s37", ".srec", ".mot")
+elf_extensions = (".elf", ".axf", ".out")
+file_formats = ("ihex", "srec", "elf")
+
+
+class Segment:
+    __slots__ = ("address", "data")
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+    @property
+    def end(self):
+        return self.address + len(self.data)
+
+    def __repr__(self):
+        return f"Segment(0x{self.address:08X}, {len(self.data)} bytes)"
+
+
+class SparseImage:
+    # Populated address ranges of a firmware image, sorted by address
+
+    def __init__(self, segments, entry_point=None):
+        self.segments = segments
+        self.entry_point = entry_point
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self):
+        return len(self.segments)
+
+    @property
+    def size(self):
+        # Populated bytes, what a transfer sends
+        return sum(len(segment.data) for segment in self.segments)
+
+    @property
+    def span(self):
+        # First to last populated address, what a flat image would send
+        return self.segments[-1].end - self.segments[0].address if self.segments else 0
+
+
+class _SegmentBuilder:
+    # Collects records, appending each one to the previous segment when it
+    # continues it (the usual case) and sorting/merging the rest at the end
+
+    def __init__(self):
+        self.segments = []
+        self.address = None
+        self.data = bytearray()
+
+    def add(self, address, data):
+        if self.address is None or address != self.address + len(self.data):
+            self._flush()
+            self.address = address
+        self.data += data
+
+    def _flush(self):
+        if self.data:
+            self.segments.append(Segment(self.address, bytes(self.data)))
+        self.data = bytearray()
+
+    def finish(self, entry_point=None) -> SparseImage:
+        self._flush()
+        self.segments.sort(key=lambda segment: segment.address)
+        merged = []
+        for segment in self.segments:
+            if merged and segment.address < merged[-1].end:
+                raise ValueError(f"Overlapping records at 0x{segment.address:08X}")
+            if merged and segment.address == merged[-1].end:
+                merged[-1] = Segment(merged[-1].address, merged[-1].data + segment.data)
+            else:
+                merged.append(segment)
+        return SparseImage(merged, entry_point)
+
+
+def parse_ihex(lines) -> SparseImage:
+    builder = _SegmentBuilder()
+    base = 0  # From extended segment (02) / linear (04) address records
+    entry_point = None
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1] != b":":
+            raise ValueError(f"Line {number}: not an Intel HEX record")
+        record = bytes.fromhex(line[1:].decode("ascii"))
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise ValueError(f"Line {number}: bad record length")
+        if sum(record) & 0xFF:
+            raise ValueError(f"Line {number}: bad checksum")
+        record_type = record[3]
+        if record_type == 0x00:
+            builder.add(base + ((record[1] << 8) | record[2]), record[4:-1])
+        elif record_type == 0x01:
+            break
+        elif record_type == 0x02:
+            base = int.from_bytes(record[4:6], "big") << 4
+        elif record_type == 0x04:
+            base = int.from_bytes(record[4:6], "big") << 16
+        elif record_type in (0x03, 0x05):
+            entry_point = int.from_bytes(record[4:-1], "big")
+    return builder.finish(entry_point)
+
+
+# S-record type -> address length in bytes
+_srec_data_records = {ord("1"): 2, ord("2"): 3, ord("3"): 4}
+_srec_start_records = {ord("7"): 4, ord("8"): 3, ord("9"): 2}
+
+
+def parse_srec(lines) -> SparseImage:
+    builder = _SegmentBuilder()
+    entry_point = None
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1] != b"S" or len(line) < 4:
+            raise ValueError(f"Line {number}: not an S-record")
+        record = bytes.fromhex(line[2:].decode("ascii"))
+        if len(record) != record[0] + 1:
+            raise ValueError(f"Line {number}: bad record length")
+        if sum(record) & 0xFF != 0xFF:
+            raise ValueError(f"Line {number}: bad checksum")
+        record_type = line[1]
+        address_length = _srec_data_records.get(record_type)
+        if address_length is not None:
+            address = int.from_bytes(record[1:1 + address_length], "big")
+            builder.add(address, record[1 + address_length:-1])
+            continue
+        address_length = _srec_start_records.get(record_type)
+        if address_length is not None:
+            entry_point = int.from_bytes(record[1:1 + address_length], "big")
+        # S0 header and S5/S6 record counts carry no data
+    return builder.finish(entry_point)
+
+
+_elf_layouts = {
+    # EI_CLASS: (entry, program header offset, entry size, count), program header
+    1: ("24xI", "28xI", "42xHH", "IIIIIIII"),
+    2: ("24xQ", "32xQ", "54xHH", "IIQQQQQQ"),
+}
+pt_load = 1
+
+
+def parse_elf(view) -> SparseImage:
+    # Loadable segments at their physical (load) address; the zero-filled
+    # part of a segment (.bss, p_memsz > p_filesz) is not part of the image
+    if len(view) < 16 or view[:4] != b"\x7fELF" or view[4] not in _elf_layouts or view[5] not in (1, 2):
+        raise ValueError("Not an ELF file")
+    try:
+        return _parse_elf(view)
+    except struct.error:
+        raise ValueError("Truncated ELF file") from None
+
+
+def _parse_elf(view) -> SparseImage:
+    order = "<" if view[5] == 1 else ">"
+    entry_layout, offset_layout, count_layout, header_format = _elf_layouts[view[4]]
+    entry_point = struct.unpack_from(order + entry_layout, view)[0]
+    program_headers = struct.unpack_from(order + offset_layout, view)[0]
+    entry_size, count = struct.unpack_from(order + count_layout, view)
+    program_header = struct.Struct(order + header_format)
+    builder = _SegmentBuilder()
+    for index in range(count):
+        fields = program_header.unpack_from(view, program_headers + index * entry_size)
+        if view[4] == 1:
+            p_type, p_offset, _, p_paddr, p_filesz = fields[:5]
+        else:
+            p_type, _, p_offset, _, p_paddr, p_filesz = fields[:6]
+        if p_type == pt_load and p_filesz:
+            if p_offset + p_filesz > len(view):
+                raise ValueError(f"Segment {index} extends past the end of the file")
+            builder.add(p_paddr, view[p_offset:p_offset + p_filesz])
+    return builder.finish(entry_point)
+
+
+def image_format(file_name):
+    # "ihex", "srec", "elf", or None for a flat binary, from the extension
+    # only: a flat image may start with anything, including an ELF header
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension in ihex_extensions:
+        return "ihex"
+    if extension in srec_extensions:
+        return "srec"
+    if extension in elf_extensions:
+        return "elf"
+    return None
+
+
+def file_hash(file_name) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_name, "rb") as file:
+        while True:
+            chunk = file.read(hash_chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def _cache_file(key):
+    return os.path.join(cache_directory, key + ".segments")
+
+
+def _read_cache(key):
+    try:
+        with open(_cache_file(key), "rb") as file:
+            content = file.read()
+    except OSError:
+        return None
+    # A truncated or corrupt cache file is a cache miss, the file is parsed again
+    try:
+        magic, count, entry_point = cache_header.unpack_from(content)
+        position = cache_header.size + count * cache_segment.size
+        segments = []
+        for address, length in cache_segment.iter_unpack(content[cache_header.size:position]):
+            segments.append(Segment(address, content[position:position + length]))
+            position += length
+    except (struct.error, ValueError):
+        return None
+    if magic != cache_magic or position != len(content):
+        return None
+    try:
+        os.utime(_cache_file(key))  # Marks it as recently used
+    except OSError:
+        pass
+    return SparseImage(segments, None if entry_point == 2 ** 64 - 1 else entry_point)
+
+
+def _write_cache(key, image):
+    os.makedirs(cache_directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=cache_directory, suffix=".tmp")
+    with open(descriptor, "wb") as file:
+        file.write(cache_header.pack(cache_magic, len(image),
+                                     2 ** 64 - 1 if image.entry_point is None else image.entry_point))
+        for segment in image:
+            file.write(cache_segment.pack(segment.address, len(segment.data)))
+        for segment in image:
+            file.write(segment.data)
+    os.replace(temporary, _cache_file(key))  # Readers never see a partial file
+    cached = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(cache_directory)
+                    if entry.name.endswith(".segments"))
+    for _, path in cached[:-max_cache_files]:
+        os.remove(path)
+
+
+def parse_file(file_name, file_format) -> SparseImage:
+    if file_format == "elf":
+        with open(file_name, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return parse_elf(view)
+    parse = parse_ihex if file_format == "ihex" else parse_srec
+    with open(file_name, "rb") as file:
+        return parse(file)
+
+
+def load_image(file_name, use_cache=True, file_format=None) -> SparseImage:
+    # Parses a HEX, S-record or ELF file, with the format from the file's
+    # extension (see image_format) unless file_format ("ihex", "srec", "elf")
+    # is given. Raises ValueError for flat binaries and malformed files.
+    file_format = file_format or image_format(file_name)
+    if file_format not in file_formats:
+        raise ValueError(f"{file_name} is not an Intel HEX, S-record or ELF file")
+    # The format is part of the key, the same bytes read as another format differ
+    key = f"{file_hash(file_name)}-{file_format}" if use_cache else None
+    if key is not None:
+        image = _read_cache(key)
+        if image is not None:
+            return image
+    image = parse_file(file_name, file_format)
+    if key is not None:
+        try:
+            _write_cache(key, image)
+        except OSError:
+            pass  # Caching is an optimization only
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the segments of a HEX, S-record or ELF firmware image")
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=file_formats, help="format of the file, default from its extension")
+    parser.add_argument("--no-cache", action="store_true", help="parse the file even if it is cached")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    image = load_image(args.file, use_cache=not args.no_cache, file_format=args.format)
+    elapsed = time.perf_counter() - start
+    for segment in image:
+        print(f"0x{segment.address:08X}-0x{segment.end - 1:08X} {len(segment.data)} bytes")
+    entry = "none" if image.entry_point is None else f"0x{image.entry_point:08X}"
+    print(f"{len(image)} segment(s), {image.size} bytes populated of a {image.span} byte span, "
+          f"entry point {entry}, loaded in {elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import hashlib
+import queue
+import struct
+import threading
+import zlib
+
+# Running CRC32 and SHA-256 of a transferred image, updated block by block
+# while the transfer is going on, so verifying needs no second pass over
+# the image. The digests are computed by a worker thread; the transfer loop
+# only queues the blocks (zero-copy views of immutable data).
+#
+# UDS downloads are verified with the checkMemory routine (0x0202):
+#   option record   CRC32 (u32, big endian) + SHA-256 (32 bytes) of the download
+#   status record   0x00 correct, 0x01 incorrect
+
+check_memory_routine = 0x0202
+check_memory_record = struct.Struct(">I32s")
+check_memory_ok = 0x00
+check_memory_failed = 0x01
+
+
+class RunningDigest:
+    # add(offset, data) may be called with blocks in any order (retransmitted
+    # or windowed blocks); they are hashed in image order as soon as the
+    # blocks before them are in. Data must not change until it is hashed.
+    # With by_index the blocks are numbered 0, 1, 2... instead, for callers
+    # that know a block's sequence number but not its offset in the image.
+
+    def __init__(self, sha256=True, by_index=False):
+        self.crc32 = 0
+        self.sha256 = hashlib.sha256() if sha256 else None
+        self.size = 0  # Bytes hashed, contiguous from the first block
+        self.by_index = by_index
+        self._next = 0  # Offset (or index) of the next block to hash
+        self._pending = {}  # offset (or index) -> data received ahead of _next
+        self._blocks = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="running-digest", daemon=True)
+        self._thread.start()
+
+    def add(self, offset, data):
+        self._blocks.put((offset, data))
+
+    def _hash(self, data):
+        self.crc32 = zlib.crc32(data, self.crc32)
+        if self.sha256 is not None:
+            self.sha256.update(data)  # hashlib releases the GIL on large blocks
+        self.size += len(data)
+        self._next += 1 if self.by_index else len(data)
+
+    def _run(self):
+        while True:
+            item = self._blocks.get()
+            if item is None:
+                return
+            key, data = item
+            if key != self._next:
+                if key > self._next:
+                    self._pending[key] = data
+                continue  # key < _next: a block hashed already
+            self._hash(data)
+            while self._next in self._pending:
+                self._hash(self._pending.pop(self._next))
+
+    def result(self):
+        # Waits for the queued blocks, returns (CRC32, SHA-256 digest or None)
+        if self._thread.is_alive():
+            self._blocks.put(None)
+            self._thread.join()
+        self._pending.clear()
+        return self.crc32, self.sha256.digest() if self.sha256 is not None else None
+
+
+def encode_check_memory(crc32, sha256) -> bytes:
+    return check_memory_record.pack(crc32, sha256)
+
+
+def decode_check_memory(record):
+    # Returns (CRC32, SHA-256) or None if the record is malformed
+    if len(record) != check_memory_record.size:
+        return None
+    return check_memory_record.unpack(record)
@@ -0,0 +1,128 @@
+import argparse
+import itertools
+import os
+import threading
+import time
+
+import can
+import isotp
+
+from can_bus_manager import open_bus
+from isotp_profiles import load_profile, save_profile
+
+# Sweeps ISO-TP parameters between two local stacks and stores the fastest
+# error-free combination as a profile, e.g.
+#   python isotp_autotune.py --interface virtual --activate
+# On real hardware, use two channels wired to the same bus:
+#   python isotp_autotune.py --interface vector --tx-channel 0 --rx-channel 1
+
+tx_id = 0x33
+rx_id = 0x34
+classic_lengths = (8,)
+fd_lengths = (16, 32, 64)
+default_app_name = "udsWithIsoTp"  # Vector application the channels are mapped under, as in the sender
+
+
+def candidates(stmin_values, blocksize_values, include_fd):
+    for stmin, blocksize, tx_data_length in itertools.product(stmin_values, blocksize_values, classic_lengths):
+        yield {'stmin': stmin, 'blocksize': blocksize, 'tx_data_length': tx_data_length, 'can_fd': False}
+    if include_fd:
+        for stmin, blocksize, tx_data_length in itertools.product(stmin_values, blocksize_values, fd_lengths):
+            yield {'stmin': stmin, 'blocksize': blocksize, 'tx_data_length': tx_data_length,
+                   'can_fd': True, 'bitrate_switch': True}
+
+
+def measure(candidate, base_params, interface, tx_channel, rx_channel, payload, message_count, timeout,
+            app_name=default_app_name):
+    # Returns the throughput in bytes/s, or None if any error occurred,
+    # including a bus that cannot be opened with the candidate's settings
+    params = dict(base_params, **candidate)
+    params['blocking_send'] = True
+    errors = []
+    fd = candidate['can_fd']
+    tx_bus = rx_bus = sender = receiver = None
+    received = []
+
+    def receive():
+        deadline = time.monotonic() + timeout
+        while len(received) < message_count and time.monotonic() < deadline:
+            message = receiver.recv(block=True, timeout=0.1)
+            if message is not None:
+                received.append(message)
+
+    try:
+        tx_bus = open_bus(interface, tx_channel, fd, app_name)
+        rx_bus = open_bus(interface, rx_channel, fd, app_name)
+        sender = isotp.CanStack(tx_bus, address=isotp.Address(txid=tx_id, rxid=rx_id), params=params,
+                                error_handler=errors.append)
+        receiver = isotp.CanStack(rx_bus, address=isotp.Address(txid=rx_id, rxid=tx_id), params=params,
+                                  error_handler=errors.append)
+        sender.start()
+        receiver.start()
+        receive_thread = threading.Thread(target=receive, daemon=True)
+        receive_thread.start()
+        start = time.perf_counter()
+        for _ in range(message_count):
+            sender.send(payload, send_timeout=timeout)
+        receive_thread.join(timeout)
+        elapsed = time.perf_counter() - start
+    except (can.CanError, OSError, isotp.BlockingSendFailure) as e:
+        errors.append(e)
+    finally:
+        for stack in (sender, receiver):
+            if stack is not None:
+                stack.stop()
+        for bus in (tx_bus, rx_bus):
+            if bus is not None:
+                bus.shutdown()
+
+    if errors or len(received) != message_count or any(message != payload for message in received):
+        return None
+    return len(payload) * message_count / elapsed
+
+
+def autotune(args):
+    base_params = load_profile(args.base_profile)
+    payload = os.urandom(args.message_size)
+    best = None
+    for candidate in candidates(args.stmin, args.blocksize, not args.no_fd):
+        throughput = measure(candidate, base_params, args.interface, args.tx_channel, args.rx_channel,
+                             payload, args.messages, args.timeout, args.app_name)
+        result = "errors" if throughput is None else f"{throughput / 1024:.1f} KiB/s"
+        print(f"{candidate}: {result}")
+        if throughput is not None and (best is None or throughput > best[0]):
+            best = (throughput, candidate)
+
+    if best is None:
+        print("No error-free parameter set found, profiles left unchanged.")
+        return None
+    throughput, candidate = best
+    profile = dict(base_params, **candidate)
+    save_profile(args.name, profile, make_active=args.activate)
+    print(f"Saved profile '{args.name}' ({throughput / 1024:.1f} KiB/s): {profile}")
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the fastest error-free ISO-TP parameters")
+    parser.add_argument("--interface", default="virtual")
+    parser.add_argument("--tx-channel", default="0")
+    parser.add_argument("--rx-channel", default=None, help="defaults to the tx channel")
+    parser.add_argument("--app-name", default=default_app_name, help="Vector application name of the channels")
+    parser.add_argument("--stmin", type=int, nargs="+", default=[0, 1, 2, 5])
+    parser.add_argument("--blocksize", type=int, nargs="+", default=[0, 8, 16])
+    parser.add_argument("--no-fd", action="store_true", help="only sweep classic CAN frame sizes")
+    parser.add_argument("--message-size", type=int, default=4095)
+    parser.add_argument("--messages", type=int, default=2, help="messages sent per candidate")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds allowed per candidate")
+    parser.add_argument("--base-profile", default="classic_fast", help="profile the sweep starts from")
+    parser.add_argument("--name", default="autotuned", help="name of the saved profile")
+    parser.add_argument("--activate", action="store_true", help="make the saved profile the active one")
+    args = parser.parse_args()
+    if args.rx_channel is None:
+        args.rx_channel = args.tx_channel
+    autotune(args)
+
+
+if __name__ == "__main__":
+    main()
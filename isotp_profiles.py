@@ -0,0 +1,47 @@
+import json
+import os
+
+# Named ISO-TP parameter sets shared by every entry point.
+# The profile used is, in order of precedence: the ISOTP_PROFILE environment
+# variable, the "active" entry of the profiles file, the script's default.
+# CAN-FD profiles set can_fd/bitrate_switch and a tx_data_length up to 64;
+# isotp pads the last frame up to the next valid FD length with tx_padding.
+profiles_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "isotp_profiles.json")
+profile_env_var = "ISOTP_PROFILE"
+
+
+def load_profiles(path=None) -> dict:
+    with open(path or profiles_file, "r") as file:
+        return json.load(file)
+
+
+def active_profile_name(config, default=None):
+    return os.environ.get(profile_env_var) or config.get("active") or default
+
+
+def load_profile(default=None, path=None) -> dict:
+    # Returns a copy of the selected profile's isotp params
+    config = load_profiles(path)
+    name = active_profile_name(config, default)
+    try:
+        return dict(config["profiles"][name])
+    except KeyError:
+        raise ValueError(f"Unknown ISO-TP profile: {name}")
+
+
+def save_profile(name, params, make_active=False, path=None):
+    config = load_profiles(path)
+    config["profiles"][name] = params
+    if make_active:
+        config["active"] = name
+    # Write to a temporary file first so a crash never leaves a broken config
+    temporary_file = (path or profiles_file) + ".tmp"
+    with open(temporary_file, "w") as file:
+        json.dump(config, file, indent=4)
+        file.write("\n")
+    os.replace(temporary_file, path or profiles_file)
+
+
+def profile_is_fd(params) -> bool:
+    # CAN-FD profiles need the bus opened in FD mode as well
+    return bool(params.get("can_fd", False))
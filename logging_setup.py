@@ -0,0 +1,129 @@
+import atexit
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Logging shared by every script. GeneralLogger and ErrorLogger only put
+# records on a queue; one listener thread formats them and writes them to
+# the console and to size-rotated files, so a slow console or disk never
+# stalls a CAN loop. The first script that calls setup_logging() in a
+# process chooses the file names, later calls reuse the same setup.
+#
+# Per-frame messages go through FrameLog, whose mode is chosen with the
+# CAN_FRAME_LOG environment variable (or frame_log_mode):
+#   counter  only count frames, the total is logged by flush() (default)
+#   sample   log one frame out of frame_log_sample_every
+#   rate     log at most frame_log_max_per_second frames per second
+#   all      log every frame
+
+log_format = '%(asctime)s - %(levelname)s - %(message)s'
+date_format = "%Y-%m-%d %H:%M:%S"
+max_log_bytes = 5 * 1024 * 1024  # Size at which a log file is rotated
+log_backup_count = 3  # Rotated files kept: name.log.1 ... name.log.3
+
+frame_log_env_var = "CAN_FRAME_LOG"
+frame_log_mode = "counter"
+frame_log_sample_every = 1000
+frame_log_max_per_second = 10
+
+_listener = None
+
+
+def _file_handler(file_name, level, formatter, logger_name):
+    # delay: the file is only created once something is logged
+    handler = RotatingFileHandler(file_name, maxBytes=max_log_bytes, backupCount=log_backup_count, delay=True)
+    handler.setLevel(level)
+    handler.setFormatter(formatter)
+    handler.addFilter(logging.Filter(logger_name))
+    return handler
+
+
+def _console_handler(level, formatter, logger_name):
+    handler = logging.StreamHandler()
+    handler.setLevel(level)
+    handler.setFormatter(formatter)
+    handler.addFilter(logging.Filter(logger_name))
+    return handler
+
+
+def setup_logging(log_file, error_file):
+    # Returns (GeneralLogger, ErrorLogger)
+    global _listener
+    logger = logging.getLogger("GeneralLogger")
+    error_logger = logging.getLogger("ErrorLogger")
+    if _listener is not None:
+        return logger, error_logger
+
+    formatter = logging.Formatter(log_format, datefmt=date_format)
+    records = queue.SimpleQueue()
+    logger.setLevel(logging.INFO)
+    error_logger.setLevel(logging.ERROR)
+    for target in (logger, error_logger):
+        target.addHandler(QueueHandler(records))
+        target.propagate = False
+
+    _listener = QueueListener(
+        records,
+        _console_handler(logging.INFO, formatter, "GeneralLogger"),
+        _file_handler(log_file, logging.INFO, formatter, "GeneralLogger"),
+        _console_handler(logging.ERROR, formatter, "ErrorLogger"),
+        _file_handler(error_file, logging.ERROR, formatter, "ErrorLogger"),
+        respect_handler_level=True,
+    )
+    _listener.start()
+    atexit.register(_listener.stop)  # Writes out the records still queued
+    return logger, error_logger
+
+
+def _hex_args(args):
+    return tuple(bytes(arg).hex() if isinstance(arg, (bytes, bytearray, memoryview)) else arg for arg in args)
+
+
+class FrameLog:
+    # Logging for per-frame events in hot loops. Arguments are only formatted
+    # when a record is actually emitted, bytes-like ones as hex.
+
+    def __init__(self, logger, message, mode=None, level=logging.INFO):
+        self.logger = logger
+        self.message = message
+        self.level = level
+        self.count = 0
+        self._flushed_count = 0
+        self._window_start = 0.0
+        self._window_count = 0
+        mode = mode or os.environ.get(frame_log_env_var, frame_log_mode)
+        try:
+            self.log = {"counter": self._count, "sample": self._sample,
+                        "rate": self._rate, "all": self._all}[mode]
+        except KeyError:
+            raise ValueError(f"Unknown frame log mode '{mode}'") from None
+
+    def _count(self, *args):
+        self.count += 1
+
+    def _all(self, *args):
+        self.count += 1
+        self.logger.log(self.level, self.message, *_hex_args(args))
+
+    def _sample(self, *args):
+        self.count += 1
+        if self.count % frame_log_sample_every == 0:
+            self.logger.log(self.level, self.message + " (frame %d)", *_hex_args(args), self.count)
+
+    def _rate(self, *args):
+        self.count += 1
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        if self._window_count < frame_log_max_per_second:
+            self._window_count += 1
+            self.logger.log(self.level, self.message, *_hex_args(args))
+
+    def flush(self, what="frames"):
+        # Logs how many frames went through since the previous flush
+        if self.count != self._flushed_count:
+            self.logger.info("%d %s (%d in total)", self.count - self._flushed_count, what, self.count)
+            self._flushed_count = self.count
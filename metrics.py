@@ -0,0 +1,258 @@
+import atexit
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and latency histograms for the transfer hot paths. Updating one
+# is an attribute increment (plus a perf_counter() call for timings), so
+# they stay enabled all the time; reading them is left to:
+#   CAN_METRICS_PORT=9100     JSON snapshot on http://127.0.0.1:9100/metrics
+#   CAN_STATS_INTERVAL=10     snapshot logged every 10 seconds
+#   CAN_PROFILE=flash.prof    cProfile of profiled() sections, dumped at exit
+# start_from_env() is called by the scripts' entry points.
+
+metrics_port_env_var = "CAN_METRICS_PORT"
+stats_interval_env_var = "CAN_STATS_INTERVAL"
+profile_env_var = "CAN_PROFILE"
+metrics_host = "127.0.0.1"  # The endpoint is only reachable locally
+histogram_buckets = 64  # Bucket n counts values of 2**(n-1) up to 2**n microseconds
+
+_counters = {}
+_histograms = {}
+_registry_lock = threading.Lock()
+_started = False
+_profiler = None
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    # Durations in seconds, kept as power-of-two microsecond buckets
+
+    def __init__(self, name):
+        self.name = name
+        self.buckets = [0] * histogram_buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        # 64 buckets hold any duration, so the index needs no bounds check
+        self.buckets[int(seconds * 1000000).bit_length()] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def time(self):
+        # with histogram.time(): ...
+        return _Timer(self)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the fraction-th value, in seconds
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1000000, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def counter(name) -> Counter:
+    # Returns the counter of that name, created on first use
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter(name)
+        return _counters[name]
+
+
+def histogram(name) -> Histogram:
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name)
+        return _histograms[name]
+
+
+class IsoTpMetrics:
+    # Frame level metrics of one ISO-TP endpoint, fed by its txfn/rxfn:
+    #   <prefix>.frames_tx / frames_rx        frames sent / received
+    #   <prefix>.consecutive_frame_gap        time between a consecutive frame and the frame before it
+    #   <prefix>.flow_control_wait            time from our last frame to the peer's flow control
+    #   <prefix>.<IsoTpError class>           errors reported through error_handler (timeouts, ...)
+    # The PCI type is the high nibble of the first data byte.
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.frames_tx = counter(prefix + ".frames_tx")
+        self.frames_rx = counter(prefix + ".frames_rx")
+        self.consecutive_frame_gap = histogram(prefix + ".consecutive_frame_gap")
+        self.flow_control_wait = histogram(prefix + ".flow_control_wait")
+        self.last_tx = 0.0
+
+    def on_tx(self, data):
+        now = time.perf_counter()
+        if data[0] >> 4 == 2:  # Consecutive frame
+            self.consecutive_frame_gap.observe(now - self.last_tx)
+        self.last_tx = now
+        self.frames_tx.value += 1
+
+    def on_rx(self, data):
+        self.frames_rx.value += 1
+        if data and data[0] >> 4 == 3:  # Flow control
+            self.flow_control_wait.observe(time.perf_counter() - self.last_tx)
+
+    def on_error(self, error):
+        # error_handler of isotp.TransportLayer, which logs the error itself
+        counter(self.prefix + "." + type(error).__name__).inc()
+
+
+def snapshot(prefix="") -> dict:
+    # Current values of the metrics whose name starts with prefix
+    with _registry_lock:
+        counters = [item for name, item in _counters.items() if name.startswith(prefix)]
+        histograms = [item for name, item in _histograms.items() if name.startswith(prefix)]
+    return {
+        'time': time.time(),
+        'counters': {item.name: item.value for item in counters},
+        'histograms': {item.name: item.summary() for item in histograms},
+    }
+
+
+def reset():
+    with _registry_lock:
+        for item in _counters.values():
+            item.value = 0
+        for item in _histograms.values():
+            item.__init__(item.name)
+
+
+def format_snapshot(values) -> str:
+    parts = [f"{name}={value}" for name, value in sorted(values['counters'].items()) if value]
+    for name, summary in sorted(values['histograms'].items()):
+        if summary['count']:
+            parts.append(f"{name}: n={summary['count']} p50={summary['p50'] * 1000:.3f}ms "
+                         f"p99={summary['p99'] * 1000:.3f}ms max={summary['max'] * 1000:.3f}ms")
+    return ", ".join(parts) or "no activity"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(snapshot(), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # No access log on the console
+
+
+def start_http_server(port, host=metrics_host) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_stats_dump(logger, interval, stop_event=None) -> threading.Thread:
+    # Logs a snapshot every interval seconds until stop_event is set
+    stop_event = stop_event or threading.Event()
+
+    def dump():
+        while not stop_event.wait(interval):
+            logger.info("Stats: %s", format_snapshot(snapshot()))
+
+    thread = threading.Thread(target=dump, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+
+def _dump_profile(file_name):
+    _profiler.dump_stats(file_name)
+    pstats.Stats(file_name).sort_stats("cumulative").print_stats(25)
+
+
+def start_profiling(file_name):
+    # Profiles every profiled() section of this process, written at exit
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        atexit.register(_dump_profile, file_name)
+
+
+@contextlib.contextmanager
+def profiled():
+    # Section recorded by the profiler when CAN_PROFILE is set, free otherwise
+    if _profiler is None:
+        yield
+        return
+    try:
+        _profiler.enable()
+    except ValueError:
+        # Another thread is already being profiled, cProfile allows only one
+        yield
+        return
+    try:
+        yield
+    finally:
+        _profiler.disable()
+
+
+def start_from_env(logger):
+    # Starts what the environment variables ask for, once per process
+    global _started
+    if _started:
+        return
+    _started = True
+    port = os.environ.get(metrics_port_env_var)
+    if port:
+        start_http_server(int(port))
+        logger.info("Metrics served on http://%s:%s/metrics", metrics_host, port)
+    interval = os.environ.get(stats_interval_env_var)
+    if interval:
+        start_stats_dump(logger, float(interval))
+    profile_file = os.environ.get(profile_env_var)
+    if profile_file:
+        start_profiling(profile_file)
+        logger.info("Profiling into %s", profile_file)
+    atexit.register(lambda: logger.info("Final stats: %s", format_snapshot(snapshot())))
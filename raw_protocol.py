@@ -0,0 +1,60 @@
+import struct
+
+import can
+
+# Bulk transfer of raw CAN frames between sender.py and receive.py, without
+# ISO-TP. The sender announces the transfer, then streams data frames and
+# the receiver acknowledges cumulatively instead of frame by frame.
+#
+#   control_id  sender -> receiver  START: frame count (u32), total size (u32)
+#   data_id     sender -> receiver  sequence counter (u8, frame index & 0xFF), data
+#   ack_id      receiver -> sender  frames received in order so far (u32), gap flag (u8)
+#
+# The receiver acknowledges every ack_every frames, when it notices a gap
+# (gap flag set, the sender goes back to the first missing frame) and when
+# the stream pauses, which covers the last, incomplete group of frames.
+# The sender keeps at most max_window frames unacknowledged so that the 8-bit
+# sequence counter identifies a frame without ambiguity.
+
+control_id = 0x32
+data_id = 0x33
+ack_id = 0x34
+
+ack_every = 64
+ack_idle_timeout = 0.02  # Seconds without data after which the receiver acknowledges
+max_window = 256
+
+start_message = struct.Struct(">II")
+ack_message = struct.Struct(">IB")
+
+
+def payload_per_frame(fd: bool) -> int:
+    return (64 if fd else 8) - 1
+
+
+def frame_count(total_size: int, fd: bool) -> int:
+    per_frame = payload_per_frame(fd)
+    return (total_size + per_frame - 1) // per_frame
+
+
+def encode_start(frames: int, total_size: int) -> bytes:
+    return start_message.pack(frames, total_size)
+
+
+def decode_start(data):
+    return start_message.unpack(data)
+
+
+def padded_length(length: int) -> int:
+    # CAN-FD frames only come in some lengths (12, 16, 20, 24, 32, 48, 64)
+    return can.util.dlc2len(can.util.len2dlc(length))
+
+
+def encode_ack(frames_received: int, gap=False) -> bytes:
+    return ack_message.pack(frames_received, 1 if gap else 0)
+
+
+def decode_ack(data):
+    # Returns (frames received in order, gap detected)
+    frames_received, gap = ack_message.unpack(data)
+    return frames_received, bool(gap)
@@ -1,48 +1,15 @@
+import argparse
+import collections
+import threading
+import time
 import can
-import logging
 from can.interfaces.vector.exceptions import VectorInitializationError
+import raw_protocol
+from frame_trace import open_trace_writer
+from logging_setup import FrameLog, setup_logging
 
-# Create an error-specific logger
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-
-# Create a formatter for the ErrorLogger
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-
-# Create a file handler for the ErrorLogger
-error_file_handler = logging.FileHandler("can_receive_errors.log")
-error_file_handler.setFormatter(error_formatter)
-error_file_handler.setLevel(logging.ERROR)
-
-# Create a console handler for the ErrorLogger
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(error_formatter)
-error_console_handler.setLevel(logging.ERROR)
-
-# Add both handlers to the ErrorLogger
-ErrorLogger.addHandler(error_file_handler)
-ErrorLogger.addHandler(error_console_handler)
-
-# Create a general logger for INFO-level logging
-logger = logging.getLogger("GeneralLogger")
-logger.setLevel(logging.INFO)
-
-# Create a formatter
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-
-# Create a console handler for general logging
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)
-
-# Create a file handler for general logging
-file_handler = logging.FileHandler("can_receiver.log")
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-
-# Add handlers to the general logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Logging, see logging_setup.py
+logger, ErrorLogger = setup_logging("can_receiver.log", "can_receive_errors.log")
 
 fd_flag=False
 extended_flag=False
@@ -50,56 +17,216 @@ channel_number=0
 filterFlashCommand = [{"can_id": 0x33, "can_mask": 0x7FF, "extended": False}]
 time_out_in_seconds=10
 
-try:
-    # Initialize the CAN bus with the Vector interface
-    with can.Bus(interface="vector", channel=channel_number, app_name="fileSenderApp", fd=fd_flag) as bus:
-        
-        logger.info("CAN bus initialized successfully for receiving messages.")
-
-        while True:
-
-            logger.info("Waiting to receive a CAN message...")
-            bus.set_filters(filterFlashCommand)
-            # Receive a message
-            msg = bus.recv(timeout=time_out_in_seconds)  # Adjust timeout as needed
-            if msg:
-
-                logger.info("Message received with arbitration_id=0x%X and data=%s , and hole message = %s", msg.arbitration_id, msg.data, msg)
-
-                # Send acknowledgment
-                ack_msg = can.Message(arbitration_id=msg.arbitration_id, data=[1], is_extended_id=extended_flag,is_fd=fd_flag)
-                try:
-                    bus.send(ack_msg)
-
-                    logger.info("Acknowledgment sent for message arbitration_id=0x%X", msg.arbitration_id)
-                except can.CanError as e:
-                    ErrorLogger.error("Error: CanError while sending acknowledgment: %s", e)
-
-
-            else:
-                logger.info("Timeout: No message received.")
-                break
-
-            
-
-except VectorInitializationError as e:
-    ErrorLogger.error("Error: VectorInitializationError: %s, Details: Vector CAN hardware not detected or configured incorrectly. Check connections and drivers.", e)
-
-
-except ValueError as e:
-    ErrorLogger.error("Error: ValueError due to Invalid parameter provided for CAN Bus initialization: %s", e)
-
-except OSError as e:
-    ErrorLogger.error("Error: OSError likely due to hardware or system issues: %s", e)
-
-
-except can.CanError as e:
-    ErrorLogger.error("Error: A general CAN-related issue occurred during initialization: %s", e)
-
-
-except Exception as e:
-    ErrorLogger.error("Error: Unexpected exception occurred: %s", e)
-
-
-finally:
-    logger.info("CAN receive operation complete.")
+# Bulk raw frame mode (--bulk), see raw_protocol.py
+interface = "vector"
+ring_buffer_size = 4096  # Frames buffered between the notifier thread and the receive loop
+bulk_filters = [
+    {"can_id": raw_protocol.control_id, "can_mask": 0x7FF, "extended": extended_flag},
+    {"can_id": raw_protocol.data_id, "can_mask": 0x7FF, "extended": extended_flag},
+]
+
+
+class RingBufferListener(can.Listener):
+    # Bounded buffer filled by the notifier thread. When the receive loop
+    # falls behind, new frames are dropped and counted; the sequence counter
+    # then shows the gap and the sender resends.
+
+    def __init__(self, size=None):
+        self.size = size or ring_buffer_size
+        self.frames = collections.deque()
+        self.dropped = 0
+        self._waiting = False
+        self._wakeup = threading.Event()
+
+    def on_message_received(self, msg):
+        if len(self.frames) >= self.size:
+            self.dropped += 1
+            return
+        self.frames.append(msg)
+        if self._waiting:
+            self._wakeup.set()
+
+    def get(self, timeout):
+        # Next frame, or None after timeout seconds without one
+        try:
+            return self.frames.popleft()
+        except IndexError:
+            pass
+        self._waiting = True
+        self._wakeup.clear()
+        try:
+            if self.frames or self._wakeup.wait(timeout):
+                return self.frames.popleft()
+            return None
+        finally:
+            self._waiting = False
+
+
+def receive_single(bus, trace=None):
+    # Original mode: every frame is logged and acknowledged on its own.
+    # trace: optional listener recording every received frame, see frame_trace
+    bus.set_filters(filterFlashCommand)
+    frame_log = FrameLog(logger, "Message received with arbitration_id=0x%X and data=%s, acknowledged")
+    logger.info("Waiting to receive CAN messages...")
+    while True:
+
+        # Receive a message
+        msg = bus.recv(timeout=time_out_in_seconds)  # Adjust timeout as needed
+        if msg:
+            if trace is not None:
+                trace(msg)
+
+            # Send acknowledgment
+            ack_msg = can.Message(arbitration_id=msg.arbitration_id, data=[1], is_extended_id=extended_flag,is_fd=fd_flag)
+            try:
+                bus.send(ack_msg)
+                frame_log.log(msg.arbitration_id, msg.data)
+            except can.CanError as e:
+                ErrorLogger.error("Error: CanError while sending acknowledgment: %s", e)
+
+
+        else:
+            frame_log.flush("messages received and acknowledged")
+            logger.info("Timeout: No message received.")
+            break
+
+
+def receive_bulk(bus, stop_event=None, timeout=None, trace=None) -> dict:
+    # Receives one raw bulk transfer. Returns its statistics, with the data
+    # in 'data' (None if no transfer started before the timeout).
+    # trace: optional listener also attached to the notifier, see frame_trace
+    timeout = time_out_in_seconds if timeout is None else timeout
+    bus.set_filters(bulk_filters)  # Once, not per frame
+    ring = RingBufferListener()
+    notifier = can.Notifier(bus, [ring] if trace is None else [ring, trace])
+
+    def acknowledge(gap=False):
+        bus.send(can.Message(arbitration_id=raw_protocol.ack_id, data=raw_protocol.encode_ack(expected, gap),
+                             is_extended_id=extended_flag))
+
+    data = None
+    total_frames = 0
+    total_size = 0
+    expected = 0
+    unacknowledged = 0
+    gap_reported = False
+    frames_received = 0
+    start = None
+    last_frame = time.perf_counter()
+    try:
+        while stop_event is None or not stop_event.is_set():
+            msg = ring.get(raw_protocol.ack_idle_timeout)
+            if msg is None:
+                if unacknowledged:
+                    acknowledge()  # The stream paused: acknowledge the last, incomplete group
+                    unacknowledged = 0
+                if data is not None and expected >= total_frames:
+                    break
+                if time.perf_counter() - last_frame > timeout:
+                    logger.info("Timeout: No message received.")
+                    break
+                continue
+            last_frame = time.perf_counter()
+
+            if msg.arbitration_id == raw_protocol.control_id:
+                total_frames, total_size = raw_protocol.decode_start(msg.data)
+                data = bytearray(total_size)
+                expected = unacknowledged = frames_received = 0
+                start = last_frame
+                logger.info("Bulk transfer started: %d bytes in %d frames", total_size, total_frames)
+                continue
+            if data is None:
+                continue  # Data frame of a transfer we did not see start
+
+            frames_received += 1
+            if expected < total_frames and msg.data[0] == expected & 0xFF:
+                per_frame = raw_protocol.payload_per_frame(msg.is_fd)
+                offset = expected * per_frame
+                length = min(per_frame, total_size - offset)
+                data[offset:offset + length] = msg.data[1:1 + length]
+                expected += 1
+                unacknowledged += 1
+                gap_reported = False
+                if unacknowledged >= raw_protocol.ack_every or expected == total_frames:
+                    acknowledge()
+                    unacknowledged = 0
+            elif not gap_reported:
+                # Lost or repeated frame: tell the sender where to resume, once per gap
+                acknowledge(gap=True)
+                unacknowledged = 0
+                gap_reported = True
+    finally:
+        notifier.stop()
+
+    elapsed = (last_frame - start) if start is not None else 0.0
+    stats = {
+        'ok': data is not None and expected >= total_frames,
+        'data': data,
+        'bytes': total_size,
+        'frames': total_frames,
+        'frames_received': frames_received,
+        'ring_dropped': ring.dropped,
+        'seconds': elapsed,
+        'frames_per_second': frames_received / elapsed if elapsed else 0.0,
+    }
+    if data is not None:
+        logger.info("Bulk transfer %s: %d of %d frames in order, %d received, %d dropped by the ring buffer",
+                    "complete" if stats['ok'] else "incomplete", expected, total_frames,
+                    frames_received, ring.dropped)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive raw CAN frames")
+    parser.add_argument("--bulk", action="store_true", help="receive a bulk transfer from sender.py --bulk")
+    parser.add_argument("--output", help="file the bulk transfer is written to")
+    parser.add_argument("--trace", help="record the received frames, binary trace or .blf/.asc")
+    parser.add_argument("--interface", default=interface)
+    parser.add_argument("--channel", default=channel_number)
+    args = parser.parse_args()
+    kwargs = {"app_name": "fileSenderApp"} if args.interface == "vector" else {}
+
+    try:
+        # Initialize the CAN bus with the Vector interface
+        with can.Bus(interface=args.interface, channel=args.channel, fd=fd_flag, **kwargs) as bus:
+
+            logger.info("CAN bus initialized successfully for receiving messages.")
+
+            trace = open_trace_writer(args.trace, fd_flag) if args.trace else None
+            try:
+                if args.bulk:
+                    stats = receive_bulk(bus, trace=trace)
+                    if stats['ok'] and args.output:
+                        with open(args.output, "wb") as file:
+                            file.write(stats['data'])
+                else:
+                    receive_single(bus, trace)
+            finally:
+                if trace is not None:
+                    trace.stop()
+
+    except VectorInitializationError as e:
+        ErrorLogger.error("Error: VectorInitializationError: %s, Details: Vector CAN hardware not detected or configured incorrectly. Check connections and drivers.", e)
+
+
+    except ValueError as e:
+        ErrorLogger.error("Error: ValueError due to Invalid parameter provided for CAN Bus initialization: %s", e)
+
+    except OSError as e:
+        ErrorLogger.error("Error: OSError likely due to hardware or system issues: %s", e)
+
+
+    except can.CanError as e:
+        ErrorLogger.error("Error: A general CAN-related issue occurred during initialization: %s", e)
+
+
+    except Exception as e:
+        ErrorLogger.error("Error: Unexpected exception occurred: %s", e)
+
+
+    finally:
+        logger.info("CAN receive operation complete.")
+
+
+if __name__ == "__main__":
+    main()
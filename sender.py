@@ -1,47 +1,14 @@
+import argparse
+import time
 import can
-import logging
+from can.interfaces.vector.exceptions import VectorInitializationError
+import raw_protocol
+from can_bus_manager import frame_bits, wait_until
+from firmware_stream import FirmwareImage
+from logging_setup import setup_logging
 
-# Create an error-specific logger
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-
-# Create a formatter for the ErrorLogger
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-
-# Create a file handler for the ErrorLogger
-error_file_handler = logging.FileHandler("can_sender_errors.log")
-error_file_handler.setFormatter(error_formatter)
-error_file_handler.setLevel(logging.ERROR)
-
-# Create a console handler for the ErrorLogger (prints to terminal)
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(error_formatter)
-error_console_handler.setLevel(logging.ERROR)
-
-# Add both handlers to the ErrorLogger
-ErrorLogger.addHandler(error_file_handler)
-ErrorLogger.addHandler(error_console_handler)
-
-# Create a general logger for INFO-level logging
-logger = logging.getLogger("GeneralLogger")
-logger.setLevel(logging.INFO)
-
-# Create a formatter
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-
-# Create a console handler for general logging
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-console_handler.setLevel(logging.INFO)
-
-# Create a file handler for general logging
-file_handler = logging.FileHandler("can_sender.log")
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.INFO)
-
-# Add handlers to the general logger
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Logging, see logging_setup.py
+logger, ErrorLogger = setup_logging("can_sender.log", "can_sender_errors.log")
 
 fd_flag=False
 extended_flag=False
@@ -50,65 +17,186 @@ message_id = 0x33
 retries = 3  # Number of retries
 time_out_in_seconds=5
 
-try:
-    # Initialize CAN bus
-    with can.Bus(interface="vector", channel=channel_number, app_name="fileSenderApp",fd=fd_flag) as bus:
-        print("CAN bus initialized successfully.")
-        logger.info("CAN bus initialized successfully.")
-        bus.set_filters([{"can_id": message_id, "can_mask": 0x7FF, "extended": extended_flag}])
-        # Message to be sent
-        msg = can.Message(arbitration_id=message_id, data=[0, 25, 0, 1, 3, 1, 4, 1], is_extended_id=extended_flag,is_fd=fd_flag)
-
-        acknowledgment_received = False
-
-
-        while not acknowledgment_received and retries > 0:
-            try:
-                # Send the CAN message
-                bus.send(msg)
-                print(f"Message sent: {msg}")
-                logger.info("Message sent with arbitration_id=0x%X and data=%s", msg.arbitration_id, msg.data)
-
-                # Wait for acknowledgment
-                ack = bus.recv(timeout=time_out_in_seconds)  # Wait for acknowledgment
-                if ack :  # Acknowledgment message ID
-                    print("Acknowledgment received.")
-                    logger.info("Acknowledgment received for arbitration_id=0x%X", ack.arbitration_id)
-                    acknowledgment_received = True
-                else:
-                    print("No acknowledgment received. Retrying...")
-                    logger.warning("No acknowledgment received. Retrying...")
-                    retries -= 1
-
-            except can.CanError as e:
-                ErrorLogger.error("CanError while sending a message: %s", e)
-                print(f"Error: Failed to send CAN message: {e}")
-                retries -= 1
-
-        if not acknowledgment_received:
-            print("Message transmission failed after retries.")
-            ErrorLogger.error("Message transmission failed after retries.")
-            
-
-except can.interfaces.vector.exceptions.VectorInitializationError as e:
-    ErrorLogger.error("Error: VectorInitializationError: %s , Details: Vector CAN hardware not detected or configured incorrectly. Check connections and drivers.", e)
-
-
-except ValueError as e:
-    ErrorLogger.error("Error: Invalid parameter provided for CAN Bus initialization: %s", e)
-   
-
-except OSError as e:
-    ErrorLogger.error("Error: OSError likely due to hardware or system issues: %s", e)
-
-
-except can.CanError as e:
-    ErrorLogger.error("Error: A general CAN-related issue occurred %s", e)
-
-
-except Exception as e:
-    ErrorLogger.error("Error: Unexpected exception occurred: %s", e)
-
-
-finally:
-    logger.info("CAN operation complete.")
+# Bulk raw frame mode (--bulk FILE), see raw_protocol.py
+interface = "vector"
+bitrate = 500000  # Nominal bit rate, only used to report the bus load
+inter_frame_gap = 0.0  # Seconds between two frames, 0 sends back to back
+window_frames = raw_protocol.max_window  # Frames sent ahead of the last acknowledgment
+bulk_ack_timeout = 1.0  # Seconds without progress before going back to the last acknowledged frame
+
+
+def send_single(bus):
+    # Original stop-and-wait exchange: one frame, one acknowledgment
+    bus.set_filters([{"can_id": message_id, "can_mask": 0x7FF, "extended": extended_flag}])
+    # Message to be sent
+    msg = can.Message(arbitration_id=message_id, data=[0, 25, 0, 1, 3, 1, 4, 1], is_extended_id=extended_flag,is_fd=fd_flag)
+
+    acknowledgment_received = False
+    retries_left = retries
+
+    while not acknowledgment_received and retries_left > 0:
+        try:
+            # Send the CAN message
+            bus.send(msg)
+            print(f"Message sent: {msg}")
+            logger.info("Message sent with arbitration_id=0x%X and data=%s", msg.arbitration_id, msg.data)
+
+            # Wait for acknowledgment
+            ack = bus.recv(timeout=time_out_in_seconds)  # Wait for acknowledgment
+            if ack :  # Acknowledgment message ID
+                print("Acknowledgment received.")
+                logger.info("Acknowledgment received for arbitration_id=0x%X", ack.arbitration_id)
+                acknowledgment_received = True
+            else:
+                print("No acknowledgment received. Retrying...")
+                logger.warning("No acknowledgment received. Retrying...")
+                retries_left -= 1
+
+        except can.CanError as e:
+            ErrorLogger.error("CanError while sending a message: %s", e)
+            print(f"Error: Failed to send CAN message: {e}")
+            retries_left -= 1
+
+    if not acknowledgment_received:
+        print("Message transmission failed after retries.")
+        ErrorLogger.error("Message transmission failed after retries.")
+    return acknowledgment_received
+
+
+def send_bulk(bus, data, gap=None, fd=None) -> dict:
+    # Streams data (bytes-like) as raw frames with cumulative acknowledgments.
+    # Returns the transfer statistics, 'ok' is False if the receiver stopped
+    # acknowledging.
+    gap = inter_frame_gap if gap is None else gap
+    fd = fd_flag if fd is None else fd
+    data = memoryview(data)
+    per_frame = raw_protocol.payload_per_frame(fd)
+    frames = raw_protocol.frame_count(len(data), fd)
+    window = min(window_frames, raw_protocol.max_window)
+    bus.set_filters([{"can_id": raw_protocol.ack_id, "can_mask": 0x7FF, "extended": extended_flag}])
+
+    # Preallocated frames, refilled in place for every frame of the window
+    ring = [can.Message(arbitration_id=raw_protocol.data_id, data=bytearray(per_frame + 1),
+                        is_extended_id=extended_flag, is_fd=fd, bitrate_switch=fd)
+            for _ in range(window)]
+    bus.send(can.Message(arbitration_id=raw_protocol.control_id, data=raw_protocol.encode_start(frames, len(data)),
+                         is_extended_id=extended_flag, is_fd=fd))
+
+    acked = 0
+    next_index = 0
+    sent = 0
+    bits = 0
+    retries_left = retries
+    start = time.perf_counter()
+    next_time = start
+    while acked < frames:
+        # Transmit up to the next acknowledgment point or until the window is full
+        while next_index < frames and next_index - acked < window:
+            msg = ring[next_index % window]
+            offset = next_index * per_frame
+            chunk = data[offset:offset + per_frame]
+            if len(chunk) == per_frame:
+                msg.data[0] = next_index & 0xFF
+                msg.data[1:] = chunk
+            else:
+                last = bytearray(raw_protocol.padded_length(len(chunk) + 1) if fd else len(chunk) + 1)
+                last[0] = next_index & 0xFF
+                last[1:1 + len(chunk)] = chunk
+                msg = can.Message(arbitration_id=raw_protocol.data_id, data=last,
+                                  is_extended_id=extended_flag, is_fd=fd, bitrate_switch=fd)
+            if gap:
+                wait_until(next_time)
+                next_time = max(next_time + gap, time.perf_counter())
+            bus.send(msg)
+            bits += frame_bits(msg)
+            sent += 1
+            next_index += 1
+            if next_index % raw_protocol.ack_every == 0:
+                break
+
+        # Collect acknowledgments, waiting only when nothing more can be sent
+        must_wait = next_index >= frames or next_index - acked >= window
+        ack = bus.recv(timeout=bulk_ack_timeout if must_wait else 0)
+        if ack is None and must_wait:
+            retries_left -= 1
+            if retries_left == 0:
+                break
+            logger.warning("No acknowledgment for frame %d, resending from there", acked)
+            next_index = acked
+            continue
+        while ack is not None:
+            if ack.arbitration_id == raw_protocol.ack_id and len(ack.data) == raw_protocol.ack_message.size:
+                received, gap_detected = raw_protocol.decode_ack(ack.data)
+                if received > acked:
+                    acked = received
+                    retries_left = retries
+                if gap_detected and received < next_index:
+                    next_index = received  # Go back to the first missing frame
+            ack = bus.recv(timeout=0)
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        'ok': acked >= frames,
+        'bytes': len(data),
+        'frames': frames,
+        'frames_sent': sent,
+        'seconds': elapsed,
+        'frames_per_second': sent / elapsed if elapsed else 0.0,
+        'bus_load': bits / elapsed / bitrate if elapsed else 0.0,
+    }
+    if stats['ok']:
+        logger.info("Bulk transfer: %d bytes, %d frames (%d sent) in %.2f s, %.0f frames/s, bus load %.0f%%",
+                    len(data), frames, sent, elapsed, stats['frames_per_second'], 100 * stats['bus_load'])
+    else:
+        ErrorLogger.error("Bulk transfer failed: only %d of %d frames acknowledged", acked, frames)
+    return stats
+
+
+def send_file_bulk(bus, file_name, gap=None, fd=None) -> dict:
+    with FirmwareImage(file_name) as image:
+        return send_bulk(bus, image.view, gap, fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send raw CAN frames")
+    parser.add_argument("--bulk", metavar="FILE", help="stream FILE as raw frames with cumulative acknowledgments")
+    parser.add_argument("--gap", type=float, default=inter_frame_gap, help="seconds between frames in bulk mode")
+    parser.add_argument("--interface", default=interface)
+    parser.add_argument("--channel", default=channel_number)
+    args = parser.parse_args()
+    kwargs = {"app_name": "fileSenderApp"} if args.interface == "vector" else {}
+
+    try:
+        # Initialize CAN bus
+        with can.Bus(interface=args.interface, channel=args.channel, fd=fd_flag, **kwargs) as bus:
+            print("CAN bus initialized successfully.")
+            logger.info("CAN bus initialized successfully.")
+            if args.bulk:
+                stats = send_file_bulk(bus, args.bulk, args.gap)
+                print(f"{'OK' if stats['ok'] else 'FAILED'}: {stats['bytes']} bytes in {stats['seconds']:.2f} s, "
+                      f"{stats['frames_per_second']:.0f} frames/s, bus load {100 * stats['bus_load']:.0f}% "
+                      f"({stats['frames_sent'] - stats['frames']} frames resent)")
+            else:
+                send_single(bus)
+
+    except VectorInitializationError as e:
+        ErrorLogger.error("Error: VectorInitializationError: %s , Details: Vector CAN hardware not detected or configured incorrectly. Check connections and drivers.", e)
+
+    except ValueError as e:
+        ErrorLogger.error("Error: Invalid parameter provided for CAN Bus initialization: %s", e)
+
+    except OSError as e:
+        ErrorLogger.error("Error: OSError likely due to hardware or system issues: %s", e)
+
+    except can.CanError as e:
+        ErrorLogger.error("Error: A general CAN-related issue occurred %s", e)
+
+    except Exception as e:
+        ErrorLogger.error("Error: Unexpected exception occurred: %s", e)
+
+    finally:
+        logger.info("CAN operation complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import zlib
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from hex_viewer import HexTableModel, bytes_per_row, image_crc32
+from image_loader import Segment, SparseImage
+
+
+def sparse_image():
+    return SparseImage([Segment(0x1000, bytes(range(40))), Segment(0x08000000, b"\xAA" * 20)])
+
+
+def test_segments_start_new_rows_at_their_addresses():
+    model = HexTableModel(sparse_image())
+    assert model.total_rows() == 3 + 2
+    assert model.row(0) == (0x1000, bytes(range(16)))
+    assert model.row(2) == (0x1020, bytes(range(32, 40)))
+    assert model.row(3) == (0x08000000, b"\xAA" * bytes_per_row)
+    assert model.row(4) == (0x08000010, b"\xAA" * 4)
+    assert model.data(model.index(3, 0)) == "08000000"
+
+
+def test_sparse_crc_covers_the_segment_data_only():
+    image = sparse_image()
+    assert image_crc32(image) == zlib.crc32(bytes(range(40)) + b"\xAA" * 20)
@@ -0,0 +1,162 @@
+import os
+import struct
+
+import pytest
+
+import image_loader
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    monkeypatch.setattr(image_loader, "cache_directory", str(directory))
+    return directory
+
+
+def ihex_record(address, record_type, data=b""):
+    body = bytes((len(data), (address >> 8) & 0xFF, address & 0xFF, record_type)) + data
+    return ":" + (body + bytes(((-sum(body)) & 0xFF,))).hex().upper() + "\n"
+
+
+def srec_record(record_type, address, address_length, data=b""):
+    body = bytes((address_length + len(data) + 1,)) + address.to_bytes(address_length, "big") + data
+    return f"S{record_type}" + (body + bytes((0xFF - (sum(body) & 0xFF),))).hex().upper() + "\n"
+
+
+def elf_file(bits, byte_order, segments, entry=0x1000):
+    # ELF header and program headers followed by the segment data;
+    # segments are (type, physical address, data, memory size)
+    order = "<" if byte_order == "little" else ">"
+    header_size, entry_size = (52, 32) if bits == 32 else (64, 56)
+    ident = b"\x7fELF" + bytes((1 if bits == 32 else 2, 1 if byte_order == "little" else 2, 1)) + bytes(9)
+    offset = header_size + entry_size * len(segments)
+    headers = b""
+    content = b""
+    for p_type, address, data, memory_size in segments:
+        if bits == 32:
+            headers += struct.pack(order + "IIIIIIII", p_type, offset + len(content), address + 0x10000000,
+                                   address, len(data), memory_size, 5, 4)
+        else:
+            headers += struct.pack(order + "IIQQQQQQ", p_type, 5, offset + len(content), address + 0x10000000,
+                                   address, len(data), memory_size, 4)
+        content += data
+    if bits == 32:
+        header = ident + struct.pack(order + "HHIIIIIHHHHHH", 2, 40, 1, entry, header_size, 0, 0,
+                                     header_size, entry_size, len(segments), 0, 0, 0)
+    else:
+        header = ident + struct.pack(order + "HHIQQQIHHHHHH", 2, 40, 1, entry, header_size, 0, 0,
+                                     header_size, entry_size, len(segments), 0, 0, 0)
+    return header + headers + content
+
+
+def write(path, content):
+    path.write_bytes(content.encode("ascii") if isinstance(content, str) else content)
+    return str(path)
+
+
+def segments(image):
+    return [(segment.address, bytes(segment.data)) for segment in image]
+
+
+def test_ihex_extended_addresses_and_merged_records(tmp_path):
+    content = (ihex_record(0, 0x04, b"\x08\x00")  # Linear base 0x08000000
+               + ihex_record(0x0000, 0x00, b"\x01\x02")
+               + ihex_record(0x0002, 0x00, b"\x03\x04")  # Continues the first record
+               + ihex_record(0, 0x02, b"\x10\x00")  # Segment base 0x10000
+               + ihex_record(0x0010, 0x00, b"\xAA")
+               + ihex_record(0, 0x05, b"\x08\x00\x01\x00")
+               + ihex_record(0, 0x01))
+    image = image_loader.load_image(write(tmp_path / "firmware.hex", content))
+    assert segments(image) == [(0x10010, b"\xAA"), (0x08000000, b"\x01\x02\x03\x04")]
+    assert image.entry_point == 0x08000100
+    assert image.size == 5
+
+
+def test_srec_record_types(tmp_path):
+    content = (srec_record(0, 0, 2, b"HDR")
+               + srec_record(1, 0x1000, 2, b"\x01\x02")
+               + srec_record(2, 0x1002, 3, b"\x03")  # Continues the S1 record
+               + srec_record(3, 0x20000000, 4, b"\x04\x05")
+               + srec_record(5, 3, 2)
+               + srec_record(7, 0x20000000, 4))
+    image = image_loader.load_image(write(tmp_path / "firmware.s37", content))
+    assert segments(image) == [(0x1000, b"\x01\x02\x03"), (0x20000000, b"\x04\x05")]
+    assert image.entry_point == 0x20000000
+
+
+@pytest.mark.parametrize("bits", [32, 64])
+@pytest.mark.parametrize("byte_order", ["little", "big"])
+def test_elf_load_segments(tmp_path, bits, byte_order):
+    content = elf_file(bits, byte_order, [
+        (1, 0x8000, b"\x11" * 16, 16),
+        (4, 0x0, b"note", 4),  # PT_NOTE, not loaded
+        (1, 0x8010, b"\x22" * 8, 64),  # Adjacent, .bss part not in the image
+        (1, 0x20000, b"", 32),  # .bss only
+    ])
+    image = image_loader.load_image(write(tmp_path / "firmware.elf", content))
+    assert segments(image) == [(0x8000, b"\x11" * 16 + b"\x22" * 8)]
+    assert image.entry_point == 0x1000
+
+
+def test_truncated_elf(tmp_path):
+    content = elf_file(32, "little", [(1, 0x8000, b"\x11" * 16, 16)])
+    with pytest.raises(ValueError):
+        image_loader.load_image(write(tmp_path / "firmware.elf", content[:-4]))
+
+
+def test_overlapping_records(tmp_path):
+    content = ihex_record(0x0000, 0x00, b"\x01\x02\x03\x04") + ihex_record(0x0002, 0x00, b"\x05") \
+        + ihex_record(0, 0x01)
+    with pytest.raises(ValueError, match="Overlapping"):
+        image_loader.load_image(write(tmp_path / "firmware.hex", content))
+
+
+@pytest.mark.parametrize("name, content", [
+    ("firmware.hex", ":0400000001020304F0\n"),
+    ("firmware.s19", "S1051000010200\n"),
+])
+def test_checksum_errors(tmp_path, name, content):
+    with pytest.raises(ValueError, match="checksum"):
+        image_loader.load_image(write(tmp_path / name, content))
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("a.hex", "ihex"), ("a.IHX", "ihex"), ("a.s19", "srec"), ("a.srec", "srec"), ("a.elf", "elf"),
+    ("a.bin", None), ("firmware", None),
+])
+def test_format_from_extension(name, expected):
+    assert image_loader.image_format(name) == expected
+
+
+@pytest.mark.parametrize("start", [b"\x7fELF\x01\x01\x01", b":020000040800F2", b"S0030000FC"])
+def test_flat_binary_is_never_sniffed(tmp_path, start):
+    for name in ("firmware.bin", "firmware"):
+        file_name = write(tmp_path / name, start + os.urandom(64))
+        assert image_loader.image_format(file_name) is None
+        with pytest.raises(ValueError):
+            image_loader.load_image(file_name)
+
+
+def test_explicit_format(tmp_path):
+    content = ihex_record(0x0100, 0x00, b"\x01") + ihex_record(0, 0x01)
+    image = image_loader.load_image(write(tmp_path / "firmware", content), file_format="ihex")
+    assert segments(image) == [(0x0100, b"\x01")]
+
+
+def test_cached_reload(tmp_path, cache_directory):
+    file_name = write(tmp_path / "firmware.hex", ihex_record(0x0100, 0x00, b"\x01\x02") + ihex_record(0, 0x01))
+    first = image_loader.load_image(file_name)
+    assert len(os.listdir(cache_directory)) == 1
+    cached = image_loader.load_image(file_name)
+    assert segments(cached) == segments(first)
+    assert cached.entry_point is None
+
+
+@pytest.mark.parametrize("damage", [lambda content: content[:10], lambda content: content[:-1],
+                                    lambda content: b"garbage" + content[7:]])
+def test_corrupt_cache_is_a_miss(tmp_path, cache_directory, damage):
+    file_name = write(tmp_path / "firmware.hex", ihex_record(0x0100, 0x00, b"\x01\x02") + ihex_record(0, 0x01))
+    image_loader.load_image(file_name)
+    cache_file = cache_directory / os.listdir(cache_directory)[0]
+    cache_file.write_bytes(damage(cache_file.read_bytes()))
+    assert segments(image_loader.load_image(file_name)) == [(0x0100, b"\x01\x02")]
@@ -0,0 +1,172 @@
+import argparse
+import os
+import threading
+import time
+
+import can
+
+import can_bus_manager
+from can_bus_manager import wait_until
+from frame_trace import TraceReader, python_can_extensions
+
+# Replays a captured trace (our binary format, or ASC/BLF/... through
+# python-can's readers) onto a bus, by default a virtual one shared with a
+# simulated target in this process:
+#   python trace_replay.py field.bin --target uds-server              recorded timing
+#   python trace_replay.py field.asc --target isotp-receiver --speed 10
+#   python trace_replay.py field.bin --target uds-server --speed 0    as fast as possible
+# Frames are scheduled against the trace's own timestamps; each one is
+# decoded while waiting for its slot and sent after a sleep-then-spin wait,
+# so timing does not drift and late frames catch up instead of piling delay.
+
+replay_channel = "replay"
+
+
+def read_trace(file_name, ids=None, start=None, end=None):
+    # Yields the frames of a trace, optionally only some ids / a time range
+    if os.path.splitext(file_name)[1].lower() in python_can_extensions:
+        ids = None if ids is None else set(ids)
+        for msg in can.LogReader(file_name):
+            if ids is not None and msg.arbitration_id not in ids:
+                continue
+            if start is not None and msg.timestamp < start:
+                continue
+            if end is not None and msg.timestamp > end:
+                break
+            yield msg
+        return
+    with TraceReader(file_name) as reader:
+        yield from reader.filter(ids, start, end)
+
+
+def replay(bus, messages, speed=1.0) -> dict:
+    # speed: 1.0 recorded timing, 2.0 twice as fast, None or 0 as fast as possible.
+    # Returns frame count, duration and how late frames were sent.
+    lateness = []
+    sent = 0
+    start = None
+    first_timestamp = None
+    for msg in messages:
+        if speed:
+            if start is None:
+                start = time.perf_counter()
+                first_timestamp = msg.timestamp
+            due = start + (msg.timestamp - first_timestamp) / speed
+            wait_until(due)
+            lateness.append(time.perf_counter() - due)
+        elif start is None:
+            start = time.perf_counter()
+        bus.send(msg)
+        sent += 1
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    lateness.sort()
+    stats = {
+        'frames': sent,
+        'seconds': elapsed,
+        'frames_per_second': sent / elapsed if elapsed else 0.0,
+    }
+    if lateness:
+        stats.update(late_p50=lateness[len(lateness) // 2], late_p99=lateness[int(len(lateness) * 0.99)],
+                     late_max=lateness[-1])
+    return stats
+
+
+def wait_drained(bus, timeout=30.0):
+    # Waits until the target has read every frame queued on its virtual bus,
+    # returns the time at which it did (None if it did not within timeout)
+    pending = getattr(bus, "queue", None)
+    if pending is None:
+        return None
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if pending.empty():
+            return time.perf_counter()
+        time.sleep(0.001)
+    return None
+
+
+def start_uds_server(interface, channel):
+    import uds_server
+    bus = can.Bus(interface=interface, channel=channel)
+    connection = uds_server.create_uds_connection(bus)
+    connection.open()
+    stop_event = threading.Event()
+    uds_server.timeout_seconds = 0.5  # Notice stop_event quickly
+    thread = threading.Thread(target=uds_server.serve, args=(connection, stop_event), daemon=True)
+    thread.start()
+
+    def stop():
+        stop_event.set()
+        thread.join()
+        connection.close()
+        bus.shutdown()
+
+    return bus, stop
+
+
+def start_isotp_receiver(interface, channel):
+    import canWithIsoTpReceiver as receiver
+    can_bus_manager.default_interface = interface
+    receiver.channel_number = channel
+    receiver.receive_timeout_in_seconds = 0.5
+    bus = receiver.get_bus()
+    tp_layer = receiver.create_tp_layer()
+    stop_event = threading.Event()
+    thread = threading.Thread(target=receiver.receive_loop, args=(tp_layer, None, stop_event), daemon=True)
+    thread.start()
+
+    def stop():
+        stop_event.set()
+        thread.join()
+        tp_layer.stop()
+        can_bus_manager.bus_manager.shutdown()
+
+    return bus, stop
+
+
+targets = {
+    "uds-server": start_uds_server,
+    "isotp-receiver": start_isotp_receiver,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a CAN trace onto a (virtual) bus")
+    parser.add_argument("trace", help="binary trace (frame_trace.py) or .asc/.blf/... file")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale, 0 for as fast as possible")
+    parser.add_argument("--id", type=lambda text: int(text, 0), action="append", help="only replay this id")
+    parser.add_argument("--start", type=float, default=None, help="first trace timestamp to replay")
+    parser.add_argument("--end", type=float, default=None, help="last trace timestamp to replay")
+    parser.add_argument("--loop", type=int, default=1, help="replay the trace this many times")
+    parser.add_argument("--target", choices=sorted(targets), help="simulated receiver started in this process")
+    parser.add_argument("--interface", default="virtual")
+    parser.add_argument("--channel", default=replay_channel)
+    args = parser.parse_args()
+
+    target_bus, stop_target = (targets[args.target](args.interface, args.channel) if args.target
+                               else (None, None))
+    bus = can.Bus(interface=args.interface, channel=args.channel)
+    try:
+        for _ in range(args.loop):
+            started = time.perf_counter()
+            stats = replay(bus, read_trace(args.trace, args.id, args.start, args.end), args.speed or None)
+            line = (f"replayed {stats['frames']} frames in {stats['seconds']:.3f} s "
+                    f"({stats['frames_per_second']:,.0f} frames/s)")
+            if 'late_p50' in stats:
+                line += (f", late p50 {stats['late_p50'] * 1e6:.0f} us, p99 {stats['late_p99'] * 1e6:.0f} us, "
+                         f"max {stats['late_max'] * 1e6:.0f} us")
+            print(line)
+            if target_bus is not None:
+                drained = wait_drained(target_bus)
+                if drained is not None and stats['frames']:
+                    # The target is done once it has read the last frame
+                    print(f"target read {stats['frames']} frames in {drained - started:.3f} s "
+                          f"({stats['frames'] / (drained - started):,.0f} frames/s sustained)")
+    finally:
+        bus.shutdown()
+        if stop_target is not None:
+            stop_target()
+
+
+if __name__ == "__main__":
+    main()
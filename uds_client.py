@@ -1,20 +1,34 @@
 import can
-import logging
 from udsoncan.client import Client
 from udsoncan.connections import PythonIsoTpConnection
 import isotp  # ISO-TP for transport layer
 from udsoncan import configs
 import struct
+from isotp_profiles import load_profile, profile_is_fd
 from udsoncan import DidCodec, AsciiCodec
-from udsoncan import DataIdentifier
+from udsoncan import DataFormatIdentifier, DataIdentifier, MemoryLocation
+from udsoncan import services, Request
+from udsoncan.exceptions import NegativeResponseException
+import queue
+import threading
+from did_codecs import DidCodecRegistry
+from firmware_stream import FirmwareImage
+from image_loader import image_format, load_image
+from compression import data_format, stream_compressor
+from integrity import RunningDigest, check_memory_ok, check_memory_routine, encode_check_memory
+from logging_setup import setup_logging
+
+uint32_le = struct.Struct('<L')  # Little endian, 32-bit value
+
+
 # Define a custom codec as in the example
 class MyCustomCodecThatShiftBy4(DidCodec):
     def encode(self, val):
         val = (val << 4) & 0xFFFFFFFF  # Do some stuff
-        return struct.pack('<L', val)  # Little endian, 32-bit value
+        return uint32_le.pack(val)
 
     def decode(self, payload):
-        val = struct.unpack('<L', payload)[0]  # Decode the 32-bit value
+        val = uint32_le.unpack(payload)[0]  # Decode the 32-bit value
         return val >> 4  # Reverse the operation
 
     def __len__(self):
@@ -23,86 +37,298 @@ class MyCustomCodecThatShiftBy4(DidCodec):
 # Configuration for UDS Client
 client_config = dict(configs.default_client_config)
 
-# Define the DID and assign codecs
-client_config['data_identifiers'] = {
-    'default': '>H',                      # Default codec: 16-bit little-endian
+# Define the DID and assign codecs. The registry compiles pack strings and
+# instantiates codec classes once, udsoncan gets the ready instances.
+did_codecs = DidCodecRegistry({
+    'default': '>H',                      # Default codec: 16-bit big-endian
     0x1234: MyCustomCodecThatShiftBy4,    # Custom codec
     0x1235: MyCustomCodecThatShiftBy4(),  # Another instance of custom codec
     0xF190: AsciiCodec(15)                # ASCII codec for 15-character string
-}
-
-# Create an error-specific logger
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-
-# Error logger handlers
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-error_file_handler = logging.FileHandler("can_sender_errors.log")
-error_file_handler.setFormatter(error_formatter)
-error_console_handler = logging.StreamHandler()
-error_console_handler.setFormatter(error_formatter)
-ErrorLogger.addHandler(error_file_handler)
-ErrorLogger.addHandler(error_console_handler)
-
-# Create a general logger for INFO-level logging
-logger = logging.getLogger("GeneralLogger")
-logger.setLevel(logging.INFO)
-
-# General logger handlers
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-file_handler = logging.FileHandler("can_sender.log")
-file_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
-
-fd_flag = False
+})
+client_config['data_identifiers'] = did_codecs.config()
+
+# Logging, see logging_setup.py
+logger, ErrorLogger = setup_logging("can_sender.log", "can_sender_errors.log")
+
 extended_flag = False
 channel_number = 0
 tx_id = 0x33  # Transmitter ID
 rx_id = 0x34  # Receiver ID
 time_out_in_seconds = 5
 
-try:
-    # Initialize CAN bus
-    with can.Bus(interface="vector", channel=channel_number, app_name="UDS trial", fd=fd_flag) as bus:
-        logger.info("CAN bus initialized successfully for UDS Client.")
-        
-        address = isotp.Address(txid=tx_id, rxid=rx_id)  # ISO-TP addressing
-        # Configure ISO-TP Layer
-        stack = isotp.CanStack(bus, address=address, params={
-            'stmin': 0,  # Minimum separation time (ms)
-            'blocksize': 8,  # Block size
-            'tx_padding': 0x00,  # Padding for outgoing frames
-            'rx_flowcontrol_timeout': 1000,  # Timeout for receiving flow control messages (ms)
-            'override_receiver_stmin': 10
-        })
-
-        uds_connection = PythonIsoTpConnection(stack)
-
-        # Pass the config when initializing the UDS Client
+# Flashing configuration
+flash_file_name = None  # Image to flash, None to only read the VIN
+flash_memory_address = 0x00000000  # Start address passed in RequestDownload
+prefetch_depth = 4  # TransferData requests prepared ahead of the one on the wire
+flash_compression = None  # "zlib" or "lzma": TransferData carries a compressed stream, see compression.py
+compression_chunk_size = 64 * 1024  # Image bytes fed to the compressor at a time
+verify_downloads = True  # checkMemory routine after every download, see integrity.py
+
+# Bulk DID reads: DIDs packed per ReadDataByIdentifier request, lowered
+# automatically when the ECU rejects a request as too long
+max_dids_per_request = 64
+max_response_length = 4095
+
+# ISO-TP parameters, see isotp_profiles.json
+isotp_profile = "uds_default"  # Used unless another profile is active
+isotp_params = load_profile(isotp_profile)
+fd_flag = profile_is_fd(isotp_params)  # Bus opened in CAN-FD mode for FD profiles
+
+
+def create_uds_connection(bus, params=None) -> PythonIsoTpConnection:
+    address = isotp.Address(txid=tx_id, rxid=rx_id)  # ISO-TP addressing
+    # Configure ISO-TP Layer. blocking_send: udsoncan starts the P2 timer when
+    # send() returns, which must be once a long TransferData is on the wire
+    params = dict(params or isotp_params)
+    params['blocking_send'] = True
+    stack = isotp.CanStack(bus, address=address, params=params)
+    return PythonIsoTpConnection(stack)
+
+
+def read_vin(client):
+    # Sending a Read Data by Identifier (DID) request
+    logger.info("Sending UDS request: Read Data by Identifier (DID).")
+    response = client.read_data_by_identifier([DataIdentifier.VIN])
+    vin = response.service_data.values[DataIdentifier.VIN]  # Access the value of the DID
+    logger.info(f"VIN received: {vin}")
+    return vin
+
+
+def _next_did_batch(dids, start, limit):
+    # As many DIDs as fit in one request and its response. A DID whose codec
+    # reads all the remaining data is always requested alone.
+    batch = []
+    length = 1  # Response SID
+    for did in dids[start:start + limit]:
+        size = did_codecs.payload_size(did)
+        if size is None or length + 2 + size > max_response_length:
+            if not batch:
+                batch.append(did)
+            break
+        batch.append(did)
+        length += 2 + size
+    return batch
+
+
+def read_all_dids(client, dids=None) -> dict:
+    # ReadDataByIdentifier (0x22) for every DID with a codec, or the given
+    # ones, with as many DIDs per request as the ECU allows.
+    dids = did_codecs.dids() if dids is None else list(dids)
+    values = {}
+    limit = max_dids_per_request
+    position = 0
+    while position < len(dids):
+        batch = _next_did_batch(dids, position, limit)
+        request = Request(services.ReadDataByIdentifier, data=b''.join(did.to_bytes(2, 'big') for did in batch))
         try:
-            with Client(uds_connection, config=client_config) as client:
-                logger.info("UDS Client initialized successfully.")
-                
+            response = client.send_request(request)
+        except NegativeResponseException as e:
+            if e.response.code in (0x13, 0x14) and len(batch) > 1:
+                limit = len(batch) // 2  # The ECU accepts fewer DIDs per request
+                continue
+            if e.response.code != 0x31:
+                raise
+            logger.info("None of the DIDs %s is supported.", ", ".join(f"0x{did:04X}" for did in batch))
+        else:
+            values.update(did_codecs.decode_response(response.data))
+        position += len(batch)
+    return values
+
+
+def _transfer_blocks(data, block_length, data_format_identifier, digest=None):
+    # Yields (image bytes consumed, TransferData payload). Compressed
+    # downloads cut one compressed stream of the whole image into blocks.
+    # Every slice of the image read is also queued to digest.
+    if not data_format_identifier:
+        for offset in range(0, len(data), block_length):
+            block = data[offset:offset + block_length]
+            if digest is not None:
+                digest.add(offset, block)
+            yield min(offset + block_length, len(data)), block.tobytes()
+        return
+    compressor = stream_compressor(data_format_identifier)
+    pending = bytearray()
+    for offset in range(0, len(data), compression_chunk_size):
+        chunk = data[offset:offset + compression_chunk_size]
+        if digest is not None:
+            digest.add(offset, chunk)
+        pending += compressor.compress(chunk)
+        consumed = min(offset + compression_chunk_size, len(data))
+        while len(pending) >= block_length:
+            yield consumed, bytes(pending[:block_length])
+            del pending[:block_length]
+    pending += compressor.flush()
+    for offset in range(0, len(pending), block_length):
+        yield len(data), bytes(pending[offset:offset + block_length])
+
+
+def _prepare_transfer_requests(blocks, requests, stop_event):
+    # Producer side of the TransferData pipeline: builds (and compresses) the
+    # next requests while the client is waiting on the wire for the current one
+    sequence_number = 1
+    end = None  # What the consumer gets last: None, or the error that stopped the producer
+    try:
+        for consumed, block in blocks:
+            request = services.TransferData.make_request(sequence_number, block)
+            while not stop_event.is_set():
                 try:
-                    # Sending a Read Data by Identifier (DID) request
-                    logger.info("Sending UDS request: Read Data by Identifier (DID).")
-                    response = client.read_data_by_identifier([DataIdentifier.VIN])
-                    vin = response.service_data.values[DataIdentifier.VIN]  # Access the value of the DID
-                    print(vin)  # Should output VIN
-                    logger.info(f"VIN received: {vin}")
-                except Exception as e:
-                    ErrorLogger.error("UDS request failed: %s", e)
-                    print(f"UDS request failed: {e}")
-        except Exception as e:
-            ErrorLogger.error("Error initializing UDS Client: %s", e)
-except can.CanError as e:
-    ErrorLogger.error("CAN error occurred: %s", e)
-
-except Exception as e:
-    ErrorLogger.error("Unexpected exception: %s", e)
-
-finally:
-    logger.info("CAN UDS Client operation complete.")
+                    requests.put((sequence_number, consumed, request), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop_event.is_set():
+                return
+            sequence_number = (sequence_number + 1) & 0xFF  # Block sequence counter wraps to 0x00
+    except Exception as e:
+        end = e  # Reading or compressing failed, download() re-raises it
+    finally:
+        requests.put(end)
+
+
+def download(client, data, memory_address, progress_callback=None, compression=None) -> bool:
+    # RequestDownload (0x34) / TransferData (0x36) / RequestTransferExit (0x37)
+    # of data (a memoryview) to memory_address, in the active session.
+    # progress_callback(bytes_sent, total_bytes) is called after every block.
+    # compression ("zlib", "lzma") is announced in the dataFormatIdentifier.
+    data_format_identifier = data_format(compression)
+    memory_location = MemoryLocation(address=memory_address, memorysize=len(data),
+                                     address_format=32, memorysize_format=32)
+    response = client.request_download(memory_location, dfi=DataFormatIdentifier(
+        compression=data_format_identifier >> 4))
+    # maxNumberOfBlockLength counts the SID and the block sequence counter
+    block_length = response.service_data.max_length - 2
+    if block_length <= 0:
+        ErrorLogger.error("ECU reported an unusable maxNumberOfBlockLength: %s", response.service_data.max_length)
+        return False
+    logger.info("RequestDownload accepted: %d bytes at 0x%08X, %d bytes per block",
+                len(data), memory_address, block_length)
+
+    requests = queue.Queue(maxsize=prefetch_depth)
+    stop_event = threading.Event()
+    digest = RunningDigest() if verify_downloads else None
+    blocks = _transfer_blocks(data, block_length, data_format_identifier, digest)
+    producer = threading.Thread(target=_prepare_transfer_requests, args=(blocks, requests, stop_event), daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = requests.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                # Not the end of the image: no RequestTransferExit for a partial download
+                raise item
+            sequence_number, consumed, request = item
+            response = client.send_request(request)
+            services.TransferData.interpret_response(response)
+            if response.service_data.sequence_number_echo != sequence_number:
+                ErrorLogger.error("TransferData sequence mismatch: sent %d, ECU echoed %d",
+                                  sequence_number, response.service_data.sequence_number_echo)
+                return False
+            if progress_callback is not None:
+                progress_callback(consumed, len(data))
+    finally:
+        stop_event.set()
+        # Unblock the producer if it is waiting on a full queue
+        while producer.is_alive():
+            try:
+                requests.get_nowait()
+            except queue.Empty:
+                producer.join(0.05)
+        # Also releases the image slices still queued to the digest
+        checksums = digest.result() if digest is not None else None
+
+    client.request_transfer_exit()
+    if checksums is not None:
+        return verify_download(client, *checksums)
+    return True
+
+
+def verify_download(client, crc32, sha256) -> bool:
+    # checkMemory: the ECU compares the digests it computed while writing
+    response = client.start_routine(check_memory_routine, encode_check_memory(crc32, sha256))
+    status = response.service_data.routine_status_record
+    if status != bytes((check_memory_ok,)):
+        ErrorLogger.error("checkMemory failed: ECU reported status %s for CRC32 %08X", status.hex(), crc32)
+        return False
+    logger.info("checkMemory correct, CRC32 %08X", crc32)
+    return True
+
+
+def flash_segments(client, image, progress_callback=None, compression=None) -> bool:
+    # One download per segment of a sparse image (see image_loader), at the
+    # segment's address, so the gaps between segments are never transferred.
+    # progress_callback(bytes_sent, total_bytes) counts over all segments.
+    total = image.size
+    sent = 0
+    for segment in image:
+        def segment_progress(bytes_sent, _, done=sent):
+            if progress_callback is not None:
+                progress_callback(done + bytes_sent, total)
+
+        with memoryview(segment.data) as data:
+            if not download(client, data, segment.address, segment_progress, compression):
+                return False
+        sent += len(segment.data)
+    return True
+
+
+def flash_image(client, file_name, memory_address=None, progress_callback=None, compression=None) -> bool:
+    # Flashes a flat binary in one download at memory_address, or the
+    # segments of a HEX, S-record or ELF file at their own addresses
+    if memory_address is None:
+        memory_address = flash_memory_address
+    compression = compression or flash_compression
+    sparse_image = load_image(file_name) if image_format(file_name) is not None else None
+    client.change_session(services.DiagnosticSessionControl.Session.programmingSession)
+    logger.info("Programming session started.")
+
+    if sparse_image is not None:
+        logger.info("%s: %d bytes in %d segment(s) spanning %d bytes",
+                    file_name, sparse_image.size, len(sparse_image), sparse_image.span)
+        if not flash_segments(client, sparse_image, progress_callback, compression):
+            return False
+        logger.info("RequestTransferExit accepted, %s flashed.", file_name)
+        return True
+
+    with FirmwareImage(file_name) as image:
+        if not download(client, image.view, memory_address, progress_callback, compression):
+            return False
+    logger.info("RequestTransferExit accepted, %s flashed.", file_name)
+    return True
+
+
+def main():
+    try:
+        # Initialize CAN bus
+        with can.Bus(interface="vector", channel=channel_number, app_name="UDS trial", fd=fd_flag) as bus:
+            logger.info("CAN bus initialized successfully for UDS Client.")
+
+            uds_connection = create_uds_connection(bus)
+
+            # Pass the config when initializing the UDS Client
+            try:
+                with Client(uds_connection, config=client_config) as client:
+                    logger.info("UDS Client initialized successfully.")
+
+                    try:
+                        vin = read_vin(client)
+                        print(vin)  # Should output VIN
+                        if flash_file_name:
+                            flash_image(client, flash_file_name)
+                    except Exception as e:
+                        ErrorLogger.error("UDS request failed: %s", e)
+                        print(f"UDS request failed: {e}")
+            except Exception as e:
+                ErrorLogger.error("Error initializing UDS Client: %s", e)
+    except can.CanError as e:
+        ErrorLogger.error("CAN error occurred: %s", e)
+
+    except Exception as e:
+        ErrorLogger.error("Unexpected exception: %s", e)
+
+    finally:
+        logger.info("CAN UDS Client operation complete.")
+
+
+if __name__ == "__main__":
+    main()
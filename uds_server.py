@@ -1,31 +1,25 @@
+import argparse
+import asyncio
 import can
 import logging
+import os
+import time
 import isotp
+import metrics
 from udsoncan.connections import PythonIsoTpConnection
 from udsoncan import DidCodec
-import struct
-
-# Logging setup
-ErrorLogger = logging.getLogger("ErrorLogger")
-ErrorLogger.setLevel(logging.ERROR)
-error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-error_file_handler = logging.FileHandler("uds_server_errors.log")
-error_file_handler.setFormatter(error_formatter)
-ErrorLogger.addHandler(error_file_handler)
-
-GeneralLogger = logging.getLogger("GeneralLogger")
-GeneralLogger.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt="%Y-%m-%d %H:%M:%S")
-console_handler = logging.StreamHandler()
-file_handler = logging.FileHandler("uds_server.log")
-console_handler.setFormatter(formatter)
-file_handler.setFormatter(formatter)
-GeneralLogger.addHandler(console_handler)
-GeneralLogger.addHandler(file_handler)
+from async_transport import AsyncCanRouter, serve_uds
+from did_store import DidStore, load_did_store
+from compression import is_supported, stream_decompressor, stream_finished, uncompressed
+from integrity import RunningDigest, check_memory_failed, check_memory_ok, check_memory_routine, decode_check_memory
+from logging_setup import setup_logging
+from isotp_profiles import load_profile, profile_is_fd
+
+# Logging, see logging_setup.py
+GeneralLogger, ErrorLogger = setup_logging("uds_server.log", "uds_server_errors.log")
 
 tx_id = 0x34  # Server's transmitter ID
 rx_id = 0x33  # Server's receiver ID
-fd_flag = False
 timeout_seconds = 60
 
 # Custom Codec for VIN (Example of ASCII encoding)
@@ -42,65 +36,510 @@ class AsciiCodec(DidCodec):
     def __len__(self):
         return self.length
 
-# Simulated Data Identifiers (DIDs) and their corresponding encoded responses
+# Simulated Data Identifiers (DIDs) and their values, copied into every emulated ECU
 data_store = {
-    b'\xF1\x90': AsciiCodec(15).encode('ABCDE0123456789'),  # Example VIN response using ASCII Codec
+    0xF190: AsciiCodec(15).encode('ABCDE0123456789'),  # Example VIN response using ASCII Codec
+}
+writable_dids = frozenset((0xF190,))  # WriteDataByIdentifier needs security access
+did_store_file = None  # JSON, CSV or binary DID file replacing data_store, see did_store.py
+
+# ISO-TP parameters, see isotp_profiles.json
+isotp_profile = "uds_default"  # Used unless another profile is active
+isotp_params = load_profile(isotp_profile)
+fd_flag = profile_is_fd(isotp_params)  # Bus opened in CAN-FD mode for FD profiles
+
+# Simulated flash memory written by RequestDownload/TransferData
+max_block_length = 4095  # maxNumberOfBlockLength, includes SID and sequence counter
+max_flash_size = 16 * 1024 * 1024
+max_response_length = 4095  # Largest ISO-TP message on classic CAN
+supported_sessions = (0x01, 0x02, 0x03)  # default, programming, extended
+security_key_mask = 0xA5A5A5A5  # Simulated seed/key algorithm: key = seed XOR mask
+max_key_attempts = 3
+
+# Responses that never change are built once. isotp reads the payload lazily
+# while the frames go out, so responses must be immutable, not a reused buffer.
+session_responses = {
+    # P2 = 50 ms, P2* = 5000 ms (in 10 ms units)
+    session: bytes((0x50, session, 0x00, 0x32, 0x01, 0xF4)) for session in supported_sessions
 }
+transfer_data_responses = tuple(bytes((0x76, sequence_number)) for sequence_number in range(256))
+tester_present_response = b'\x7E\x00'
+transfer_exit_response = b'\x77'
+
+# Server loop metrics, see metrics.py
+requests_served = metrics.counter("uds_server.requests")
+negative_responses = metrics.counter("uds_server.negative_responses")
+serve_errors = metrics.counter("uds_server.errors")
+request_time = metrics.histogram("uds_server.request_time")  # Request received -> response handed to ISO-TP
+
+
+class EcuState:
+    # Everything one emulated ECU remembers between requests. The server
+    # runs one of these per diagnostic address.
+
+    def __init__(self, name="ECU", txid=None, rxid=None, dids=None):
+        self.name = name
+        self.txid = tx_id if txid is None else txid
+        self.rxid = rx_id if rxid is None else rxid
+        self.session = 0x01
+        self.download = None  # Active download: address, size, written, next_seq, decompressor, digest
+        self.last_download = None  # Finished download checked by checkMemory: address, size, digest
+        self.flash_memory = bytearray()
+        self.security_unlocked = False
+        self.seed = None
+        self.failed_key_attempts = 0
+        self.routine_results = {}
+        # Private copy so that WriteDataByIdentifier only changes this ECU
+        if dids is None:
+            dids = default_dids
+        self.dids = dids.copy() if isinstance(dids, DidStore) else DidStore(dids)
+
+    def change_session(self, session):
+        self.session = session
+        self.security_unlocked = False  # Every session transition locks the ECU again
+        self.seed = None
+        self.abort_download()  # and aborts an unfinished download
+
+    def abort_download(self):
+        if self.download is not None:
+            self.download['digest'].result()  # Ends its worker thread
+            self.download = None
+
+    def handle_request(self, request):
+        # Returns the response payload, or None when no response must be sent
+        entry = service_table[request[0]] if request else None
+        if entry is None:
+            GeneralLogger.warning("Unsupported service requested: %s", bytes(request[:1]).hex())
+            return negative_response(request[0], 0x11) if request else None  # serviceNotSupported
+        handler, sessions = entry
+        if sessions is not None and self.session not in sessions:
+            return negative_response(request[0], 0x7F)  # serviceNotSupportedInActiveSession
+        try:
+            return handler(self, request)
+        except Exception as e:
+            ErrorLogger.error("%s: error handling service 0x%02X: %s", self.name, request[0], e)
+            return negative_response(request[0], 0x10)  # generalReject
+
+
+# Service registry indexed by SID: (handler, sessions the service is allowed in)
+service_table = [None] * 256
+routine_table = {}  # Routine identifier -> (handler, session, needs security access)
+
+
+def service(sid, sessions=None):
+    def register(handler):
+        service_table[sid] = (handler, sessions)
+        return handler
+    return register
+
+
+def routine(routine_id, session=None, secured=False):
+    # The handler gets (ecu, optionRecord) and returns the routineStatusRecord,
+    # or None when the option record is not valid
+    def register(handler):
+        routine_table[routine_id] = (handler, session, secured)
+        return handler
+    return register
+
+
+def negative_response(sid, nrc) -> bytes:
+    return bytes((0x7F, sid, nrc))
+
+
+def parse_address_and_size(record):
+    # addressAndLengthFormatIdentifier followed by the address and the size,
+    # returns (address, size) or None if the record is malformed
+    if not record:
+        return None
+    memorysize_length = record[0] >> 4
+    address_length = record[0] & 0x0F
+    if memorysize_length == 0 or address_length == 0 or len(record) != 1 + address_length + memorysize_length:
+        return None
+    address = int.from_bytes(record[1:1 + address_length], 'big')
+    size = int.from_bytes(record[1 + address_length:], 'big')
+    return address, size
+
+
+@service(0x10)
+def handle_session_control(ecu, request):
+    if len(request) != 2:
+        return negative_response(0x10, 0x13)  # incorrectMessageLengthOrInvalidFormat
+    session = request[1] & 0x7F
+    if session not in supported_sessions:
+        return negative_response(0x10, 0x12)  # subFunctionNotSupported
+    ecu.change_session(session)
+    GeneralLogger.info("%s: diagnostic session changed to 0x%02X", ecu.name, session)
+    if request[1] & 0x80:
+        return None  # suppressPosRspMsgIndicationBit
+    return session_responses[session]
+
+
+@service(0x22)
+def handle_read_data_by_identifier(ecu, request):
+    count, odd = divmod(len(request) - 1, 2)
+    if count == 0 or odd:
+        return negative_response(0x22, 0x13)
+    if count == 1:
+        response = ecu.dids.responses.get((request[1] << 8) | request[2])
+        if response is None:
+            GeneralLogger.debug("%s: unsupported DID requested: %s", ecu.name, bytes(request[1:3]).hex())
+            return negative_response(0x22, 0x31)  # requestOutOfRange
+        return response
+
+    # Unsupported DIDs are left out, the request fails only if none is supported
+    records = ecu.dids.records
+    parts = [b'\x62']
+    length = 1
+    for index in range(1, len(request), 2):
+        record = records.get((request[index] << 8) | request[index + 1])
+        if record is not None:
+            parts.append(record)
+            length += len(record)
+    if length == 1:
+        return negative_response(0x22, 0x31)
+    if length > max_response_length:
+        return negative_response(0x22, 0x14)  # responseTooLong
+    return b''.join(parts)
+
+
+@service(0x27, sessions=(0x02, 0x03))
+def handle_security_access(ecu, request):
+    if len(request) < 2:
+        return negative_response(0x27, 0x13)
+    sub_function = request[1] & 0x7F
+    if sub_function == 0x01:  # requestSeed
+        if len(request) != 2:
+            return negative_response(0x27, 0x13)
+        if ecu.failed_key_attempts >= max_key_attempts:
+            return negative_response(0x27, 0x36)  # exceededNumberOfAttempts
+        if ecu.security_unlocked:
+            return b'\x67\x01\x00\x00\x00\x00'  # Already unlocked: zero seed
+        ecu.seed = int.from_bytes(os.urandom(4), 'big') or 1
+        return b'\x67\x01' + ecu.seed.to_bytes(4, 'big')
+    if sub_function == 0x02:  # sendKey
+        if len(request) != 6:
+            return negative_response(0x27, 0x13)
+        if ecu.seed is None:
+            return negative_response(0x27, 0x24)  # requestSequenceError
+        key = int.from_bytes(request[2:6], 'big')
+        expected = ecu.seed ^ security_key_mask
+        ecu.seed = None
+        if key != expected:
+            ecu.failed_key_attempts += 1
+            if ecu.failed_key_attempts >= max_key_attempts:
+                return negative_response(0x27, 0x36)
+            return negative_response(0x27, 0x35)  # invalidKey
+        ecu.security_unlocked = True
+        ecu.failed_key_attempts = 0
+        GeneralLogger.info("%s: security access granted", ecu.name)
+        return b'\x67\x02'
+    return negative_response(0x27, 0x12)
+
+
+@service(0x2E, sessions=(0x02, 0x03))
+def handle_write_data_by_identifier(ecu, request):
+    if len(request) < 4:
+        return negative_response(0x2E, 0x13)
+    did = (request[1] << 8) | request[2]
+    record = ecu.dids.records.get(did)
+    if record is None or did not in writable_dids:
+        return negative_response(0x2E, 0x31)
+    if len(request) - 3 != len(record) - 2:
+        return negative_response(0x2E, 0x13)
+    if not ecu.security_unlocked:
+        return negative_response(0x2E, 0x33)  # securityAccessDenied
+    ecu.dids.set(did, request[3:])
+    GeneralLogger.info("%s: DID 0x%04X written", ecu.name, did)
+    return bytes((0x6E, request[1], request[2]))
+
+
+@service(0x31)
+def handle_routine_control(ecu, request):
+    if len(request) < 4:
+        return negative_response(0x31, 0x13)
+    control_type = request[1] & 0x7F
+    routine_id = (request[2] << 8) | request[3]
+    entry = routine_table.get(routine_id)
+    if entry is None:
+        return negative_response(0x31, 0x31)
+    handler, session, secured = entry
+    if session is not None and ecu.session != session:
+        return negative_response(0x31, 0x22)  # conditionsNotCorrect
+    if secured and not ecu.security_unlocked:
+        return negative_response(0x31, 0x33)
+
+    if control_type == 0x01:  # startRoutine, the simulated routines finish at once
+        status = handler(ecu, request[4:])
+        if status is None:
+            return negative_response(0x31, 0x31)
+        ecu.routine_results[routine_id] = status
+    elif control_type == 0x03:  # requestRoutineResults
+        status = ecu.routine_results.get(routine_id)
+        if status is None:
+            return negative_response(0x31, 0x24)
+    else:
+        return negative_response(0x31, 0x12)  # stopRoutine is not supported
+    if request[1] & 0x80:
+        return None
+    return bytes((0x71, control_type, request[2], request[3])) + status
+
+
+@routine(0xFF00, session=0x02, secured=True)
+def erase_memory(ecu, option_record):
+    # eraseMemory: the option record is an addressAndLengthFormatIdentifier,
+    # the address and the size. Erased flash reads as 0xFF.
+    location = parse_address_and_size(option_record)
+    if location is None:
+        return None
+    address, size = location
+    if address + size > max_flash_size:
+        return None
+    if len(ecu.flash_memory) < address + size:
+        ecu.flash_memory.extend(bytes(address + size - len(ecu.flash_memory)))
+    ecu.flash_memory[address:address + size] = b'\xFF' * size
+    GeneralLogger.info("%s: erased %d bytes at 0x%08X", ecu.name, size, address)
+    return b'\x00'  # Routine completed successfully
+
+
+@routine(0xFF01, session=0x02)
+def set_image_size(ecu, option_record):
+    # Ends a delta flash: the image now spans address and size (same record
+    # as eraseMemory), memory after it is dropped when the image got shorter
+    location = parse_address_and_size(option_record)
+    if location is None:
+        return None
+    address, size = location
+    if address + size > max_flash_size:
+        return None
+    if len(ecu.flash_memory) < address + size:
+        ecu.flash_memory.extend(b'\xFF' * (address + size - len(ecu.flash_memory)))
+    del ecu.flash_memory[address + size:]
+    GeneralLogger.info("%s: image set to %d bytes at 0x%08X", ecu.name, size, address)
+    return b'\x00'
+
+
+@service(0x34)
+def handle_request_download(ecu, request):
+    if len(request) < 3:
+        return negative_response(0x34, 0x13)
+    location = parse_address_and_size(request[2:])
+    if location is None:
+        return negative_response(0x34, 0x13)
+    if ecu.session != 0x02:
+        return negative_response(0x34, 0x22)  # conditionsNotCorrect
+    if ecu.download is not None:
+        return negative_response(0x34, 0x70)  # uploadDownloadNotAccepted
+    address, size = location
+    if address + size > max_flash_size:
+        return negative_response(0x34, 0x31)  # requestOutOfRange
+    # dataFormatIdentifier: the size is the uncompressed one, TransferData
+    # carries one compressed stream that is inflated block by block
+    data_format = request[1]
+    if not is_supported(data_format):
+        return negative_response(0x34, 0x31)
+
+    if len(ecu.flash_memory) < address + size:
+        ecu.flash_memory.extend(bytes(address + size - len(ecu.flash_memory)))
+    ecu.download = {'address': address, 'size': size, 'written': 0, 'next_seq': 1,
+                    'decompressor': stream_decompressor(data_format) if data_format != uncompressed else None,
+                    'digest': RunningDigest()}
+    GeneralLogger.info("%s: RequestDownload: %d bytes at 0x%08X, dataFormatIdentifier 0x%02X",
+                       ecu.name, size, address, data_format)
+    # lengthFormatIdentifier: maxNumberOfBlockLength is sent on 2 bytes
+    return b'\x74\x20' + max_block_length.to_bytes(2, 'big')
+
+
+@service(0x36)
+def handle_transfer_data(ecu, request):
+    download = ecu.download
+    if download is None:
+        return negative_response(0x36, 0x24)  # requestSequenceError
+    if len(request) < 2 or len(request) > max_block_length:
+        return negative_response(0x36, 0x13)
+    sequence_number = request[1]
+    if sequence_number == (download['next_seq'] - 1) & 0xFF and download['written'] > 0:
+        # Repeated block after a lost response: acknowledge without rewriting
+        return transfer_data_responses[sequence_number]
+    if sequence_number != download['next_seq']:
+        return negative_response(0x36, 0x73)  # wrongBlockSequenceCounter
+
+    data = memoryview(request)[2:]
+    remaining = download['size'] - download['written']
+    if download['decompressor'] is not None:
+        # The decompressor has consumed the block even when it is rejected,
+        # a retransmission could not continue the stream: the download ends
+        try:
+            data = download['decompressor'].decompress(data, remaining + 1)
+        except Exception as e:
+            GeneralLogger.warning("%s: TransferData is not a valid compressed stream: %s", ecu.name, e)
+            ecu.abort_download()
+            return negative_response(0x36, 0x31)  # requestOutOfRange
+        if len(data) > remaining:
+            GeneralLogger.warning("%s: TransferData inflates beyond the requested size", ecu.name)
+            ecu.abort_download()
+            return negative_response(0x36, 0x71)  # transferDataSuspended
+    data_length = len(data)
+    if data_length > remaining:
+        return negative_response(0x36, 0x71)  # transferDataSuspended
+    start = download['address'] + download['written']
+    ecu.flash_memory[start:start + data_length] = data
+    download['digest'].add(download['written'], data)
+    download['written'] += data_length
+    download['next_seq'] = (sequence_number + 1) & 0xFF
+    return transfer_data_responses[sequence_number]
+
+
+@service(0x37)
+def handle_request_transfer_exit(ecu, request):
+    download = ecu.download
+    if download is None:
+        return negative_response(0x37, 0x24)
+    if download['written'] != download['size']:
+        return negative_response(0x37, 0x24)
+    if download['decompressor'] is not None and not stream_finished(download['decompressor']):
+        return negative_response(0x37, 0x24)
+    ecu.download = None
+    # The worker has kept up with the transfer, this only waits for the last block
+    download['digest'] = download['digest'].result()
+    ecu.last_download = download
+    GeneralLogger.info("%s: RequestTransferExit: %d bytes written at 0x%08X",
+                       ecu.name, download['written'], download['address'])
+    return transfer_exit_response
+
+
+@routine(check_memory_routine, session=0x02)
+def check_memory(ecu, option_record):
+    # Compares the digests computed while the last download was written
+    # with the ones the client computed while sending it
+    expected = decode_check_memory(option_record)
+    if expected is None or ecu.last_download is None:
+        return None
+    actual = ecu.last_download['digest']
+    if actual != expected:
+        ErrorLogger.error("%s: checkMemory failed for %d bytes at 0x%08X: CRC32 %08X, expected %08X", ecu.name,
+                          ecu.last_download['size'], ecu.last_download['address'], actual[0], expected[0])
+        return bytes((check_memory_failed,))
+    GeneralLogger.info("%s: checkMemory correct, CRC32 %08X", ecu.name, actual[0])
+    return bytes((check_memory_ok,))
+
+
+@service(0x3E)
+def handle_tester_present(ecu, request):
+    if len(request) != 2:
+        return negative_response(0x3E, 0x13)
+    if request[1] & 0x7F != 0x00:
+        return negative_response(0x3E, 0x12)
+    if request[1] & 0x80:
+        return None
+    return tester_present_response
+
+
+# DIDs every ECU starts with, and the ECU answering on tx_id/rx_id used by
+# serve() and handle_request()
+default_dids = load_did_store(did_store_file) if did_store_file else DidStore(data_store)
+default_ecu = EcuState()
+
+
+def handle_request(request):
+    return default_ecu.handle_request(request)
+
+
+def create_ecus(count, base_txid=tx_id, base_rxid=rx_id, stride=2, dids=None):
+    # count ECUs on consecutive address pairs: (rx_id, tx_id), (rx_id + 2, tx_id + 2), ...
+    return [EcuState(f"ECU{index}", base_txid + index * stride, base_rxid + index * stride, dids)
+            for index in range(count)]
+
+
+def create_uds_connection(bus, params=None, ecu=None) -> PythonIsoTpConnection:
+    ecu = ecu or default_ecu
+    address = isotp.Address(txid=ecu.txid, rxid=ecu.rxid)  # ISO-TP addressing
+    # Configure ISO-TP Layer
+    stack = isotp.CanStack(bus, address=address, params=params or isotp_params)
+    return PythonIsoTpConnection(stack)
+
+
+def serve(connection, stop_event=None, ecu=None):
+    ecu = ecu or default_ecu
+    GeneralLogger.info("UDS Server is now running.")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            # Receive request
+            request = connection.wait_frame(timeout=timeout_seconds)
+            if request:
+                if GeneralLogger.isEnabledFor(logging.DEBUG):
+                    GeneralLogger.debug("Received UDS request: %s", request.hex())
+                requests_served.value += 1
+                started = time.perf_counter()
+                response = ecu.handle_request(request)
+                if response is not None:
+                    if response[0] == 0x7F:
+                        negative_responses.value += 1
+                    connection.send(response)
+                request_time.observe(time.perf_counter() - started)
+            else:
+                GeneralLogger.info("Timeout: No UDS request received.")
+
+        except Exception as e:
+            serve_errors.value += 1
+            ErrorLogger.error("Unexpected error during UDS processing: %s", e)
+
+
+async def serve_ecus(bus, ecus, params=None, stop_event=None):
+    # Worker model for load tests: one event loop answers for every ECU
+    # address, each ECU has its own ISO-TP session and state
+    router = AsyncCanRouter(bus)
+    workers = [asyncio.create_task(serve_uds(router.open_session(ecu.txid, ecu.rxid, params or isotp_params),
+                                             ecu.handle_request))
+               for ecu in ecus]
+    GeneralLogger.info("UDS Server is now running for %d ECU(s).", len(ecus))
+    try:
+        if stop_event is None:
+            await asyncio.gather(*workers)
+        else:
+            await stop_event.wait()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await router.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDS server / ECU simulator")
+    parser.add_argument("--ecus", type=int, default=1,
+                        help="number of emulated ECUs, ECU n listens on rx_id + 2n and answers on tx_id + 2n")
+    parser.add_argument("--interface", default="vector")
+    parser.add_argument("--channel", default=0)
+    parser.add_argument("--dids", default=did_store_file, help="JSON, CSV or binary file with the DID values")
+    args = parser.parse_args()
+    metrics.start_from_env(GeneralLogger)
+    dids = load_did_store(args.dids) if args.dids else default_dids
+    kwargs = {"app_name": "UDS trial"} if args.interface == "vector" else {}
+    try:
+        # Initialize CAN bus
+        with can.Bus(interface=args.interface, channel=args.channel, fd=fd_flag, **kwargs) as bus:
+            GeneralLogger.info("CAN bus initialized successfully.")
+
+            if args.ecus > 1:
+                asyncio.run(serve_ecus(bus, create_ecus(args.ecus, dids=dids)))
+            else:
+                ecu = EcuState(dids=dids)
+                connection = create_uds_connection(bus, ecu=ecu)
+                connection.open()
+                try:
+                    with metrics.profiled():
+                        serve(connection, ecu=ecu)
+                finally:
+                    connection.close()
+
+    except can.CanError as e:
+        ErrorLogger.error("CAN error occurred: %s", e)
+
+    except Exception as e:
+        ErrorLogger.error("Unexpected exception: %s", e)
+
+    finally:
+        GeneralLogger.info("UDS Server operation complete.")
+
 
-try:
-    # Initialize CAN bus
-    with can.Bus(interface="vector", channel=0, app_name="UDS trial", fd=fd_flag) as bus:
-        GeneralLogger.info("CAN bus initialized successfully.")
-
-        address = isotp.Address(txid=tx_id, rxid=rx_id)  # ISO-TP addressing
-        # Configure ISO-TP Layer
-        stack = isotp.CanStack(bus, address=address, params={
-            'stmin': 0,  # Minimum separation time (ms)
-            'blocksize': 8,  # Block size
-            'tx_padding': 0x00,  # Padding for outgoing frames
-            'rx_flowcontrol_timeout': 1000,  # Timeout for receiving flow control messages (ms)
-            'override_receiver_stmin': 10
-        })
-
-        connection = PythonIsoTpConnection(stack)
-
-        GeneralLogger.info("UDS Server is now running.")
-        while True:
-            try:
-                # Receive request
-                request = connection.wait_frame(timeout=timeout_seconds)
-                if request:
-                    GeneralLogger.info("Received UDS request: %s", request.hex())
-
-                    # Handling a Read Data By Identifier (DID) Request
-                    if request.startswith(b'\x22'):  # Read Data By Identifier service (0x22)
-                        did = request[1:3]  # Extract DID
-                        GeneralLogger.info("Received Read DID request for DID: %s", did.hex())
-
-                        if did in data_store:  # Check if DID is supported
-                            response = b'\x62' + did + data_store[did]  # Positive Response (0x62)
-                            connection.send(response)
-                            GeneralLogger.info("Responded to Read DID with: %s", response.hex())
-                        else:
-                            response = b'\x7F\x22\x31'  # Negative Response: Request Out of Range
-                            connection.send(response)
-                            GeneralLogger.warning("Unsupported DID requested: %s", did.hex())
-                    else:
-                        # Negative Response: Service Not Supported
-                        response = b'\x7F' + request[:1] + b'\x11'
-                        connection.send(response)
-                        GeneralLogger.warning("Unsupported service requested: %s", request[:1].hex())
-                else:
-                    GeneralLogger.info("Timeout: No UDS request received.")
-
-            except Exception as e:
-                ErrorLogger.error("Unexpected error during UDS processing: %s", e)
-
-except can.CanError as e:
-    ErrorLogger.error("CAN error occurred: %s", e)
-
-except Exception as e:
-    ErrorLogger.error("Unexpected exception: %s", e)
-
-finally:
-    GeneralLogger.info("UDS Server operation complete.")
+if __name__ == "__main__":
+    main()